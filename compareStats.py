@@ -1,6 +1,19 @@
+import os
+
 import numpy as np
-import scripts.sbf as sbf
+import matplotlib
+# Renders the plots to files, without a display
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
+from scripts.study import hash_family_subsets, run_study, write_csv, write_json
+from scripts.sweep import SizeSweep
+
+# The metrics of the study plotted against the bit mapping, with their titles
+STUDY_PLOTS = {
+    'fpp': 'False Positive Probability',
+    'collisions': 'Number of Hash Collisions',
+    'sparsity': 'Filter Sparsity',
+}
 
 
 class CompareResults:
@@ -12,11 +25,12 @@ class CompareResults:
         self.sbf_sizes = self._create_sbfs()
 
     def _create_sbfs(self):
+        # The dataset is hashed once; the filters of every size are derived from the same digests
+        sweep = SizeSweep(self.HFS, self.MAX_SBF_SIZE)
+        sweep.insert_from_file()
+
         sizes = {}
-        for x in range(1, self.MAX_SBF_SIZE+1):
-            test = sbf.sbf(self.HFS, x)
-            test.insert_from_file()
-            test.update_stats()
+        for x, test in sweep.filters():
             if x < 10:
                 sizes["0{}".format(x)] = test
             else:
@@ -32,7 +46,7 @@ class CompareResults:
             filter_stats = test.get_stats()
             print('size {}: {}'.format(y, filter_stats['Filter False Positive Probability']))
 
-    def graph_fpp(self):
+    def graph_fpp(self, path="fpp.png"):
         objects = sorted(list(self.sbf_sizes.keys()))
 
         performance = []
@@ -47,7 +61,8 @@ class CompareResults:
         plt.xlabel('Spatial Bloom Filter Sizes')
         plt.plot(objects[:20], performance, 'bo-')
         plt.gca().invert_yaxis()
-        plt.show()
+        fig.savefig(path)
+        plt.close(fig)
 
     def hash_collision(self):
         keys = sorted(list(self.sbf_sizes.keys()))
@@ -57,7 +72,7 @@ class CompareResults:
             filter_stats = test.get_stats()
             print('size {}: {}'.format(y, filter_stats['Number of Hash Collisions']))
 
-    def graph_hash_col(self):
+    def graph_hash_col(self, path="hash_collisions.png"):
         objects = sorted(list(self.sbf_sizes.keys()))
 
         performance = []
@@ -72,7 +87,8 @@ class CompareResults:
         plt.xlabel('Spatial Bloom Filter Sizes')
         plt.plot(objects[:25], performance, 'bo-')
         plt.gca().invert_yaxis()
-        plt.show()
+        fig.savefig(path)
+        plt.close(fig)
 
     def sparsity(self):
         keys = sorted(list(self.sbf_sizes.keys()))
@@ -82,7 +98,7 @@ class CompareResults:
             filter_stats = test.get_stats()
             print('size {}: {}'.format(y, filter_stats['Filter Sparsity']))
 
-    def graph_sparsity(self):
+    def graph_sparsity(self, path="sparsity.png"):
         objects = sorted(list(self.sbf_sizes.keys()))
 
         performance = []
@@ -96,14 +112,49 @@ class CompareResults:
         plt.ylabel('Filter Sparsity')
         plt.xlabel('Spatial Bloom Filter Sizes')
         plt.plot(objects[:30], performance, 'bo-')
-        plt.show()
+        fig.savefig(path)
+        plt.close(fig)
+
+
+def plot_study(results, directory):
+    """
+    Plots each metric of STUDY_PLOTS against the bit mapping, one file per metric and dataset, one line per hash
+    family.
+    :param results: the study results, as a dictionary of columns.
+    :param directory: the directory of the PNG files.
+    :return: list of the paths of the plots.
+    """
+    paths = []
+    datasets = np.array(results['dataset'])
+    families = np.array(results['hash_family'])
+    bit_mappings = np.array(results['bit_mapping'])
+
+    for metric, title in STUDY_PLOTS.items():
+        values = np.array(results[metric], dtype=np.float64)
+        for dataset in sorted(set(results['dataset'])):
+            fig = plt.figure(num=None, figsize=(12, 8), dpi=80, facecolor='w', edgecolor='k')
+            plt.title("{} ({})".format(title, os.path.basename(dataset)))
+            plt.ylabel(title)
+            plt.xlabel('Spatial Bloom Filter Sizes')
+            for family in sorted(set(families[datasets == dataset])):
+                rows = (datasets == dataset) & (families == family)
+                plt.plot(bit_mappings[rows], values[rows], '.-', label=family)
+            if len(set(families)) <= 10:
+                plt.legend()
+
+            path = os.path.join(directory, "{}_{}.png".format(os.path.splitext(os.path.basename(dataset))[0], metric))
+            fig.savefig(path)
+            plt.close(fig)
+            paths.append(path)
+
+    return paths
 
 
 if __name__ == '__main__':
-    stats = CompareResults()
-    stats.ffp()
-    stats.graph_fpp()
-    stats.hash_collision()
-    stats.graph_hash_col()
-    stats.sparsity()
-    stats.graph_sparsity()
+    output = "study"
+    os.makedirs(output, exist_ok=True)
+
+    results = run_study(["dataset/cork.csv"], hash_family_subsets(), range(1, 33), workers=os.cpu_count())
+    write_csv(results, os.path.join(output, "study.csv"))
+    write_json(results, os.path.join(output, "study.json"))
+    plot_study(results, output)
@@ -1,49 +1,69 @@
-from flask import Flask, render_template, Markup, session, request
+import threading
+import uuid
+from collections import OrderedDict
+
+from flask import Flask, render_template, Markup, session, request, jsonify, Response
+from scripts.fragments import FragmentCache
+from scripts.heatmap import filter_heatmap, HEATMAP_MODES
 from scripts.layout import Layout
+from scripts.registry import FilterRegistry
 from scripts.sbf import sbf
+from scripts.shared import SharedFilter
 app = Flask(__name__)
 
 app.secret_key = 'spacial bloom filter'
 
 HASH_FAMILY = ['md5', 'sha1', 'sha256']
-
-format_layout = Layout(10)
-app.my_sbf = sbf(HASH_FAMILY)
+# The filters have 2^BIT_MAPPING cells
+BIT_MAPPING = 10
+# Number of processes hashing the dataset when the filter is (re)built; the Cork dataset is a single chunk, and
+# forking inside a (threaded) WSGI worker is best avoided, so the demo hashes in-process
+BUILD_WORKERS = 1
+# Seconds a worker waits for the shared filter to be built by another one before building it itself
+SHARED_FILTER_TIMEOUT = 60
+
+# Filters up to FULL_TABLE_CELLS cells are displayed whole, larger ones TABLE_WINDOW cells at a time
+FULL_TABLE_CELLS = 4096
+TABLE_WINDOW = 1024
+MAX_TABLE_WINDOW = 16384
+# Maximum width and height, in pixels, of the filter heatmap
+HEATMAP_SIZE = 256
+
+# The name of a filter of the dataset built once per host, in shared memory, and attached by every server worker
+# on import; None to build the dataset into each session filter (demo.wsgi sets it from SBF_SHARED_FILTER)
+app.config.setdefault('SHARED_FILTER', None)
+app.shared_filter = None
+app.shared_lock = threading.Lock()
+# Rendered filter table rows, by filter generation, shared by the per-request layouts
+app.table_rows = OrderedDict()
+# One filter per session, evicted least recently used first beyond the memory budget
+app.sbf_registry = FilterRegistry(memory_budget=64 * 1024 * 1024)
+# Rendered HTML fragments, keyed by session and filter generation; only the session key goes in the cookie
+app.fragment_cache = FragmentCache(max_bytes=16 * 1024 * 1024)
 
 
 @app.route('/index')
 @app.route('/')
 def index():
-    app.my_sbf = sbf(HASH_FAMILY)
+    my_sbf = _get_sbf()
+    # Clearing bumps the generation, so an empty filter is left as it is and its cached fragments stay valid
+    if my_sbf.members != 0:
+        my_sbf.clear_filter()
 
-    _set_session()
-
-    return render_template('index.html', sbf_table=Markup(session.get('sbf_table')),
-                           sbf_stats=Markup(session.get('sbf_stats')),
-                           import_message=Markup(session.get('import_message')),
-                           area_link=Markup(session.get('area_link')),
-                           check_result_table=Markup(session.get('check_result_table')),
-                           check_result_conclusion=Markup(session.get('check_result_conclusion')))
+    return _index_page()
 
 
 @app.route('/import_sbf', methods=['POST'])
 def import_sbf():
-    app.my_sbf.insert_from_file()
-    app.my_sbf.update_stats()
-
-    session['sbf_table'] = format_layout.load_table(app.my_sbf.get_filter())
-    session['sbf_stats'] = format_layout.load_stats(app.my_sbf.get_stats())
-    session['import_message'] = 'style="display: none"'
-    session['area_link'] = 'style="display: block"'
-    session['fp_values'] = format_layout.false_positive_area(app.my_sbf.find_false_positives())
-    session['incorrect_values'] = format_layout.incorrect_areas(app.my_sbf.incorrect_values())
+    my_sbf = _get_sbf()
+    dataset_sbf = _shared_dataset_sbf(my_sbf)
+    if dataset_sbf is not None:
+        app.sbf_registry.register(session['sbf_key'], dataset_sbf)
+    else:
+        my_sbf.insert_from_file(workers=BUILD_WORKERS)
+        my_sbf.update_stats()
 
-    return render_template('index.html', sbf_table=Markup(session.get('sbf_table')),
-                           sbf_stats=Markup(session.get('sbf_stats')),
-                           import_message=Markup(session.get('import_message')),
-                           area_link=Markup(session.get('area_link')),
-                           check_result_table=Markup(session.get('check_result_table')),
-                           check_result_conclusion=Markup(session.get('check_result_conclusion')))
+    return _index_page()
 
 
 @app.route('/check_sbf', methods=['POST'])
@@ -52,29 +72,25 @@ def check_sbf():
         result = request.form
         value = result['sbf_check']
 
-        check_result_table, check_result_conclusion = format_layout.load_check_result(value, app.my_sbf.check(value),
-                                                                                      app.my_sbf.incorrect_values())
-        sbf_table = format_layout.highlight_table(app.my_sbf.get_filter(), app.my_sbf.check(value))
+        my_sbf = _get_sbf()
+        check_result = my_sbf.check(value)
 
-        return render_template('index.html', sbf_table=Markup(sbf_table),
-                               sbf_stats=Markup(session.get('sbf_stats')),
-                               import_message=Markup(session.get('import_message')),
-                               area_link=Markup(session.get('area_link')),
-                               check_result_table=Markup(check_result_table),
-                               check_result_conclusion=Markup(check_result_conclusion))
+        format_layout = _layout(my_sbf)
+        check_result_table, check_result_conclusion = format_layout.load_check_result(value, check_result,
+                                                                                      my_sbf.incorrect_values())
+        if my_sbf.num_cells <= FULL_TABLE_CELLS:
+            sbf_table = format_layout.highlight_table(my_sbf.get_filter(), check_result, my_sbf.generation)
+        else:
+            sbf_table = format_layout.load_window(my_sbf.filter, 0, TABLE_WINDOW, results=check_result)
+
+        return _index_page(sbf_table, check_result_table, check_result_conclusion, value)
 
 
 @app.route('/clear_sbf', methods=['POST'])
 def clear_sbf():
-    app.my_sbf.clear_filter()
-    _set_session()
+    _get_sbf().clear_filter()
 
-    return render_template('index.html', sbf_table=Markup(session.get('sbf_table')),
-                           sbf_stats=Markup(session.get('sbf_stats')),
-                           import_message=Markup(session.get('import_message')),
-                           area_link=Markup(session.get('area_link')),
-                           check_result_table=Markup(session.get('check_result_table')),
-                           check_result_conclusion=Markup(session.get('check_result_conclusion')))
+    return _index_page()
 
 
 @app.route('/reset_hash_family', methods=['POST'])
@@ -83,9 +99,7 @@ def reset_hash_family():
         default_hash_family = ['md5', 'sha256', 'sha1']
         hash_family, hf_options = _hash_functions(default_hash_family)
 
-        app.my_sbf.clear_filter()
-        app.my_sbf = sbf(default_hash_family)
-        _set_session()
+        _new_sbf(default_hash_family)
 
         return render_template('edit-details.html', hash_family=Markup(hash_family), hf_options=Markup(hf_options))
 
@@ -95,26 +109,48 @@ def update_hash_family():
     if request.method == 'POST':
         hash_family, hf_options = _hash_functions(request.form.getlist('hf'))
 
-        app.my_sbf.clear_filter()
-        app.my_sbf = sbf(request.form.getlist('hf'))
-        _set_session()
+        _new_sbf(request.form.getlist('hf'))
 
         return render_template('edit-details.html', hash_family=Markup(hash_family), hf_options=Markup(hf_options))
 
 
 @app.route('/back')
 def back():
-    return render_template('index.html', sbf_table=Markup(session.get('sbf_table')),
-                           sbf_stats=Markup(session.get('sbf_stats')),
-                           import_message=Markup(session.get('import_message')),
-                           area_link=Markup(session.get('area_link')),
-                           check_result_table=Markup(session.get('check_result_table')),
-                           check_result_conclusion=Markup(session.get('check_result_conclusion')))
+    return _index_page()
+
+
+@app.route('/sbf_window')
+def sbf_window():
+    my_sbf = _get_sbf()
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', TABLE_WINDOW, type=int), 1), MAX_TABLE_WINDOW)
+    width = min(max(request.args.get('width', Layout.ROW_WIDTH, type=int), 1), limit)
+    value = request.args.get('check', '')
+
+    check_result = my_sbf.check(value) if value else None
+    sbf_table = _layout(my_sbf).load_window(my_sbf.filter, offset, limit, width, check_result)
+
+    return jsonify(html=sbf_table, offset=offset, next_offset=min(offset + limit, my_sbf.num_cells),
+                   total=my_sbf.num_cells, generation=my_sbf.generation)
+
+
+@app.route('/sbf_heatmap.png')
+def sbf_heatmap():
+    my_sbf = _get_sbf()
+    mode = request.args.get('mode', 'max')
+    if mode not in HEATMAP_MODES:
+        mode = 'max'
+    size = min(max(request.args.get('size', HEATMAP_SIZE, type=int), 1), HEATMAP_SIZE)
+
+    png = app.fragment_cache.get((session['sbf_key'], my_sbf.generation, 'heatmap', mode, size),
+                                 lambda: filter_heatmap(my_sbf.get_filter(), my_sbf.num_areas, size, mode))
+
+    return Response(png, mimetype='image/png')
 
 
 @app.route('/cork_csv')
 def cork_csv():
-    csv_table = format_layout.csv_table()
+    csv_table = _layout().csv_table()
     return render_template('cork-csv.html', csv_table=Markup(csv_table))
 
 
@@ -125,42 +161,153 @@ def about():
 
 @app.route('/values')
 def values():
-    return render_template('values.html', incorrect_values=Markup(session.get('incorrect_values')),
-                           import_message=Markup(session.get('import_message')),
-                           fp_values=Markup(session.get('fp_values')))
+    my_sbf = _get_sbf()
+    return render_template('values.html', incorrect_values=Markup(_fragment(my_sbf, 'incorrect_values')),
+                           import_message=Markup(_import_message(my_sbf)),
+                           fp_values=Markup(_fragment(my_sbf, 'fp_values')))
 
 
 @app.route('/area_stats')
 def area_stats():
-    s1, s2 = app.my_sbf.area_stats()
-    stats1, stats2 = format_layout.area_stats(s1, s2)
+    s1, s2 = _get_sbf().area_stats()
+    stats1, stats2 = _layout().area_stats(s1, s2)
 
     return render_template('area.html', stats1=Markup(stats1), stats2=Markup(stats2))
 
 
 @app.route('/edit_details')
 def edit_details():
-    hash_family, hf_options = _hash_functions(app.my_sbf.get_hash_family())
+    hash_family, hf_options = _hash_functions(_get_sbf().get_hash_family())
     return render_template('edit-details.html', hash_family=Markup(hash_family), hf_options=Markup(hf_options))
 
 
-def _set_session():
-    session['sbf_table'] = format_layout.load_table(app.my_sbf.get_filter())
-    session['sbf_stats'] = format_layout.load_stats(app.my_sbf.get_stats())
-    session['import_message'] = 'style="display: block"'
-    session['area_link'] = 'style="display: none"'
-
-    check_result_table, check_result_conclusion = format_layout.no_check_result()
-
-    session['check_result_table'] = check_result_table
-    session['check_result_conclusion'] = check_result_conclusion
-    session['incorrect_values'] = '<tr><td></td><td></td><td></td><td></td></tr>'
-    session['fp_values'] = '<tr><td></td><td></td><td></td></tr>'
+def _get_sbf():
+    if 'sbf_key' not in session:
+        session['sbf_key'] = uuid.uuid4().hex
+    return app.sbf_registry.get(session['sbf_key'], session.get('hash_family', HASH_FAMILY), BIT_MAPPING)
+
+
+def _new_sbf(hash_family):
+    if 'sbf_key' not in session:
+        session['sbf_key'] = uuid.uuid4().hex
+    session['hash_family'] = hash_family
+    return app.sbf_registry.create(session['sbf_key'], hash_family, BIT_MAPPING)
+
+
+def publish_shared_filter():
+    """
+    Builds the filter of the dataset and publishes it in shared memory, unless it is already published.
+    """
+    with app.shared_lock:
+        if app.shared_filter is None:
+            app.shared_filter = SharedFilter(app.config['SHARED_FILTER'])
+        _publish_dataset_sbf()
+
+
+def _publish_dataset_sbf():
+    # Only the process creating the shared filter builds it; the others wait for its first generation
+    if not app.shared_filter.create():
+        try:
+            app.shared_filter.wait(SHARED_FILTER_TIMEOUT)
+            return
+        except TimeoutError:
+            # The builder died before publishing
+            pass
+
+    dataset_sbf = sbf(HASH_FAMILY, BIT_MAPPING)
+    dataset_sbf.insert_from_file(workers=BUILD_WORKERS)
+    dataset_sbf.update_stats()
+    app.shared_filter.publish(dataset_sbf)
+
+
+def _shared_dataset_sbf(my_sbf):
+    if not app.config['SHARED_FILTER']:
+        return None
+
+    with app.shared_lock:
+        if app.shared_filter is None:
+            app.shared_filter = SharedFilter(app.config['SHARED_FILTER'])
+        try:
+            app.shared_filter.attach()
+        except FileNotFoundError:
+            # The publishing process is gone, and its segments with it
+            app.shared_filter.close()
+            _publish_dataset_sbf()
+            app.shared_filter.attach()
+
+        # Only the sessions using the configuration the dataset was published with can share it
+        header = app.shared_filter.header
+        if (header["hash_family"] != my_sbf.get_hash_family()) or (header["bit_mapping"] != my_sbf.bit_mapping) \
+                or (header["num_areas"] != my_sbf.num_areas) \
+                or (header.get("index_mode", 'digest') != my_sbf.index_mode) \
+                or (header.get("salt_version", 1) != my_sbf.salt_version) \
+                or (header.get("element_format", 'string') != my_sbf.element_format):
+            return None
+        return app.shared_filter.view(hash_engine=my_sbf.hash_engine)
+
+
+def _layout(my_sbf=None):
+    return Layout(hash_family=None if my_sbf is None else my_sbf.get_hash_family(), row_cache=app.table_rows)
+
+
+def _index_page(sbf_table=None, check_result_table=None, check_result_conclusion=None, check_value=''):
+    my_sbf = _get_sbf()
+    if sbf_table is None:
+        sbf_table = _fragment(my_sbf, 'sbf_table')
+    if check_result_table is None:
+        check_result_table = _fragment(my_sbf, 'check_result_table')
+        check_result_conclusion = ''
+
+    return render_template('index.html', sbf_table=Markup(sbf_table),
+                           sbf_table_next=my_sbf.num_cells if my_sbf.num_cells <= FULL_TABLE_CELLS else TABLE_WINDOW,
+                           sbf_table_total=my_sbf.num_cells,
+                           sbf_table_window=TABLE_WINDOW,
+                           sbf_check=check_value,
+                           sbf_stats=Markup(_fragment(my_sbf, 'sbf_stats')),
+                           import_message=Markup(_import_message(my_sbf)),
+                           area_link=Markup(_area_link(my_sbf)),
+                           check_result_table=Markup(check_result_table),
+                           check_result_conclusion=Markup(check_result_conclusion))
+
+
+def _fragment(my_sbf, name):
+    return app.fragment_cache.get((session['sbf_key'], my_sbf.generation, name),
+                                  lambda: _render_fragment(my_sbf, name))
+
+
+def _render_fragment(my_sbf, name):
+    format_layout = _layout(my_sbf)
+    if name == 'sbf_table':
+        if my_sbf.num_cells <= FULL_TABLE_CELLS:
+            return format_layout.load_table(my_sbf.get_filter())
+        return format_layout.load_window(my_sbf.filter, 0, TABLE_WINDOW)
+    if name == 'sbf_stats':
+        return format_layout.load_stats(my_sbf.get_stats())
+    if name == 'check_result_table':
+        return format_layout.no_check_result()[0]
+    if name == 'fp_values':
+        if my_sbf.members == 0:
+            return '<tr><td></td><td></td><td></td></tr>'
+        return format_layout.false_positive_area(my_sbf.find_false_positives())
+    if name == 'incorrect_values':
+        if my_sbf.members == 0:
+            return '<tr><td></td><td></td><td></td><td></td></tr>'
+        return format_layout.incorrect_areas(my_sbf.incorrect_values())
+    raise KeyError(name)
+
+
+def _import_message(my_sbf):
+    return 'style="display: block"' if my_sbf.members == 0 else 'style="display: none"'
+
+
+def _area_link(my_sbf):
+    return 'style="display: none"' if my_sbf.members == 0 else 'style="display: block"'
 
 
 def _hash_functions(hash_fam):
+    allowed_hash_functions = _get_sbf().allowed_hashes()
+    format_layout = _layout()
     hf = format_layout.edit_details(hash_fam)
-    allowed_hash_functions = app.my_sbf.allowed_hashes()
     hfo = format_layout.hash_family_options(allowed_hash_functions)
     return hf, hfo
 
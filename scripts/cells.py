@@ -0,0 +1,294 @@
+import sys
+
+import numpy as np
+
+# The storage backends of the filter cells
+CELL_BACKENDS = ['dense', 'sparse']
+# The widths, in bits, cells can be stored with
+CELL_BITS = [2, 4, 8, 16]
+# The number of cells unpacked at a time when iterating
+ITER_CHUNK = 65536
+
+
+class PackedCells:
+
+    def __init__(self, size, bits, data=None):
+        """
+        Initialises a dense array of cells packed at a width of less than a byte (2 or 4 bits), several cells per
+        byte. It reads and writes like the NumPy array of cells it stands for (scalar, slice and index array access),
+        with vectorized unpacking and masking.
+        :param size: the number of cells.
+        :param bits: the width of a cell, 2 or 4 bits.
+        :param data: the array of packed bytes, empty cells by default.
+        """
+        self.size = size
+        self.bits = bits
+        self.dtype = np.dtype(np.uint8)
+        self.per_byte = 8 // bits
+        self.mask = (1 << bits) - 1
+        self.data = np.zeros(-(-size // self.per_byte), dtype=np.uint8) if data is None else data
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for start in range(0, self.size, ITER_CHUNK):
+            yield from self[start:start + ITER_CHUNK]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[0:self.size], dtype=dtype)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    @property
+    def flags(self):
+        return self.data.flags
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            byte, shift = self._locate(key)
+            return np.uint8((int(self.data[byte]) >> shift) & self.mask)
+        if isinstance(key, slice):
+            key = np.arange(*key.indices(self.size))
+        keys = np.asarray(key, dtype=np.intp)
+
+        shifts = (keys % self.per_byte) * self.bits
+        return ((self.data[keys // self.per_byte] >> shifts) & self.mask).astype(np.uint8)[()]
+
+    def __setitem__(self, key, value):
+        if isinstance(key, (int, np.integer)) and np.ndim(value) == 0:
+            value = int(value)
+            if (value < 0) or (value > self.mask):
+                raise ValueError("Cell value out of range.")
+            byte, shift = self._locate(key)
+            self.data[byte] = (int(self.data[byte]) & ~(self.mask << shift) & 0xFF) | (value << shift)
+            return
+
+        keys = np.asarray(key, dtype=np.intp).reshape(-1)
+        values = np.broadcast_to(np.asarray(value), np.shape(key)).reshape(-1).astype(np.intp)
+        if (values < 0).any() or (values > self.mask).any():
+            raise ValueError("Cell value out of range.")
+
+        # The last write to a cell wins, as with NumPy
+        keys, last = np.unique(keys[::-1], return_index=True)
+        values = values[::-1][last]
+
+        # Cells sharing a byte are merged into one write, their keys being sorted
+        shifts = (keys % self.per_byte) * self.bits
+        clear = (self.mask << shifts).astype(np.uint8)
+        fill = (values << shifts).astype(np.uint8)
+        touched, starts = np.unique(keys // self.per_byte, return_index=True)
+        clear = np.bitwise_or.reduceat(clear, starts)
+        fill = np.bitwise_or.reduceat(fill, starts)
+
+        self.data[touched] = (self.data[touched] & ~clear) | fill
+
+    def nonzero(self):
+        """
+        Returns the indexes of the non-zero cells, as numpy.nonzero does.
+        :return: a tuple holding the sorted array of indexes.
+        """
+        return np.flatnonzero(self[0:self.size]),
+
+    def _locate(self, key):
+        """
+        Locates a single cell in the packed bytes.
+        :param key: the index of the cell (negative indexes count from the end, as with NumPy).
+        :return: a tuple (byte, shift): the byte holding the cell, and the position of the cell in it.
+        :raise IndexError: the index is out of range.
+        """
+        key = int(key)
+        if key < 0:
+            key += self.size
+        if (key < 0) or (key >= self.size):
+            raise IndexError("Cell index out of range.")
+        byte, slot = divmod(key, self.per_byte)
+        return byte, slot * self.bits
+
+
+class SparseCells:
+
+    def __init__(self, size, dtype=np.uint8, indexes=None, values=None):
+        """
+        Initialises a sparse array of cells: only the non-zero cells are stored, as a sorted array of cell indexes
+        and the array of their values. It reads and writes like the dense NumPy array of cells it stands for
+        (scalar, slice and index array access), so filters with very large address spaces only pay for the cells
+        they set. Scalar writes are buffered and merged into the sorted arrays in one batch when they are next read
+        as a whole, so a run of scalar writes stays linear.
+        :param size: the number of cells.
+        :param dtype: the type of the cell values.
+        :param indexes: sorted array of the indexes of the non-zero cells, empty by default.
+        :param values: array of the values of the non-zero cells.
+        """
+        self.size = size
+        self.dtype = np.dtype(dtype)
+        self._indexes = np.empty(0, dtype=np.uint64) if indexes is None else indexes
+        self._values = np.empty(0, dtype=self.dtype) if values is None else values
+        # Scalar writes not merged yet, by cell index
+        self.pending = {}
+
+    def __len__(self):
+        # len() is limited to sys.maxsize; size holds the actual number of cells
+        return min(self.size, sys.maxsize)
+
+    def __iter__(self):
+        for start in range(0, self.size, ITER_CHUNK):
+            yield from self[start:start + ITER_CHUNK]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[0:self.size], dtype=dtype)
+
+    @property
+    def indexes(self):
+        self._flush()
+        return self._indexes
+
+    @property
+    def values(self):
+        self._flush()
+        return self._values
+
+    @property
+    def nbytes(self):
+        return self.indexes.nbytes + self.values.nbytes
+
+    @property
+    def flags(self):
+        return self._values.flags
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)) and (key >= 0):
+            # Scalar reads leave the buffered writes alone: a cell not buffered holds its stored value
+            if key in self.pending:
+                return self.pending[key]
+            keys = np.asarray([key], dtype=np.uint64)
+            positions, found = self._find(keys)
+            return self._values[positions[0]] if found[0] else self.dtype.type(0)
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.size)
+            if step != 1:
+                return self._gather(np.arange(start, stop, step, dtype=np.uint64))
+
+            window = np.zeros(max(stop - start, 0), dtype=self.dtype)
+            first, last = np.searchsorted(self.indexes, np.array([start, max(start, stop)], dtype=np.uint64))
+            window[(self.indexes[first:last] - np.uint64(start)).astype(np.intp)] = self.values[first:last]
+            return window
+
+        return self._gather(np.asarray(key, dtype=np.uint64))
+
+    def __setitem__(self, key, value):
+        if not self._values.flags.writeable:
+            raise ValueError("assignment destination is read-only")
+
+        if isinstance(key, (int, np.integer)) and np.ndim(value) == 0:
+            if (key < 0) or (key >= self.size):
+                raise IndexError("Cell index out of range.")
+            self.pending[int(key)] = self.dtype.type(value)
+            return
+
+        self._flush()
+        self._merge(np.asarray(key, dtype=np.uint64).reshape(-1),
+                    np.broadcast_to(np.asarray(value, dtype=self.dtype), np.shape(key)).reshape(-1))
+
+    def _flush(self):
+        """
+        Merges the buffered scalar writes into the sorted arrays.
+        """
+        if self.pending:
+            keys = np.fromiter(self.pending.keys(), dtype=np.uint64, count=len(self.pending))
+            values = np.fromiter(self.pending.values(), dtype=self.dtype, count=len(self.pending))
+            self.pending = {}
+            self._merge(keys, values)
+
+    def _merge(self, keys, values):
+        """
+        Writes cells into the sorted arrays.
+        :param keys: array of cell indexes.
+        :param values: array of cell values, one per index.
+        """
+        # The last write to a cell wins, as with NumPy
+        keys, last = np.unique(keys[::-1], return_index=True)
+        values = values[::-1][last]
+
+        positions, found = self._find(keys)
+        self._values[positions[found]] = values[found]
+
+        cleared = found & (values == 0)
+        if cleared.any():
+            self._indexes = np.delete(self._indexes, positions[cleared])
+            self._values = np.delete(self._values, positions[cleared])
+
+        added = ~found & (values != 0)
+        if added.any():
+            positions = np.searchsorted(self._indexes, keys[added])
+            self._indexes = np.insert(self._indexes, positions, keys[added])
+            self._values = np.insert(self._values, positions, values[added])
+
+    def nonzero(self):
+        """
+        Returns the indexes of the non-zero cells, as numpy.nonzero does.
+        :return: a tuple holding the sorted array of indexes.
+        """
+        return self.indexes.copy(),
+
+    def _gather(self, keys):
+        """
+        Reads the values of some cells.
+        :param keys: array (of any shape) of cell indexes.
+        :return: array of cell values, of the same shape (a scalar for a scalar index).
+        """
+        self._flush()
+        positions, found = self._find(keys.reshape(-1))
+        values = np.zeros(found.shape, dtype=self.dtype)
+        values[found] = self._values[positions[found]]
+        return values.reshape(keys.shape)[()]
+
+    def _find(self, keys):
+        """
+        Looks cells up among the stored ones, leaving out the buffered writes.
+        :param keys: array of cell indexes.
+        :return: a tuple (positions, found): the positions of the cells in the stored arrays (only meaningful where
+                 found), and whether each cell is stored.
+        """
+        positions = np.searchsorted(self._indexes, keys)
+        found = positions < len(self._indexes)
+        found[found] = self._indexes[positions[found]] == keys[found]
+        return positions, found
+
+
+def cell_bits(num_areas):
+    """
+    Returns the narrowest width cells holding the area labels 0 to num_areas can be stored with.
+    :param num_areas: the number of areas.
+    :return: the width of a cell in bits, one of CELL_BITS.
+    :raise AttributeError: there are too many areas.
+    """
+    for bits in CELL_BITS:
+        if num_areas < (1 << bits):
+            return bits
+    raise AttributeError("Invalid number of areas.")
+
+
+def new_cells(backend, size, bits=8):
+    """
+    Allocates an array of empty cells.
+    Dense cells narrower than a byte are packed, several per byte.
+    :param backend: the storage backend, one of CELL_BACKENDS.
+    :param size: the number of cells.
+    :param bits: the width of a cell, one of CELL_BITS.
+    :return: a NumPy array or a PackedCells for the dense backend, a SparseCells for the sparse one.
+    :raise AttributeError: the backend or the width is not available.
+    """
+    if bits not in CELL_BITS:
+        raise AttributeError("Invalid cell width.")
+    dtype = np.uint16 if bits > 8 else np.uint8
+
+    if backend == 'dense':
+        if bits < 8:
+            return PackedCells(size, bits)
+        return np.zeros(size, dtype=dtype)
+    if backend == 'sparse':
+        return SparseCells(size, dtype)
+    raise AttributeError("Invalid cell backend.")
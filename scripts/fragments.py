@@ -0,0 +1,57 @@
+import threading
+from collections import OrderedDict
+
+
+class FragmentCache:
+
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        """
+        Initialises a server-side cache of rendered HTML fragments.
+        Fragments are keyed by the filter state they were rendered from (e.g. session key, filter generation and
+        fragment name), so a key never needs invalidating: a changed filter simply asks for new keys, and the
+        least recently used fragments are evicted beyond the size budget.
+        :param max_bytes: the maximum total length of the cached fragments.
+        """
+        self.max_bytes = max_bytes
+        self.fragments = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.fragments)
+
+    def __contains__(self, key):
+        return key in self.fragments
+
+    def get(self, key, render):
+        """
+        Returns a cached fragment, rendering and caching it if needed.
+        :param key: the (hashable) key of the fragment.
+        :param render: callable with no arguments returning the fragment.
+        :return: the fragment.
+        """
+        with self.lock:
+            fragment = self.fragments.get(key)
+            if fragment is not None:
+                self.fragments.move_to_end(key)
+                return fragment
+
+        fragment = render()
+
+        with self.lock:
+            if key not in self.fragments:
+                self.fragments[key] = fragment
+                self.size += len(fragment)
+            while (self.size > self.max_bytes) and (len(self.fragments) > 1):
+                _, evicted = self.fragments.popitem(last=False)
+                self.size -= len(evicted)
+
+        return fragment
+
+    def clear(self):
+        """
+        Empties the cache.
+        """
+        with self.lock:
+            self.fragments.clear()
+            self.size = 0
@@ -0,0 +1,262 @@
+import numpy as np
+
+# Packed coordinate elements: the latitude and the longitude, in units of 10^-PACKED_PRECISION degrees, as two
+# big-endian 32-bit integers (8 bytes per element)
+PACKED_PRECISION = 4
+PACKED_DTYPE = np.dtype([('lat', '>i4'), ('lon', '>i4')])
+
+
+class CoordinateGrid:
+
+    def __init__(self, lat_range, lon_range, precision=4):
+        """
+        Initialises an immutable lattice of coordinates.
+        Coordinates are handled as integers, in units of 10^-precision degrees, and the lattice is only described
+        by its bounds: the "lat#lon" element strings are materialised on demand.
+        :param lat_range: (first, last) latitudes of the lattice, inclusive, in integer units.
+        :param lon_range: (first, last) longitudes of the lattice, inclusive, in integer units.
+        :param precision: the number of decimals of the coordinates.
+        """
+        self.lat_first, self.lat_last = lat_range
+        self.lon_first, self.lon_last = lon_range
+        self.precision = precision
+        self.scale = pow(10, precision)
+
+        # The lattice can be walked in either direction, as given by the bounds
+        self.lat_step = 1 if self.lat_last >= self.lat_first else -1
+        self.lon_step = 1 if self.lon_last >= self.lon_first else -1
+        self.rows = abs(self.lat_last - self.lat_first) + 1
+        self.cols = abs(self.lon_last - self.lon_first) + 1
+        self.size = self.rows * self.cols
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for i in range(self.size):
+            yield self.element(i)
+
+    def __setattr__(self, name, value):
+        if name in self.__dict__:
+            raise AttributeError("CoordinateGrid is immutable.")
+        super().__setattr__(name, value)
+
+    def packed(self, indexes):
+        """
+        Returns the packed elements of some lattice cells, without materialising their strings.
+        :param indexes: array of cell indexes.
+        :return: array of packed coordinates (PACKED_DTYPE).
+        :raise AttributeError: the precision of the lattice is not PACKED_PRECISION.
+        """
+        if self.precision != PACKED_PRECISION:
+            raise AttributeError("Invalid grid precision.")
+
+        lats, lons = self.coordinates(indexes)
+        return pack_units(lats, lons)
+
+    def element(self, index):
+        """
+        Returns the element string of a lattice cell.
+        :param index: the index of the cell in the lattice.
+        :return: the element, as a "lat#lon" string.
+        """
+        if (index < 0) or (index >= self.size):
+            raise IndexError("Invalid grid index.")
+
+        row, col = divmod(int(index), self.cols)
+        return "{}#{}".format(self._format(self.lat_first + row * self.lat_step),
+                              self._format(self.lon_first + col * self.lon_step))
+
+    def elements(self, indexes):
+        """
+        Returns the element strings of some lattice cells.
+        :param indexes: iterable of cell indexes.
+        :return: list of "lat#lon" strings.
+        """
+        return [self.element(i) for i in indexes]
+
+    def elements_at(self, lats, lons):
+        """
+        Returns the element strings of coordinates given in integer units, whether they are cells of the lattice
+        or not.
+        :param lats: array of latitudes, in integer units.
+        :param lons: array of longitudes, in integer units.
+        :return: list of "lat#lon" strings.
+        """
+        return ["{}#{}".format(self._format(int(lat)), self._format(int(lon))) for lat, lon in zip(lats, lons)]
+
+    def indexes_at(self, lats, lons):
+        """
+        Returns the lattice indexes of coordinates given in integer units.
+        :param lats: array of latitudes, in integer units.
+        :param lons: array of longitudes, in integer units.
+        :return: array of cell indexes, -1 for the coordinates that are not cells of the lattice.
+        """
+        rows = (np.asarray(lats, dtype=np.int64) - self.lat_first) * self.lat_step
+        cols = (np.asarray(lons, dtype=np.int64) - self.lon_first) * self.lon_step
+        inside = (rows >= 0) & (rows < self.rows) & (cols >= 0) & (cols < self.cols)
+        return np.where(inside, rows * self.cols + cols, -1)
+
+    def coordinates(self, indexes):
+        """
+        Returns the integer coordinates of some lattice cells.
+        :param indexes: array of cell indexes.
+        :return: a tuple (lats, lons) of arrays, in integer units.
+        """
+        rows, cols = np.divmod(np.asarray(indexes, dtype=np.int64), self.cols)
+        return self.lat_first + rows * self.lat_step, self.lon_first + cols * self.lon_step
+
+    def index_of(self, element):
+        """
+        Returns the lattice index of an element.
+        :param element: the element, as a "lat#lon" string or a packed coordinate (bytes).
+        :return: the index of the cell, or -1 if the element is not a cell of the lattice.
+        """
+        if isinstance(element, (bytes, np.void)):
+            return int(self.indexes_of(np.frombuffer(bytes(element), dtype=PACKED_DTYPE))[0])
+
+        units = _parse_units(element, self.precision)
+        if units is None:
+            return -1
+        lat_units, lon_units = units
+
+        row = (lat_units - self.lat_first) * self.lat_step
+        col = (lon_units - self.lon_first) * self.lon_step
+        if (row < 0) or (row >= self.rows) or (col < 0) or (col >= self.cols):
+            return -1
+
+        return row * self.cols + col
+
+    def indexes_of(self, elements):
+        """
+        Returns the lattice indexes of some elements.
+        An array of packed coordinates is mapped in one vectorized pass.
+        :param elements: iterable of "lat#lon" strings or packed coordinates, or an array of packed coordinates
+                         (PACKED_DTYPE).
+        :return: array of cell indexes, -1 for the elements that are not cells of the lattice.
+        """
+        if not (isinstance(elements, np.ndarray) and (elements.dtype == PACKED_DTYPE)):
+            return np.array([self.index_of(element) for element in elements], dtype=np.int64)
+        if self.precision != PACKED_PRECISION:
+            return np.full(len(elements), -1, dtype=np.int64)
+
+        return self.indexes_at(elements['lat'], elements['lon'])
+
+    def _format(self, units):
+        """
+        Formats a coordinate given in integer units.
+        :param units: the coordinate, in units of 10^-precision degrees.
+        :return: the coordinate as a decimal string (e.g. "-8.4772").
+        """
+        return _format_units(units, self.precision)
+
+
+def pack_coordinates(lats, lons):
+    """
+    Packs coordinates given in degrees (e.g. raw GPS fixes) into fixed-width elements, in one vectorized pass.
+    The coordinates are rounded to the nearest 10^-PACKED_PRECISION degree, the resolution of the dataset.
+    :param lats: array of latitudes, in degrees.
+    :param lons: array of longitudes, in degrees.
+    :return: array of packed coordinates (PACKED_DTYPE), which filters accept as elements.
+    """
+    scale = pow(10, PACKED_PRECISION)
+    return pack_units(np.rint(np.asarray(lats, dtype=np.float64) * scale),
+                       np.rint(np.asarray(lons, dtype=np.float64) * scale))
+
+
+def pack_coordinate(lat, lon):
+    """
+    Packs a single coordinate given in degrees.
+    :param lat: the latitude, in degrees.
+    :param lon: the longitude, in degrees.
+    :return: the packed coordinate (bytes).
+    """
+    return pack_coordinates([lat], [lon]).tobytes()
+
+
+def unpack_coordinates(packed):
+    """
+    Returns the integer coordinates of packed elements.
+    :param packed: array of packed coordinates (PACKED_DTYPE), or a packed coordinate (bytes).
+    :return: a tuple (lats, lons) of arrays, in units of 10^-PACKED_PRECISION degrees.
+    """
+    if not isinstance(packed, np.ndarray):
+        packed = np.frombuffer(bytes(packed), dtype=PACKED_DTYPE)
+    return packed['lat'].astype(np.int64), packed['lon'].astype(np.int64)
+
+
+def packed_element(packed):
+    """
+    Returns the element string of a packed coordinate.
+    :param packed: the packed coordinate (bytes).
+    :return: the element, as a "lat#lon" string.
+    """
+    lats, lons = unpack_coordinates(packed)
+    return "{}#{}".format(_format_units(int(lats[0]), PACKED_PRECISION), _format_units(int(lons[0]), PACKED_PRECISION))
+
+
+def element_packed(element):
+    """
+    Returns the packed coordinate of an element string.
+    :param element: the element, as a "lat#lon" string.
+    :return: the packed coordinate (bytes), or None if the element is not the canonical spelling of a coordinate.
+    """
+    units = _parse_units(element, PACKED_PRECISION)
+    if units is None:
+        return None
+    return pack_units(*units).tobytes()
+
+
+def _parse_units(element, precision):
+    """
+    Parses an element string into integer coordinates.
+    :param element: the element, as a "lat#lon" string.
+    :param precision: the number of decimals of the coordinates.
+    :return: a tuple (lat, lon) in units of 10^-precision degrees, or None if the element is not the canonical
+             spelling of a coordinate at this precision.
+    """
+    lat, sep, lon = element.partition('#')
+    if not sep:
+        return None
+
+    scale = pow(10, precision)
+    try:
+        lat_units = round(float(lat) * scale)
+        lon_units = round(float(lon) * scale)
+    except ValueError:
+        return None
+
+    # Only the canonical spelling of a coordinate hashes to the cell's element
+    if (_format_units(lat_units, precision) != lat) or (_format_units(lon_units, precision) != lon):
+        return None
+
+    return lat_units, lon_units
+
+
+def _format_units(units, precision):
+    """
+    Formats a coordinate given in integer units.
+    :param units: the coordinate, in units of 10^-precision degrees.
+    :param precision: the number of decimals of the coordinate.
+    :return: the coordinate as a decimal string (e.g. "-8.4772").
+    """
+    sign = '-' if units < 0 else ''
+    whole, decimals = divmod(abs(units), pow(10, precision))
+    return "{}{}.{:0{prec}d}".format(sign, whole, decimals, prec=precision)
+
+
+def pack_units(lats, lons):
+    """
+    Packs coordinates given in integer units.
+    :param lats: array of latitudes, in units of 10^-PACKED_PRECISION degrees.
+    :param lons: array of longitudes, in units of 10^-PACKED_PRECISION degrees.
+    :return: array of packed coordinates (PACKED_DTYPE).
+    """
+    packed = np.empty(np.shape(lats), dtype=PACKED_DTYPE)
+    packed['lat'] = lats
+    packed['lon'] = lons
+    return packed
+
+
+# The Cork map: the lattice every filter checks its false positives against
+CORK_GRID = CoordinateGrid((518945, 519020), (-84694, -84845))
@@ -0,0 +1,121 @@
+import colorsys
+import struct
+import zlib
+
+import numpy as np
+
+from scripts.cells import SparseCells
+
+# The aggregations available for the tiles of the heatmap
+HEATMAP_MODES = ['max', 'occupancy']
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def filter_tiles(cells, num_tiles, mode='max'):
+    """
+    Aggregates the cells of a filter into tiles of consecutive cells.
+    :param cells: an array of the filter (or its SparseCells).
+    :param num_tiles: the maximum number of tiles.
+    :param mode: 'max' for the highest area label of each tile, 'occupancy' for its fraction of non-zero cells.
+    :return: array of tile values (area labels, or occupancy in [0, 1]).
+    :raise AttributeError: the mode is not available.
+    """
+    if mode not in HEATMAP_MODES:
+        raise AttributeError("Invalid heatmap mode.")
+
+    if not isinstance(cells, SparseCells):
+        cells = np.asarray(cells)
+    tile_size = max(1, -(-cells.size // num_tiles))
+    num_tiles = -(-cells.size // tile_size)
+
+    if isinstance(cells, SparseCells):
+        # Only the non-zero cells are visited
+        tiles = (cells.indexes // np.uint64(tile_size)).astype(np.intp)
+        if mode == 'max':
+            values = np.zeros(num_tiles, dtype=cells.dtype)
+            np.maximum.at(values, tiles, cells.values)
+            return values
+        return np.bincount(tiles, minlength=num_tiles) / tile_size
+
+    # Pads the last tile with empty cells
+    padded = np.zeros(num_tiles * tile_size, dtype=cells.dtype)
+    padded[:len(cells)] = cells
+    tiles = padded.reshape(num_tiles, tile_size)
+
+    if mode == 'max':
+        return tiles.max(axis=1)
+    return np.count_nonzero(tiles, axis=1) / tile_size
+
+
+def filter_heatmap(cells, num_areas, size=256, mode='max'):
+    """
+    Returns a PNG image giving an overview of the filter: the cells are aggregated into at most size x size tiles,
+    laid out row by row.
+    With mode 'max' each pixel is coloured by the highest area label of its tile (white for empty tiles),
+    with mode 'occupancy' it is a grey level, darker for fuller tiles.
+    :param cells: an array of the filter.
+    :param num_areas: the number of areas of the filter.
+    :param size: the maximum width and height of the image, in pixels.
+    :param mode: the aggregation of the tiles, one of HEATMAP_MODES.
+    :return: the PNG image (bytes).
+    """
+    tiles = filter_tiles(cells, size * size, mode)
+    width = min(size, len(tiles))
+    height = -(-len(tiles) // width)
+
+    pixels = np.zeros(width * height, dtype=np.uint8)
+    if mode == 'max':
+        palette = _area_palette(num_areas)
+        pixels[:len(tiles)] = np.minimum(tiles, len(palette) - 1)
+        return write_png(pixels.reshape(height, width), palette=palette)
+
+    pixels[:] = 255
+    pixels[:len(tiles)] = np.round(255 * (1 - tiles))
+    return write_png(pixels.reshape(height, width))
+
+
+def write_png(pixels, palette=None):
+    """
+    Encodes an 8-bit image as a PNG, with the standard library only.
+    :param pixels: (height x width) array of uint8 pixels.
+    :param palette: list of (r, g, b) colours indexed by the pixel values, None for a greyscale image.
+    :return: the PNG image (bytes).
+    """
+    height, width = pixels.shape
+    colour_type = 0 if palette is None else 3
+
+    # Each scanline starts with its filter type (0, no filtering)
+    scanlines = np.zeros((height, width + 1), dtype=np.uint8)
+    scanlines[:, 1:] = pixels
+
+    png = PNG_SIGNATURE + _png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, colour_type, 0, 0, 0))
+    if palette is not None:
+        png += _png_chunk(b'PLTE', b''.join(struct.pack('BBB', *colour) for colour in palette))
+    png += _png_chunk(b'IDAT', zlib.compress(scanlines.tobytes(), 9))
+    png += _png_chunk(b'IEND', b'')
+
+    return png
+
+
+def _png_chunk(chunk_type, data):
+    """
+    Returns a PNG chunk: length, type, data and CRC.
+    :param chunk_type: the 4-byte chunk type.
+    :param data: the chunk data.
+    :return: the chunk (bytes).
+    """
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+
+def _area_palette(num_areas):
+    """
+    Returns a palette with white for empty cells, and a distinct hue for each area label.
+    :param num_areas: the number of areas.
+    :return: list of (r, g, b) colours, indexed by area label.
+    """
+    palette = [(255, 255, 255)]
+    for area in range(1, min(num_areas, 255) + 1):
+        r, g, b = colorsys.hsv_to_rgb((area - 1) / num_areas, 0.85, 0.9)
+        palette.append((round(r * 255), round(g * 255), round(b * 255)))
+    return palette
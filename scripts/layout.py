@@ -1,14 +1,27 @@
 import ast
 import csv
+import threading
+from collections import OrderedDict
 from pathlib import Path
 
 
 class Layout:
 
-    def __init__(self, num_cells):
+    # The number of filter cells per table row
+    ROW_WIDTH = 64
+    # The number of filter generations whose table rows are kept
+    ROW_CACHE_SIZE = 8
+    # Guards the row caches, which may be shared by the layouts of concurrent requests
+    ROW_CACHE_LOCK = threading.Lock()
+
+    def __init__(self, num_cells=None, hash_family=None, row_cache=None):
         """
         Initialises stats and table layout.
-        :param num_cells: the number of cells in the filter (2^num_cells).
+        A layout holds the state of the page being rendered, so a server uses one layout per request; the rendered
+        table rows can still be shared between requests by passing the same row_cache.
+        :param num_cells: the number of cells in the filter (2^num_cells), None to display all the cells given.
+        :param hash_family: the hash family of the filter whose check results are rendered.
+        :param row_cache: the cache of rendered table rows (an OrderedDict), a new one by default.
         """
         self.dataset = self._get_dataset_path()
         self.delimiter = ','
@@ -17,7 +30,9 @@ class Layout:
         self.table = ""
         self.check = ""
         self.conclusion = ""
-        self.hash_family = []
+        self.hash_family = [] if hash_family is None else list(hash_family)
+        # Rendered table rows (with cell ids) by filter generation, the base of highlight_table
+        self.row_cache = OrderedDict() if row_cache is None else row_cache
 
     def __del__(self):
         pass
@@ -45,76 +60,143 @@ class Layout:
         return self.stats
 
     def area_stats(self, stats1, stats2):
-        self.stats1 = stats1
-        self.stats2 = stats2
-        k1 = sorted(list(self.stats1.keys()))
-        k2 = sorted(list(self.stats2.keys()))
-        self.property, self.other_stats = "", ""
-
-        for i in range(1, 5):
-            self.property += "<tr><td>{}</td>".format(k1[i-1])
-            for j in self.stats1[k1[i-1]]:
-                self.property += "<td>{}</td>".format(j)
-            self.property += "</tr>"
-
-        for i in range(1, 5):
-            self.other_stats += "<tr><td>{}</td>".format(k2[i-1])
-            for j in self.stats2[k2[i-1]]:
-                self.other_stats += "<td>{}</td>".format(j)
-            self.other_stats += "</tr>"
-
-        del self.stats1
-        del self.stats2
+        """
+        Returns the rows of the area stats tables, one row per area.
+        :param stats1: dictionary of the area properties, keyed by area label.
+        :param stats2: dictionary of the area stats, keyed by area label.
+        :return: a tuple of strings of HTML, the rows of the properties and of the stats.
+        """
+        self.property = self._stats_rows(stats1)
+        self.other_stats = self._stats_rows(stats2)
 
         return self.property, self.other_stats
 
+    @staticmethod
+    def _stats_rows(stats):
+        """
+        Returns a table row per area, sorted by area label.
+        :param stats: dictionary with the area label as the key and the list of its stats as the value.
+        :return: a string of HTML rows.
+        """
+        return "".join(["<tr><td>{}</td>{}</tr>".format(area, "".join(["<td>{}</td>".format(v) for v in values]))
+                        for area, values in sorted(stats.items())])
+
     def load_table(self, sbf_table):
         """
         Returns the table contents.
         :param sbf_table: an array of the filter.
         :return: a string of HTML to display the contents of the filter.
         """
-        self.sbf_table = sbf_table
-        self.table = "<tr>"
-
-        for i in range(0, pow(2, self.num_cells)):
-            if (i % 64 == 0) and (i != 0):
-                self.table += "</tr><tr>"
-            self.table += "<td>{}</td>".format(str(self.sbf_table[i]))
-        self.table += "</tr>"
+        cells = ["<td>{}</td>".format(v) for v in self._cell_values(sbf_table)]
 
-        del self.sbf_table
-        return self.table
+        return "".join(["<tr>{}</tr>".format("".join(cells[i:i + self.ROW_WIDTH]))
+                        for i in range(0, len(cells), self.ROW_WIDTH)])
 
-    def highlight_table(self, sbf_table, results):
+    def highlight_table(self, sbf_table, results, generation=None):
         """
         Return the table contents with the check values highlighted.
+        The rows of the table are cached by filter generation, so only the rows holding the k checked cells
+        are rendered again.
         :param sbf_table: an array of the filter.
         :param results: a dictionary with the hash function as the key and list [index, area] as the value.
+        :param generation: the generation of the filter, None to render without the cache.
         :return: a string of HTML to display the contents of the filter with highlighted values.
         """
-        self.sbf_table = sbf_table
-        self.results = results
-        self.indexes = self._get_indexes(self.results)
-        self.table = "<tr>"
-
-        for i in range(0, pow(2, self.num_cells)):
-            if (i % 64 == 0) and (i != 0):
-                self.table += "</tr><tr>"
-            if i in self.indexes:
-                self.table += "<td class=\"tooltip\" id={} style=\"background-color: red\">" \
-                              "{}" \
-                              "<span class=\"tooltiptext\">{}</span>" \
-                              "</td>".format(str(i), str(self.sbf_table[i]), str(self._tooltip(i, self.results)))
+        rows = list(self._table_rows(sbf_table, generation))
+        tooltips = {}
+        for hf in self.hash_family:
+            tooltips.setdefault(int(results[hf][0]), hf.upper())
+
+        for row in set(i // self.ROW_WIDTH for i in tooltips):
+            start = row * self.ROW_WIDTH
+            cells = self._render_cells(self._cell_values(sbf_table, start, start + self.ROW_WIDTH), start, tooltips)
+            rows[row] = "<tr>{}</tr>".format("".join(cells))
+
+        return "".join(rows)
+
+    def load_window(self, sbf_table, offset, limit, row_width=ROW_WIDTH, results=None):
+        """
+        Returns the table contents for a window of the filter cells only, so that the size of the HTML depends on
+        the window and not on the filter.
+        :param sbf_table: an array of the filter.
+        :param offset: the first cell of the window.
+        :param limit: the number of cells of the window.
+        :param row_width: the number of cells per table row.
+        :param results: a dictionary with the hash function as the key and list [index, area] as the value, to
+                        highlight the checked cells falling in the window; None for no highlighting.
+        :return: a string of HTML to display the window of the filter.
+        """
+        tooltips = {}
+        if results is not None:
+            for hf in self.hash_family:
+                tooltips.setdefault(int(results[hf][0]), hf.upper())
+
+        cells = self._render_cells(self._cell_values(sbf_table, offset, offset + limit), offset, tooltips)
+
+        return "".join(["<tr>{}</tr>".format("".join(cells[i:i + row_width]))
+                        for i in range(0, len(cells), row_width)])
+
+    @staticmethod
+    def _render_cells(values, start, tooltips):
+        """
+        Renders filter cells, with an id on each cell, highlighting the cells with a tooltip.
+        :param values: the values of the cells.
+        :param start: the index of the first cell.
+        :param tooltips: a dictionary with the index of the highlighted cells as the key and the tooltip as the value.
+        :return: list of the HTML cells.
+        """
+        cells = []
+        for i, v in enumerate(values, start):
+            if i in tooltips:
+                cells.append("<td class=\"tooltip\" id={} style=\"background-color: red\">"
+                             "{}"
+                             "<span class=\"tooltiptext\">{}</span>"
+                             "</td>".format(i, v, tooltips[i]))
             else:
-                self.table += "<td id={}>{}</td>".format(str(i),
-                                                         str(self.sbf_table[i]))
-        self.table += "</tr>"
+                cells.append("<td id={}>{}</td>".format(i, v))
+        return cells
 
-        del self.sbf_table
-        del self.results
-        del self.indexes
-        return self.table
+    def _table_rows(self, sbf_table, generation=None):
+        """
+        Returns the rows of the table, with an id on each cell, from the cache when possible.
+        :param sbf_table: an array of the filter.
+        :param generation: the generation of the filter, None to render without the cache.
+        :return: list of the HTML rows.
+        """
+        if generation is not None:
+            with self.ROW_CACHE_LOCK:
+                rows = self.row_cache.get(generation)
+                if rows is not None:
+                    self.row_cache.move_to_end(generation)
+                    return rows
+
+        cells = self._render_cells(self._cell_values(sbf_table), 0, {})
+        rows = ["<tr>{}</tr>".format("".join(cells[i:i + self.ROW_WIDTH]))
+                for i in range(0, len(cells), self.ROW_WIDTH)]
+
+        if generation is not None:
+            with self.ROW_CACHE_LOCK:
+                self.row_cache[generation] = rows
+                if len(self.row_cache) > self.ROW_CACHE_SIZE:
+                    self.row_cache.popitem(last=False)
+
+        return rows
+
+    def _cell_values(self, sbf_table, start=0, stop=None):
+        """
+        Returns the values of a range of filter cells, as Python ints.
+        :param sbf_table: an array of the filter.
+        :param start: the first cell.
+        :param stop: the cell after the last one, defaults to the end of the table.
+        :return: list of cell values.
+        """
+        # Very large (sparse) filters have more cells than len() can report
+        size = sbf_table.size if hasattr(sbf_table, 'size') else len(sbf_table)
+        num_cells = size if self.num_cells is None else min(pow(2, self.num_cells), size)
+        start = max(0, min(start, num_cells))
+        stop = num_cells if stop is None else max(start, min(stop, num_cells))
+        values = sbf_table[start:stop]
+        return values.tolist() if hasattr(values, 'tolist') else [int(v) for v in values]
 
     def load_check_result(self, value, results, incor_vals):
         """
@@ -257,38 +339,6 @@ class Layout:
         del self.allowed_hashes
         return self.checkboxes
 
-    def _tooltip(self, index, results):
-        """
-        Get the hash function to display in the tooltip.
-        :param index: the index value.
-        :param results: a dictionary with the hash function as the key and list [index, area] as the value.
-        :return: the hash function to display in the tooltip.
-        """
-        self.index = index
-        self.results = results
-        self.cnt = 0
-        self.k = list(self.results.keys())
-        self.v = list(self.results.values())
-
-        for i in self.v:
-            if i[0] == self.index:
-                return self.k[self.cnt].upper()
-            self.cnt += 1
-
-    def _get_indexes(self, results):
-        """
-        Extract the filter index from the check result.
-        :param results: a dictionary with the hash function as the key and list [index, area] as the value.
-        :return: the indexes of the check result.
-        """
-        self.results = results
-        self.index_list = []
-
-        for hf in self.hash_family:
-            self.index_list.append(self.results[hf][0])
-
-        return self.index_list
-
     def _result_header(self):
         """
         Return the table header which contains the hash function names.
@@ -0,0 +1,138 @@
+import threading
+from collections import OrderedDict
+
+from scripts.sbf import sbf
+
+
+class FilterRegistry:
+
+    def __init__(self, memory_budget=64 * 1024 * 1024, hash_salt_path="default"):
+        """
+        Initialises a registry of filters, one per session (or tenant).
+        Filters with the same hash family, bit mapping, salt, index mode, salt version and element format share their
+        hash engine, and with it the hash constructors, the salts and the grid indexes. When the filters use more
+        memory than the budget, the least recently used ones are evicted.
+        :param memory_budget: the maximum number of bytes used by the registered filters.
+        :param hash_salt_path: the path to the hash salt file used by the filters.
+        """
+        self.memory_budget = memory_budget
+        self.hash_salt_path = hash_salt_path
+        self.filters = OrderedDict()
+        self.engines = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.filters)
+
+    def __contains__(self, key):
+        return key in self.filters
+
+    def get(self, key, hash_family, bit_mapping=10, num_areas=4, index_mode='digest', salt_version=1,
+            element_format='string'):
+        """
+        Returns the filter of a session, creating it if it does not exist (or was evicted).
+        A filter registered with a different configuration is replaced by an empty one.
+        :param key: the session (or tenant) key.
+        :param hash_family: the hash family of the filter.
+        :param bit_mapping: filter composed of 2^bit_mapping cells.
+        :param num_areas: the number of areas of the filter.
+        :param index_mode: the way the filter computes the cell indexes ('digest' or 'double').
+        :param salt_version: the way the filter salts the elements (1 or 2).
+        :param element_format: the form the filter hashes coordinates in ('string' or 'packed').
+        :return: the filter (sbf).
+        """
+        with self.lock:
+            fltr = self.filters.get(key)
+            if (fltr is not None) and (fltr.get_hash_family() == [x.lower() for x in hash_family]) \
+                    and (fltr.bit_mapping == bit_mapping) and (fltr.num_areas == num_areas) \
+                    and (fltr.index_mode == index_mode) and (fltr.salt_version == salt_version) \
+                    and (fltr.element_format == element_format):
+                self.filters.move_to_end(key)
+                return fltr
+
+        return self.create(key, hash_family, bit_mapping, num_areas, index_mode, salt_version, element_format)
+
+    def create(self, key, hash_family, bit_mapping=10, num_areas=4, index_mode='digest', salt_version=1,
+               element_format='string'):
+        """
+        Registers a new, empty filter for a session, replacing its current one.
+        :param key: the session (or tenant) key.
+        :param hash_family: the hash family of the filter.
+        :param bit_mapping: filter composed of 2^bit_mapping cells.
+        :param num_areas: the number of areas of the filter.
+        :param index_mode: the way the filter computes the cell indexes ('digest' or 'double').
+        :param salt_version: the way the filter salts the elements (1 or 2).
+        :param element_format: the form the filter hashes coordinates in ('string' or 'packed').
+        :return: the filter (sbf).
+        """
+        config = (tuple(x.lower() for x in hash_family), bit_mapping, self.hash_salt_path, index_mode, salt_version,
+                  element_format)
+
+        with self.lock:
+            engine = self.engines.get(config)
+        fltr = sbf(hash_family, bit_mapping, hash_salt_path=self.hash_salt_path, hash_engine=engine,
+                   num_areas=num_areas, index_mode=index_mode, salt_version=salt_version, element_format=element_format)
+
+        return self.register(key, fltr)
+
+    def register(self, key, fltr):
+        """
+        Registers an existing filter for a session, replacing its current one.
+        :param key: the session (or tenant) key.
+        :param fltr: the filter (sbf).
+        :return: the filter (sbf).
+        """
+        config = (tuple(fltr.get_hash_family()), fltr.bit_mapping, self.hash_salt_path, fltr.index_mode,
+                  fltr.salt_version, fltr.element_format)
+
+        with self.lock:
+            self.engines.setdefault(config, fltr.hash_engine)
+            self._discard(key)
+            self.filters[key] = fltr
+            self._evict(keep=key)
+
+        return fltr
+
+    def discard(self, key):
+        """
+        Removes the filter of a session from the registry.
+        :param key: the session (or tenant) key.
+        """
+        with self.lock:
+            self._discard(key)
+
+    def _discard(self, key):
+        """
+        Removes the filter of a session, and the hash engine it no longer shares with any filter.
+        Must be called holding the lock.
+        :param key: the session (or tenant) key.
+        """
+        fltr = self.filters.pop(key, None)
+        if fltr is None:
+            return
+
+        if all(other.hash_engine is not fltr.hash_engine for other in self.filters.values()):
+            self.engines = {config: engine for config, engine in self.engines.items()
+                            if engine is not fltr.hash_engine}
+
+    def _evict(self, keep):
+        """
+        Evicts the least recently used filters until the registry fits its memory budget.
+        Must be called holding the lock.
+        :param keep: the key of the filter that must not be evicted.
+        """
+        memory = self.memory_usage()
+
+        for key in list(self.filters.keys()):
+            if memory <= self.memory_budget:
+                return
+            if key != keep:
+                memory -= self.filters[key].memory_usage()
+                self._discard(key)
+
+    def memory_usage(self):
+        """
+        Returns the memory used by the registered filters.
+        :return: the number of bytes.
+        """
+        return sum(fltr.memory_usage() for fltr in self.filters.values())
@@ -2,28 +2,371 @@ import base64
 import csv
 import sys
 import hashlib
+import json
+import os
+import struct
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from itertools import chain, count, islice
 from sys import byteorder
 from pathlib import Path
-from random import randint
 
 import numpy as np
 
+from scripts.cells import CELL_BACKENDS, PackedCells, SparseCells, cell_bits, new_cells
+from scripts.grid import CORK_GRID, PACKED_DTYPE, PACKED_PRECISION, element_packed, pack_units, packed_element
+
 if sys.version_info < (3, 6):
     import sha3
 
 
+class HashEngine:
+
+    # The ways of computing the cell indexes of an element: one digest per member of the hash family ('digest'),
+    # or k indexes h1 + i * h2 derived from a single digest (Kirsch-Mitzenmacher double hashing, 'double')
+    INDEX_MODES = ['digest', 'double']
+    # The ways of salting an element: XOR with the first salt, the element being truncated to the salt length (1),
+    # or keyed BLAKE2b of the whole element, XORed with a distinct salt for each member of the hash family (2)
+    SALT_VERSIONS = [1, 2]
+    # The size of the keyed BLAKE2b digest of salt version 2, which fits a single block of the hash functions
+    KEYED_DIGEST_SIZE = 32
+    # The forms coordinates are hashed in: "lat#lon" strings ('string'), or fixed-width packed coordinates
+    # ('packed', see grid.PACKED_DTYPE)
+    ELEMENT_FORMATS = ['string', 'packed']
+
+    def __init__(self, hash_family, bit_mapping, hash_salts, index_mode='digest', salt_version=1,
+                 element_format='string'):
+        """
+        Initialises the hashing component shared by the insert, check and batch paths of the SBF.
+        The hash constructors of the family are resolved once, here, instead of on every hash call.
+        :param hash_family: the hash family used.
+        :param bit_mapping: filter composed of 2^bit_mapping cells.
+        :param hash_salts: list of hash salts (bytes).
+        :param index_mode: the way of computing the cell indexes, one of INDEX_MODES.
+        :param salt_version: the way of salting the elements, one of SALT_VERSIONS.
+        :param element_format: the form coordinates are hashed in, one of ELEMENT_FORMATS.
+        """
+        self.hash_family = list(hash_family)
+        self.bit_mapping = bit_mapping
+        self.hash_salts = hash_salts
+        self.index_mode = index_mode
+        self.salt_version = salt_version
+        self.element_format = element_format
+
+        self.constructors = [self._constructor(hf) for hf in self.hash_family]
+        # With salt version 2, the keyed BLAKE2b state copied for each element, and the mask of each member
+        self.keyed = None
+        self.salt_masks = []
+        if self.salt_version == 2:
+            self.keyed = hashlib.blake2b(key=self.hash_salts[0][:hashlib.blake2b.MAX_KEY_SIZE],
+                                         digest_size=self.KEYED_DIGEST_SIZE)
+            self.salt_masks = [np.frombuffer(self.hash_salts[i % len(self.hash_salts)][:self.KEYED_DIGEST_SIZE],
+                                             dtype=np.uint8) for i in range(len(self.hash_family))]
+        # Where to truncate the hash digest, and the excess bits to shift off the last byte
+        self.bytes_needed = (self.bit_mapping + 7) // 8
+        self.shift = (8 - self.bit_mapping % 8) % 8
+        # Cumulative time (in seconds) and number of digests for each member of the hash family
+        self.timings = [0.0] * len(self.hash_family)
+        self.calls = [0] * len(self.hash_family)
+        # With double hashing, the k indexes are taken modulo the number of cells
+        self.index_mask = (1 << self.bit_mapping) - 1
+        # Cell indexes of every coordinate of the grids hashed with this engine, by grid
+        self.grid_cache = {}
+
+    def __reduce__(self):
+        """
+        Pickles the engine by its configuration, so it can be shipped to worker processes.
+        """
+        return self.__class__, (self.hash_family, self.bit_mapping, self.hash_salts, self.index_mode,
+                                self.salt_version, self.element_format)
+
+    @staticmethod
+    def _constructor(hf):
+        """
+        Returns the constructor of a hash function.
+        Functions hashlib does not expose by name (e.g. md4) go through hashlib.new.
+        :param hf: the name of the hash function.
+        :return: a callable returning a new hash object.
+        """
+        constructor = getattr(hashlib, hf, None)
+        if constructor is None:
+            constructor = partial(hashlib.new, hf)
+        return constructor
+
+    def salt(self, element):
+        """
+        XORs the element, byte by byte (as char by char), with the salt.
+        The element is truncated to the length of the salt.
+        :param element: the element (string, or bytes of a packed coordinate) to be salted.
+        :return: the salted buffer (bytes).
+        """
+        data = element if isinstance(element, bytes) else element.encode('latin-1')
+        data = data[:len(self.hash_salts[0])]
+        n = len(data)
+        return (int.from_bytes(data, 'big') ^ int.from_bytes(self.hash_salts[0][:n], 'big')).to_bytes(n, 'big')
+
+    def encode(self, elements):
+        """
+        Converts a batch of elements to the element format of the engine.
+        Elements are "lat#lon" strings, packed coordinates (bytes), or an array of packed coordinates
+        (grid.PACKED_DTYPE). With the string format, packed coordinates are formatted as their string; with the
+        packed format, coordinate strings are packed, so both forms of a coordinate map to the same cells. Strings
+        that are not coordinates are kept as they are.
+        :param elements: sequence of elements, or an array of packed coordinates.
+        :return: list of elements, as strings or bytes.
+        """
+        if isinstance(elements, np.ndarray) and (elements.dtype == PACKED_DTYPE):
+            if self.element_format == 'packed':
+                raw = np.ascontiguousarray(elements).tobytes()
+                width = PACKED_DTYPE.itemsize
+                return [raw[i:i + width] for i in range(0, len(raw), width)]
+            elements = [bytes(packed) for packed in elements]
+
+        encoded = []
+        for element in elements:
+            if isinstance(element, str):
+                if self.element_format == 'packed':
+                    element = element_packed(element) or element
+            elif self.element_format == 'string':
+                element = packed_element(element)
+            else:
+                element = bytes(element)
+            encoded.append(element)
+        return encoded
+
+    def salted(self, elements, count):
+        """
+        Salts a batch of elements for the first members of the hash family.
+        With salt version 1 every member hashes the same XOR-salted buffer. With salt version 2 the whole element
+        (UTF-8) is digested once with keyed BLAKE2b, so long elements are not truncated, and each member hashes the
+        digest XORed with its own salt, the whole batch at once.
+        An array of packed coordinates is XOR-salted in one vectorized pass.
+        :param elements: sequence of elements to be salted, or an array of packed coordinates.
+        :param count: the number of members of the hash family to salt for.
+        :return: list of count lists of salted buffers (bytes), one per element.
+        """
+        if self.salt_version == 1:
+            if isinstance(elements, np.ndarray) and (elements.dtype == PACKED_DTYPE) \
+                    and (self.element_format == 'packed') and (len(self.hash_salts[0]) >= PACKED_DTYPE.itemsize):
+                width = PACKED_DTYPE.itemsize
+                salt = np.frombuffer(self.hash_salts[0][:width], dtype=np.uint8)
+                raw = (np.ascontiguousarray(elements).view(np.uint8).reshape(-1, width) ^ salt).tobytes()
+                return [[raw[i:i + width] for i in range(0, len(raw), width)]] * count
+            return [[self.salt(element) for element in self.encode(elements)]] * count
+
+        data = [element if isinstance(element, bytes) else element.encode('utf-8')
+                for element in self.encode(elements)]
+        digests = []
+        for d in data:
+            h = self.keyed.copy()
+            h.update(d)
+            digests.append(h.digest())
+
+        width = self.KEYED_DIGEST_SIZE
+        digests = np.frombuffer(b''.join(digests), dtype=np.uint8).reshape(len(data), width)
+        buffers = []
+        for mask in self.salt_masks[:count]:
+            raw = (digests ^ mask).tobytes()
+            buffers.append([raw[i:i + width] for i in range(0, len(raw), width)])
+        return buffers
+
+    def indexes(self, element):
+        """
+        Computes the cell indexes of an element, one per hash function of the hash family.
+        :param element: the element (string, or bytes of a packed coordinate) to be mapped.
+        :return: list of cell indexes.
+        """
+        indexes = []
+
+        if self.index_mode == 'double':
+            buffer = self.salted([element], 1)[0][0]
+            start = time.perf_counter()
+            digest = self.constructors[0](buffer).digest()
+            self.timings[0] += time.perf_counter() - start
+            self.calls[0] += 1
+
+            # An odd step visits every cell before repeating one
+            h1 = int.from_bytes(digest[:8], byteorder=byteorder)
+            h2 = int.from_bytes(digest[8:16], byteorder=byteorder) | 1
+            return [(h1 + i * h2) & self.index_mask for i in range(len(self.constructors))]
+
+        buffers = self.salted([element], len(self.constructors))
+        for i, constructor in enumerate(self.constructors):
+            start = time.perf_counter()
+            digest = constructor(buffers[i][0]).digest()
+            self.timings[i] += time.perf_counter() - start
+            self.calls[i] += 1
+
+            index = int.from_bytes(digest[:self.bytes_needed], byteorder=byteorder)
+            indexes.append(index >> self.shift)
+
+        return indexes
+
+    def indexes_many(self, elements):
+        """
+        Computes the cell indexes of a batch of elements.
+        The whole batch is salted up front; the truncated digests of each hash function are then turned into
+        indexes with a single vectorized conversion.
+        :param elements: sequence of elements (strings or packed coordinates), or an array of packed coordinates.
+        :return: (n_elements x k_hashes) array of cell indexes.
+        """
+        indexes = np.empty((len(elements), len(self.constructors)), dtype=np.uint64)
+
+        if self.index_mode == 'double':
+            buffers = self.salted(elements, 1)[0]
+            start = time.perf_counter()
+            digests = b''.join([self.constructors[0](buffer).digest()[:16] for buffer in buffers])
+            self.timings[0] += time.perf_counter() - start
+            self.calls[0] += len(buffers)
+
+            # The uint64 arithmetic wraps modulo 2^64, as the mask of the cells divides it
+            halves = np.frombuffer(digests, dtype=np.uint64).reshape(len(buffers), 2)
+            steps = np.arange(len(self.constructors), dtype=np.uint64)
+            np.bitwise_and(halves[:, :1] + steps * (halves[:, 1:] | np.uint64(1)), np.uint64(self.index_mask),
+                           out=indexes)
+            return indexes
+
+        salted = self.salted(elements, len(self.constructors))
+        for i, constructor in enumerate(self.constructors):
+            start = time.perf_counter()
+            digests = b''.join([constructor(buffer).digest()[:self.bytes_needed] for buffer in salted[i]])
+            self.timings[i] += time.perf_counter() - start
+            self.calls[i] += len(elements)
+
+            indexes[:, i] = self._digests_to_indexes(digests, len(elements))
+
+        return indexes
+
+    def grid_indexes(self, grid, chunk_size=65536):
+        """
+        Returns the cell indexes of every coordinate of a grid, hashing the grid on first use.
+        They only depend on the hash family, the bit mapping and the salt, so they are shared by every filter
+        using this engine.
+        :param grid: the coordinate grid (CoordinateGrid).
+        :param chunk_size: the number of coordinates materialised and hashed together.
+        :return: (n_coordinates x k_hashes) array of cell indexes.
+        """
+        indexes = self.grid_cache.get(grid)
+        if indexes is None:
+            indexes = np.empty((grid.size, len(self.constructors)), dtype=np.uint64)
+            for start in range(0, grid.size, chunk_size):
+                stop = min(start + chunk_size, grid.size)
+                if self.element_format == 'packed':
+                    indexes[start:stop] = self.indexes_many(grid.packed(np.arange(start, stop)))
+                else:
+                    indexes[start:stop] = self.indexes_many(grid.elements(range(start, stop)))
+            indexes.setflags(write=False)
+            self.grid_cache[grid] = indexes
+
+        return indexes
+
+    def _digests_to_indexes(self, digests, count):
+        """
+        Converts concatenated truncated digests into cell indexes.
+        The digest bytes are read with the machine byte order, then the excess bits are shifted off.
+        :param digests: the truncated digests (bytes_needed bytes each), concatenated.
+        :param count: the number of digests.
+        :return: array of cell indexes.
+        """
+        raw = np.frombuffer(digests, dtype=np.uint8).reshape(count, self.bytes_needed)
+        padded = np.zeros((count, 8), dtype=np.uint8)
+
+        if byteorder == 'little':
+            padded[:, :self.bytes_needed] = raw
+            values = padded.view('<u8').reshape(count)
+        else:
+            padded[:, 8 - self.bytes_needed:] = raw
+            values = padded.view('>u8').reshape(count)
+
+        return values.astype(np.uint64) >> np.uint64(self.shift)
+
+    @staticmethod
+    def truncate_indexes(indexes, bit_mapping):
+        """
+        Derives the cell indexes of a 2^bit_mapping filter from the ones of a 2^64 filter, as if the same digests
+        had been truncated to bit_mapping bits: the first bytes of the digest are kept, read with the machine byte
+        order, and the excess bits shifted off.
+        :param indexes: array of cell indexes computed with a bit mapping of 64.
+        :param bit_mapping: the bit mapping of the derived indexes.
+        :return: array of cell indexes, of the same shape.
+        """
+        indexes = np.asarray(indexes, dtype=np.uint64)
+        if byteorder == 'big':
+            return indexes >> np.uint64(64 - bit_mapping)
+
+        bytes_needed = (bit_mapping + 7) // 8
+        mask = np.uint64((1 << (8 * bytes_needed)) - 1)
+        return (indexes & mask) >> np.uint64(8 * bytes_needed - bit_mapping)
+
+    def add_timings(self, timings, calls):
+        """
+        Adds the timings measured by another engine (e.g. in a worker process) to this one.
+        :param timings: list of seconds, one per member of the hash family.
+        :param calls: list of number of digests, one per member of the hash family.
+        """
+        for i in range(len(self.hash_family)):
+            self.timings[i] += timings[i]
+            self.calls[i] += calls[i]
+
+    def get_timings(self):
+        """
+        Returns the time spent in each member of the hash family.
+        :return: a dictionary with the hash function as the key and list [calls, seconds] as the value.
+        """
+        return {hf: [self.calls[i], self.timings[i]] for i, hf in enumerate(self.hash_family)}
+
+
+def _hash_chunk(hash_engine, elements):
+    """
+    Computes the cell indexes of a chunk of elements in a worker process.
+    :param hash_engine: the hashing component of the filter being built.
+    :param elements: the elements of the chunk.
+    :return: a tuple (indexes, timings, calls) with the index matrix and the hashing time spent in the worker.
+    """
+    return hash_engine.indexes_many(elements), hash_engine.timings, hash_engine.calls
+
+
 class sbf:
 
     # This value defines the maximum  number of cells of the SBF:
     MAX_BIT_MAPPING = 64
+    # Filters up to 2^DENSE_MAX_BIT_MAPPING cells store every cell, larger ones only the non-zero cells
+    DENSE_MAX_BIT_MAPPING = 24
     # The available hash families
     HASH_FAMILIES = ['md4', 'md5', 'sha1', 'sha224', 'sha256', 'sha384', 'sha512', 'sha3_256', 'sha3_512']
-
-    def __init__(self, hash_family, bit_mapping=10, hash_salt_path="default"):
+    # The maximum number of check results kept in the cache
+    CHECK_CACHE_SIZE = 4096
+    # Generations are drawn from one counter, so no two filters (or states of a filter) share one
+    GENERATIONS = count(1)
+    # Binary file format: magic, format version, header length, JSON header, then the cells and the grid areas,
+    # each aligned to FILE_ALIGNMENT bytes
+    FILE_MAGIC = b'SBF\x00'
+    FILE_VERSION = 6
+    FILE_ALIGNMENT = 64
+
+    def __init__(self, hash_family, bit_mapping=10, hash_salt_path="default", grid=None, hash_engine=None,
+                 cell_backend=None, num_areas=4, index_mode='digest', salt_version=1, element_format='string'):
         """
         Initialises the SBF class.
         :param bit_mapping: filter composed of 2^bit_mapping cells.
         :param hash_family: the hash family used
+        :param grid: the coordinate grid (CoordinateGrid) of the map, shared between filters; defaults to Cork.
+        :param hash_engine: the hashing component (HashEngine) of a filter with the same hash family, bit mapping
+                            and salt, to share with it; the hash salts are then not reloaded.
+        :param cell_backend: the storage of the cells, one of CELL_BACKENDS: 'dense' stores every cell, 'sparse'
+                             only the non-zero ones. Defaults to dense up to 2^DENSE_MAX_BIT_MAPPING cells.
+        :param num_areas: the number of areas, labelled 1 to num_areas.
+        :param index_mode: 'digest' to hash the element with every member of the hash family, 'double' to derive
+                           the k indexes from a single digest of the first member (Kirsch-Mitzenmacher); the other
+                           members then only name the k "virtual" hash functions in the check results.
+        :param salt_version: 1 to XOR the (truncated) element with the salt, 2 to hash the whole element with keyed
+                             BLAKE2b, a distinct salt per hash function. Filters of different versions map the same
+                             element to different cells, so they cannot be mixed.
+        :param element_format: the form coordinates are hashed in: 'string' ("lat#lon") or 'packed' (fixed-width
+                               integer coordinates, see grid.pack_coordinates). Either filter accepts both forms, but
+                               packed coordinates skip the string round trip on a packed filter, and vice versa.
         :raise AttributeError: the arguments are out of bounds
         :raise IOError: error with the file
         :except IOError: error with file
@@ -43,25 +386,56 @@ class sbf:
         for self.i in self.hash_family:
             if self.i not in self.HASH_FAMILIES:
                 raise AttributeError("Invalid hash family.")
+        if cell_backend is None:
+            cell_backend = 'dense' if self.bit_mapping <= self.DENSE_MAX_BIT_MAPPING else 'sparse'
+        if cell_backend not in CELL_BACKENDS:
+            raise AttributeError("Invalid cell backend.")
+        if num_areas <= 0:
+            raise AttributeError("Invalid number of areas.")
+        if index_mode not in HashEngine.INDEX_MODES:
+            raise AttributeError("Invalid index mode.")
+        if salt_version not in HashEngine.SALT_VERSIONS:
+            raise AttributeError("Invalid salt version.")
+        if element_format not in HashEngine.ELEMENT_FORMATS:
+            raise AttributeError("Invalid element format.")
+        if (element_format == 'packed') and (grid is not None) and (grid.precision != PACKED_PRECISION):
+            raise AttributeError("Invalid grid.")
+        self.index_mode = index_mode
+        self.salt_version = salt_version
+        self.element_format = element_format
+        self.cell_backend = cell_backend
 
-        # The number of bytes required for each cell
-        self.cell_size = 1
-
-        self.hash_salts = []
-        try:
-            with open(self.hash_salt_path) as self.salt_file:
-                self.hash_salts = self._load_hash_salt(self.salt_file)
-        except IOError:
-            raise IOError("Error opening hash salts")
+        # number of areas
+        self.num_areas = num_areas
+        # The number of bits, and bytes, required for each cell
+        self.cell_bits = cell_bits(self.num_areas)
+        self.cell_size = self.cell_bits / 8
+
+        if hash_engine is not None:
+            if (hash_engine.hash_family != self.hash_family) or (hash_engine.bit_mapping != self.bit_mapping) \
+                    or (hash_engine.index_mode != self.index_mode) or (hash_engine.salt_version != self.salt_version) \
+                    or (hash_engine.element_format != self.element_format):
+                raise AttributeError("Invalid hash engine.")
+            self.hash_salts = hash_engine.hash_salts
+        else:
+            self.hash_salts = []
+            try:
+                with open(self.hash_salt_path) as self.salt_file:
+                    self.hash_salts = self._load_hash_salt(self.salt_file)
+            except IOError:
+                raise IOError("Error opening hash salts")
+            hash_engine = HashEngine(self.hash_family, self.bit_mapping, self.hash_salts, self.index_mode,
+                                     self.salt_version, self.element_format)
+
+        # Hashing component shared by insert, check and the batch paths
+        self.hash_engine = hash_engine
 
         # The number of cells in the filter
         self.num_cells = pow(2, self.bit_mapping)
 
         # Initializes the cells to 0
-        self.filter = np.array(np.repeat(0, self.num_cells), dtype=np.uint8)
+        self.filter = new_cells(self.cell_backend, self.num_cells, self.cell_bits)
 
-        # number of areas
-        self.num_areas = 4
         # number of elements in the filter
         self.members = 0
         # number of collisions in the filter
@@ -76,9 +450,18 @@ class sbf:
         self.area_self_collisions = [0] * (self.num_areas + 1)
         # list of file from which elements have been inserted
         self.insert_file_list = []
-        # all coordinates from cork map with csv removed
-        self.all_coors = []
-        self._coors()
+        # the coordinate grid of the map, and the area of the dataset coordinate of each grid cell (0 if none)
+        self.grid = CORK_GRID if grid is None else grid
+        self.grid_areas = np.zeros(self.grid.size, dtype=self.filter.dtype)
+        # the evaluation of the grid against the current filter
+        self.grid_report = None
+        # mutation generation of the filter, renewed on every change of the cells
+        self.generation = next(self.GENERATIONS)
+        # generation at which the grid evaluation and the incorrect areas were computed
+        self.grid_report_generation = -1
+        self.incorrect_areas_generation = -1
+        # LRU cache of check results: element -> (generation, result)
+        self.check_cache = OrderedDict()
         # incorrect SBF values
         self.incorrect_areas = {}
         # fpp SBF values
@@ -141,70 +524,221 @@ class sbf:
         For each hash function, internal method set_cell is called, passing elements coupled with the area labels.
         The elements MUST be passed following the ascending-order of area labels.
         If this is not the case, the self-collision calculation (done by set_cell) will likely be wrong.
-        :param element: element to be mapped (as a string)
+        :param element: element to be mapped (as a string, or a packed coordinate)
         :param area: the area label (int)
         """
-        self.element = element
-        self.area = area
+        for index in self.hash_engine.indexes(element):
+            self._set_cell(index, area)
 
-        for self.i in self.hash_family:
+        self.members += 1
+        self.area_members[area] += 1
+        grid_index = self.grid.index_of(element)
+        if (grid_index >= 0) and (self.grid_areas[grid_index] < area):
+            self.grid_areas[grid_index] = area
+        self.generation = next(self.GENERATIONS)
 
-            # XOR byte by byte (as char by char) of the element string with the salt
-            self.buffer = bytes(''.join([chr(ord(a) ^ b)
-                                         for (a, b) in zip(self.element, self.hash_salts[0])]), 'latin-1')
+    def insert_many(self, elements, areas):
+        """
+        Inserts a batch of elements into the SBF filter.
+        The cell indexes of the whole batch are computed first, then written with the area-priority rule
+        (higher area wins) in a single vectorized pass. The elements are applied in the given order, so the
+        filter and every counter end up exactly as after consecutive calls to insert.
+        :param elements: sequence of elements to be mapped (as strings or packed coordinates), or an array of packed
+                         coordinates (see grid.pack_coordinates).
+        :param areas: sequence of area labels (int), one per element.
+        :raise AttributeError: the arguments differ in length or an area label is out of bounds.
+        """
+        areas = np.asarray(areas, dtype=np.int64).reshape(-1)
+        if len(elements) != len(areas):
+            raise AttributeError("Elements and areas differ in length.")
+        if len(areas) == 0:
+            return
 
-            # Initializes the hash function according to the hash family
-            if self.i == 'sha3_256':
-                self.m = hashlib.sha3_256()
-            elif self.i == 'sha3_512':
-                self.m = hashlib.sha3_512()
-            else:
-                self.m = hashlib.new(self.i)
+        self._apply_indexes(self.hash_engine.indexes_many(elements), areas)
+        self._map_coordinates(elements, areas)
 
-            self.m.update(self.buffer)
+    def _apply_indexes(self, indexes, areas):
+        """
+        Writes a batch of cell indexes into the filter, replaying the collision handling of _set_cell.
+        Writes are ordered element by element, and hash function by hash function within an element. For every
+        write the value the cell held just before it is recovered with a per-cell running maximum, which is all
+        _set_cell needs to decide between a plain write, an overwrite, a self-collision or a lost collision.
+        :param indexes: (n_elements x k_hashes) array of cell indexes.
+        :param areas: array of n_elements area labels.
+        :raise AttributeError: an area label is out of bounds.
+        """
+        if (areas.min() <= 0) or (areas.max() > self.num_areas):
+            raise AttributeError("Invalid area number.")
 
-            # We allow a maximum SBF mapping of 10 bit (resulting in 2^10 cells).
-            # Thus, the hash digest is truncated after the first 10 bites.
-            self.digest = self._bits_of(self.m.digest(), self.bit_mapping)
+        span = self.num_areas + 1
+        cells = indexes.reshape(-1).astype(np.uint64)
+        writes = np.repeat(areas, indexes.shape[1])
+
+        # Groups the writes by cell, keeping their insertion order within each cell
+        order = np.argsort(cells, kind='stable')
+        cells = cells[order]
+        writes = writes[order]
+        touched, starts, counts = np.unique(cells, return_index=True, return_counts=True)
+        group = np.repeat(np.arange(len(touched)), counts)
+        previous = self.filter[touched].astype(np.int64)
+
+        # Segmented running maximum: offsetting each group keeps the maxima from leaking across cells
+        offset = group * span
+        running = np.maximum.accumulate(writes + offset) - offset
+        before = np.empty_like(running)
+        before[1:] = running[:-1]
+        before[starts] = 0
+        before = np.maximum(before, previous[group])
+
+        final = np.maximum(previous, running[starts + counts - 1])
+        self.filter[touched] = final
+
+        self.members += len(areas)
+        self.collisions += int(np.count_nonzero(before))
+        member_counts = np.bincount(areas, minlength=span)
+        self_collisions = np.bincount(writes[before == writes], minlength=span)
+        cell_counts = np.bincount(final, minlength=span) - np.bincount(previous, minlength=span)
+
+        for a in range(1, span):
+            self.area_members[a] += int(member_counts[a])
+            self.area_self_collisions[a] += int(self_collisions[a])
+            self.area_cells[a] += int(cell_counts[a])
+
+        self.generation = next(self.GENERATIONS)
+
+    def insert_from_file(self, dataset_path=None, workers=None, chunk_size=10000, progress=None):
+        """
+        Insert the elements from a dataset CSV file (dataset_path).
+        The CSV has one area-element couple per line (in this order),
+        separated by the value dataset_delimiter, which defaults to ','.
+        :param dataset_path: the path of the CSV file, defaults to the cork dataset.
+        :param workers: the number of worker processes used for hashing, None to build serially.
+        :param chunk_size: the number of rows hashed together.
+        :param progress: optional callable, called with the number of rows inserted so far after each chunk.
+        """
+        if dataset_path is None:
+            dataset_path = self._get_dataset_path()
 
-            self.index = int(self.digest % pow(2, self.bit_mapping))
+        self.insert_from(dataset_path, workers=workers, chunk_size=chunk_size, progress=progress)
 
-            self._set_cell(self.index, self.area)
+    def insert_from(self, source, delimiter=',', workers=None, chunk_size=10000, progress=None):
+        """
+        Inserts a stream of area-element couples into the SBF filter.
+        The source is read lazily and inserted chunk by chunk, so memory stays bounded by the chunk size
+        whatever the size of the dataset. With workers set, the chunks are hashed in a pool of processes;
+        they are still written to the filter in order, so the result is identical to a serial build.
+        :param source: a path to a CSV file, an open CSV file object, or an iterable of (area, element) couples.
+                       The CSV has one area-element couple per line (in this order), separated by delimiter.
+        :param delimiter: the CSV delimiter.
+        :param workers: the number of worker processes used for hashing, None to build serially.
+        :param chunk_size: the number of couples hashed together.
+        :param progress: optional callable, called with the number of couples inserted so far after each chunk.
+        """
+        inserted = 0
 
-        self.members += 1
-        self.area_members[self.area] += 1
+        chunks = self._chunked(self._read_pairs(source, delimiter), chunk_size)
+        for elements, areas, indexes in self._hash_chunks(chunks, workers):
+            self._apply_indexes(indexes, np.asarray(areas, dtype=np.int64))
+            self._map_coordinates(elements, areas)
+            inserted += len(elements)
+            if progress is not None:
+                progress(inserted)
 
-        del self.buffer
-        del self.digest
-        del self.m
-        del self.i
-        del self.element
+        if isinstance(source, (str, Path)):
+            self.insert_file_list.append(str(source))
+        elif hasattr(source, 'name'):
+            self.insert_file_list.append(source.name)
 
-    def insert_from_file(self):
+    @staticmethod
+    def _read_pairs(source, delimiter=','):
         """
-        Insert the elements from a dataset CSV file (dataset_path).
-        The CSV has one area-element couple per line (in this order),
-        separated by the value dataset_delimiter, which defaults to ','.
+        Lazily reads area-element couples from a source.
+        :param source: a path to a CSV file, an open CSV file object, or an iterable of (area, element) couples.
+        :param delimiter: the CSV delimiter.
+        :return: generator of (area, element) couples, with the area label as an int.
         """
+        if isinstance(source, (str, Path)):
+            with open(source, 'r', newline='') as dataset_file:
+                for row in csv.reader(dataset_file, delimiter=delimiter):
+                    yield int(row[0]), row[1]
+        elif hasattr(source, 'read'):
+            for row in csv.reader(source, delimiter=delimiter):
+                yield int(row[0]), row[1]
+        else:
+            for area, element in source:
+                yield int(area), element
 
-        self.dataset_path = self._get_dataset_path()
-        self.dataset_delimiter = ','
-        self._coors()
-
-        with open(self.dataset_path, 'r') as self.dataset_file:
-            self.dataset_reader = csv.reader(self.dataset_file, delimiter=self.dataset_delimiter)
-            for self.row in self.dataset_reader:
-                self.insert(self.row[1], int(self.row[0]))
-                self.all_coors.remove(self.row[1])
+    @staticmethod
+    def _chunked(pairs, chunk_size):
+        """
+        Groups area-element couples into chunks.
+        :param pairs: iterable of (area, element) couples.
+        :param chunk_size: the maximum number of couples per chunk.
+        :return: generator of (elements, areas) couples of lists.
+        """
+        pairs = iter(pairs)
+        while True:
+            chunk = list(islice(pairs, chunk_size))
+            if not chunk:
+                return
+            yield [element for _, element in chunk], [area for area, _ in chunk]
+
+    def _hash_chunks(self, chunks, workers=None):
+        """
+        Computes the cell indexes of chunks of (elements, areas), yielding them in the order of the chunks.
+        With more than one worker and more than one chunk, the chunks are hashed in a process pool, keeping a
+        bounded number of chunks in flight.
+        :param chunks: iterable of (elements, areas) couples.
+        :param workers: the number of worker processes, None (or 1) to hash in this process.
+        :return: generator of (elements, areas, indexes) triples.
+        """
+        # A pool only pays off for more than one chunk
+        chunks = iter(chunks)
+        first = list(islice(chunks, 2))
+        if workers is None or workers <= 1 or len(first) <= 1:
+            for elements, areas in chain(first, chunks):
+                yield elements, areas, self.hash_engine.indexes_many(elements)
+            return
+
+        pending = deque()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for elements, areas in chain(first, chunks):
+                pending.append((elements, areas, executor.submit(_hash_chunk, self.hash_engine, elements)))
+                if len(pending) >= 2 * workers:
+                    yield self._collect_chunk(*pending.popleft())
+            while pending:
+                yield self._collect_chunk(*pending.popleft())
+
+    def _collect_chunk(self, elements, areas, future):
+        """
+        Waits for a chunk hashed by a worker process, and accounts its hashing time.
+        :param elements: the elements of the chunk.
+        :param areas: the area labels of the chunk.
+        :param future: the future of the worker computing the chunk indexes.
+        :return: the (elements, areas, indexes) triple of the chunk.
+        """
+        indexes, timings, calls = future.result()
+        self.hash_engine.add_timings(timings, calls)
+        return elements, areas, indexes
 
-        self.insert_file_list.append(self.dataset_path)
+    def _map_coordinates(self, elements, areas):
+        """
+        Records the grid cells of the inserted elements, with their area label.
+        Elements that are not cells of the grid are ignored.
+        :param elements: sequence of inserted elements.
+        :param areas: sequence of their area labels.
+        """
+        indexes = self.grid.indexes_of(elements)
+        mapped = indexes >= 0
+        np.maximum.at(self.grid_areas, indexes[mapped], np.asarray(areas, dtype=self.grid_areas.dtype)[mapped])
 
-        del self.dataset_delimiter
-        del self.dataset_path
-        self.dataset_file.close()
-        del self.dataset_file
-        del self.dataset_reader
-        del self.row
+    @property
+    def all_coors(self):
+        """
+        Returns the coordinates of the map that are not in the dataset, materialising them as strings.
+        :return: list of "lat#lon" coordinates.
+        """
+        return self.grid.elements(np.flatnonzero(self.grid_areas == 0))
 
     def _set_cell(self, index, area):
         """
@@ -248,41 +782,128 @@ class sbf:
         Verifies weather the input element belongs to one of the mapped areas.
         Returns the area label (i.e. the identifier of the set) if the element
         belongs to an area, 0 otherwise.
-        :param element: the element (string) to be checked against the filter.
+        Results are cached (LRU) until the filter next changes; the returned dictionary must not be modified.
+        :param element: the element (string, or packed coordinate) to be checked against the filter.
         :return: the area the element belongs to, or 0, if the element is not a member of any area.
         """
+        if isinstance(element, np.void):
+            element = bytes(element)
+
+        cached = self.check_cache.get(element)
+        if cached is not None:
+            self.check_cache.move_to_end(element)
+            generation, value_indexes = cached
+            if generation == self.generation:
+                return value_indexes
+            # The indexes never go stale, only the areas of the cells do
+            indexes = [value_indexes[hf][0] for hf in self.hash_family]
+        else:
+            indexes = self.hash_engine.indexes(element)
 
-        self.element = element
-        self.current_area = 0
-        self.value_indexes = {}
+        value_indexes = {}
+        for hf, index in zip(self.hash_family, indexes):
+            value_indexes[hf] = [index, self.filter[index]]
 
-        for self.i in self.hash_family:
+        self.check_cache[element] = (self.generation, value_indexes)
+        if len(self.check_cache) > self.CHECK_CACHE_SIZE:
+            self.check_cache.popitem(last=False)
 
-            self.buffer = bytes(''.join([chr(ord(a) ^ b)
-                                         for (a, b) in zip(self.element, self.hash_salts[0])]), 'latin-1')
+        return value_indexes
 
-            if self.i == 'sha3_256':
-                self.m = hashlib.sha3_256()
-            elif self.i == 'sha3_512':
-                self.m = hashlib.sha3_512()
-            else:
-                self.m = hashlib.new(self.i)
+    def check_many(self, elements):
+        """
+        Checks a batch of elements against the filter with a single gather on the filter cells.
+        Row i of the returned matrices holds, for the i-th element, one column per hash function of the hash family
+        (in hash family order), as check does in its [index, area] lists.
+        :param elements: sequence of elements (strings or packed coordinates), or an array of packed coordinates, to
+                         be checked against the filter.
+        :return: a tuple (indexes, areas, min_areas): the (n_elements x k_hashes) matrix of cell indexes, the
+                 matching matrix of area labels, and the resolved area of each element (0 if not a member).
+        """
+        indexes = self.hash_engine.indexes_many(elements)
+        areas = self.filter[indexes]
 
-            self.m.update(self.buffer)
-            self.digest = self._bits_of(self.m.digest(), self.bit_mapping)
-            self.index = int(self.digest % pow(2, self.bit_mapping))
-            self.current_area = self.filter[self.index]
-            self.value_indexes[self.i] = [self.index, self.current_area]
+        return indexes, areas, areas.min(axis=1)
 
-        del self.buffer
-        del self.digest
-        del self.m
-        del self.i
-        del self.current_area
-        del self.index
-        del self.element
+    def check_radius(self, lat, lon, radius):
+        """
+        Checks the neighbourhood of a coordinate against the filter: every lattice coordinate within radius steps
+        (of 10^-precision degrees, the resolution of the grid) of it, in one vectorized gather.
+        Only the neighbours are hashed, in one batch, unless the grid has already been hashed (by evaluate_grid), in
+        which case its cached cell indexes are reused for the neighbours that are cells of the grid. The neighbours
+        are ordered by distance, the coordinate itself first.
+        The report holds the integer coordinates of the neighbours ("Latitudes", "Longitudes") and their distance in
+        steps ("Distances"), their (n_neighbours x k_hashes) matrices of cell indexes ("Indexes") and areas ("Areas"),
+        and their resolved areas ("Min Areas"). The neighbourhood as a whole is summed up by the highest area found
+        ("Area", 0 if none), the number of neighbours resolved to each area ("Area Counts") and the distance to the
+        nearest neighbour of each area ("Area Distances", None if the area is not found).
+        :param lat: the latitude, in degrees.
+        :param lon: the longitude, in degrees.
+        :param radius: the radius of the neighbourhood, in steps of the grid (int).
+        :return: a dictionary with the evaluation of the neighbourhood.
+        :raise AttributeError: the radius is out of bounds.
+        """
+        if (int(radius) != radius) or (radius < 0):
+            raise AttributeError("Invalid radius.")
+
+        d_lats, d_lons, distances = self._radius_offsets(int(radius))
+        lats = int(round(lat * self.grid.scale)) + d_lats
+        lons = int(round(lon * self.grid.scale)) + d_lons
+
+        indexes = np.empty((len(lats), len(self.hash_family)), dtype=np.uint64)
+        inside = np.zeros(len(lats), dtype=bool)
+        cached = self.hash_engine.grid_cache.get(self.grid)
+        if cached is not None:
+            grid_indexes = self.grid.indexes_at(lats, lons)
+            inside = grid_indexes >= 0
+            indexes[inside] = cached[grid_indexes[inside]]
+        hashed = ~inside
+        if hashed.any():
+            if self.element_format == 'packed':
+                elements = pack_units(lats[hashed], lons[hashed])
+            else:
+                elements = self.grid.elements_at(lats[hashed], lons[hashed])
+            indexes[hashed] = self.hash_engine.indexes_many(elements)
+
+        areas = self.filter[indexes]
+        min_areas = areas.min(axis=1)
+        area_counts = np.bincount(min_areas, minlength=self.num_areas + 1)
+        # The neighbours are sorted by distance, so the first one of each area is its nearest
+        found, first = np.unique(min_areas, return_index=True)
+        area_distances = [None] * (self.num_areas + 1)
+        for a, i in zip(found.tolist(), first.tolist()):
+            area_distances[a] = float(distances[i])
+
+        return {
+            "Latitudes": lats,
+            "Longitudes": lons,
+            "Distances": distances,
+            "Indexes": indexes,
+            "Areas": areas,
+            "Min Areas": min_areas,
+            "Area": int(min_areas.max()),
+            "Area Counts": area_counts.tolist(),
+            "Area Distances": area_distances,
+        }
 
-        return self.value_indexes
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def _radius_offsets(radius):
+        """
+        Returns the offsets of the lattice coordinates within a radius, computed once per radius.
+        :param radius: the radius, in steps of the grid.
+        :return: a tuple (d_lats, d_lons, distances) of read-only arrays, sorted by distance.
+        """
+        steps = np.arange(-radius, radius + 1, dtype=np.int64)
+        d_lats, d_lons = (axis.reshape(-1) for axis in np.meshgrid(steps, steps, indexing='ij'))
+        squared = d_lats * d_lats + d_lons * d_lons
+        within = squared <= radius * radius
+        order = np.argsort(squared[within], kind='stable')
+
+        offsets = (d_lats[within][order], d_lons[within][order], np.sqrt(squared[within][order]))
+        for array in offsets:
+            array.setflags(write=False)
+        return offsets
 
     def update_stats(self):
         """
@@ -301,26 +922,23 @@ class sbf:
         self.stats['Number of Hash Collisions'] = str(self.collisions)
 
     def area_stats(self):
+        """
+        Returns the properties and the stats of each area, as strings; update_stats must have been called.
+        :return: a tuple of dictionaries, keyed by area label (right-justified, so they sort numerically): the lists
+                 [members, cells, expected cells, self collisions] and [emersion, fpp, isep].
+        """
         self.area_properties, self.area_stats2 = {}, {}
+        emersion = self._area_emersions()
+        width = len(str(self.num_areas))
 
-        for self.j in range(1, self.num_areas + 1):
-            stats1 = [str(self.area_members[self.j]), str(self.area_cells[self.j]),
-                      str(self.area_members[self.j] * len(self.hash_family)),
-                      str(self.area_self_collisions[self.j])]
-
-            self.area_properties[str(self.j).rjust(len(str(self.num_areas)))] = stats1
+        for area in range(1, self.num_areas + 1):
+            key = str(area).rjust(width)
+            self.area_properties[key] = [str(self.area_members[area]), str(self.area_cells[area]),
+                                         str(self.area_members[area] * len(self.hash_family)),
+                                         str(self.area_self_collisions[area])]
+            self.area_stats2[key] = ['{:.{prec}f}'.format(round(value, self.precision), prec=self.precision)
+                                     for value in (emersion[area], self.area_fpp[area], self.area_isep[area])]
 
-        for self.j in range(1, self.num_areas + 1):
-            stats2 = [str('{:.{prec}f}'.format(round(self._area_emersion(self.j), self.precision),
-                                               prec=self.precision)),
-                      str('{:.{prec}f}'.format(round(self.area_fpp[self.j], self.precision),
-                                               prec=self.precision)),
-                      str('{:.{prec}f}'.format(round(self.area_isep[self.j], self.precision),
-                                               prec=self.precision))]
-
-            self.area_stats2[str(self.j).rjust(len(str(self.num_areas)))] = stats2
-
-        del self.j
         return self.area_properties, self.area_stats2
 
     def _filter_sparsity(self):
@@ -328,37 +946,28 @@ class sbf:
         Returns the sparsity of the entire SBF filter.
         :return: the filter sparsity
         """
-
-        self.sparsity_sum = 0
-
-        for self.i in range(1, self.num_areas + 1):
-            self.sparsity_sum += self.area_cells[self.i]
-
-        return 1 - (self.sparsity_sum / self.num_cells)
+        return 1 - (sum(self.area_cells[1:]) / self.num_cells)
 
     def _filter_fpp(self):
         """
         Computes the false positive probability over the entire filter.
         :return: the filter false positive probability.
         """
-
-        self.c = 0
-
-        # Counts non-zero cells
-        for self.i in range(1, self.num_areas + 1):
-            self.c += self.area_cells[self.i]
-
-        # Divides by the total number of cells
-        self.p = self.c / self.num_cells
-
-        # to the power of the number of hash functions
-        return pow(self.p, len(self.hash_family))
+        # The fraction of non-zero cells, to the power of the number of hash functions
+        return pow(sum(self.area_cells[1:]) / self.num_cells, len(self.hash_family))
 
     def get_filter(self):
         """
         Returns the filter.
+        Cells packed below a byte are returned unpacked, as a read-only NumPy array (a copy: the filter is not
+        written through it). With the sparse backend this is a SparseCells, which reads like the dense array of
+        cells without materialising them.
         :return the spacial bloom filter
         """
+        if isinstance(self.filter, PackedCells):
+            cells = np.asarray(self.filter)
+            cells.flags.writeable = False
+            return cells
         return self.filter
 
     def get_hash_family(self):
@@ -368,6 +977,21 @@ class sbf:
         """
         return self.hash_family
 
+    def get_hash_timings(self):
+        """
+        Returns the time spent hashing with each member of the hash family.
+        :return: a dictionary with the hash function as the key and list [calls, seconds] as the value.
+        """
+        return self.hash_engine.get_timings()
+
+    def memory_usage(self):
+        """
+        Returns the memory used by the state of this filter, excluding the pieces it shares with other filters
+        (hash engine, grid and grid indexes).
+        :return: the number of bytes.
+        """
+        return self.filter.nbytes + self.grid_areas.nbytes
+
     def get_stats(self):
         """
         Returns a dictionary of statistics of the SBF.
@@ -379,7 +1003,7 @@ class sbf:
         """
         Clear the filter and related information.
         """
-        self.filter = np.array(np.repeat(0, self.num_cells), dtype=np.uint8)
+        self.filter = new_cells(self.cell_backend, self.num_cells, self.cell_bits)
         self.members = 0
         self.collisions = 0
         self.area_members = [0] * (self.num_areas + 1)
@@ -388,38 +1012,230 @@ class sbf:
         self.insert_file_list.clear()
         self.incorrect_areas.clear()
         self.fp_coor.clear()
-        self.all_coors.clear()
-        self._coors()
+        self.grid_areas = np.zeros(self.grid.size, dtype=self.filter.dtype)
+        self.generation = next(self.GENERATIONS)
         self.stats = {
             "Hash Family": str(self.hash_family),
             "Number of Cells": str(self.num_cells),
         }
 
+    def save(self, path):
+        """
+        Saves the filter to a binary file.
+        The file is written next to its destination and renamed over it, so processes that memory-mapped the
+        previous version keep reading a consistent filter.
+        :param path: the path of the file.
+        """
+        prefix, sections, _ = self.binary_layout()
+
+        tmp_path = "{}.tmp{}".format(path, os.getpid())
+        with open(tmp_path, 'wb') as filter_file:
+            filter_file.write(prefix)
+            for offset, array in sections:
+                filter_file.seek(offset)
+                filter_file.write(memoryview(np.ascontiguousarray(array)))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, hash_salt_path="default", mmap=True, grid=None, hash_engine=None):
+        """
+        Loads a filter from a binary file written by save.
+        With mmap, the cells are memory-mapped read-only instead of being read: loading costs no copy, and the
+        processes loading the same file share one copy of it in the page cache. Such a filter can be checked but
+        not modified; load it without mmap to insert into it.
+        :param path: the path of the file.
+        :param hash_salt_path: the path to the hash salt file, which must be the one the filter was built with.
+        :param mmap: True to memory-map the cells, False to read them into memory.
+        :param grid: the coordinate grid (CoordinateGrid) the filter was built with; defaults to Cork.
+        :param hash_engine: the hashing component of a filter with the same configuration, to share with it.
+        :return: the filter (sbf).
+        :raise IOError: the file is not a filter file, or has an unsupported format version.
+        :raise AttributeError: the hash salt or the grid differ from the ones the filter was built with.
+        """
+        with open(path, 'rb') as filter_file:
+            prefix = filter_file.read(len(cls.FILE_MAGIC) + 6)
+            if len(prefix) == len(cls.FILE_MAGIC) + 6:
+                prefix += filter_file.read(struct.unpack('<I', prefix[-4:])[0])
+        header, sections = cls.parse_binary_header(prefix)
+
+        arrays = []
+        for offset, dtype, length in sections:
+            if mmap and length > 0:
+                arrays.append(np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(length,)))
+            else:
+                arrays.append(np.fromfile(path, dtype=dtype, count=length, offset=offset))
+
+        return cls.from_binary(header, arrays, hash_salt_path, grid, hash_engine)
+
+    def binary_layout(self):
+        """
+        Returns the layout of the binary format of the filter: a magic, the format version, the length of the header,
+        the JSON header (configuration, counters and stats), then the sections holding the cells (one for the dense
+        backend, the indexes and the values of the non-zero cells for the sparse one) and the grid areas, each
+        aligned to FILE_ALIGNMENT bytes.
+        :return: a tuple (prefix, sections, size): the bytes up to the end of the header, the list of
+                 (offset, array) sections, and the total size.
+        """
+        if self.cell_backend == 'sparse':
+            arrays = [self.filter.indexes, self.filter.values, self.grid_areas]
+        elif isinstance(self.filter, PackedCells):
+            arrays = [self.filter.data, self.grid_areas]
+        else:
+            arrays = [self.filter, self.grid_areas]
+
+        header = {
+            "version": self.FILE_VERSION,
+            "hash_family": self.hash_family,
+            "bit_mapping": self.bit_mapping,
+            "index_mode": self.index_mode,
+            "salt_version": self.salt_version,
+            "element_format": self.element_format,
+            "salt_fingerprint": self.salt_fingerprint(),
+            "num_areas": self.num_areas,
+            "cell_backend": self.cell_backend,
+            "cell_bits": self.cell_bits,
+            "cell_dtype": self.filter.dtype.str,
+            "cell_count": len(arrays[0]),
+            "members": self.members,
+            "collisions": self.collisions,
+            "area_members": self.area_members,
+            "area_cells": self.area_cells,
+            "area_self_collisions": self.area_self_collisions,
+            "insert_file_list": self.insert_file_list,
+            "stats": self.stats,
+            "grid_size": self.grid.size,
+            "grid_dtype": self.grid_areas.dtype.str,
+        }
+        encoded = json.dumps(header).encode('utf-8')
+        prefix = self.FILE_MAGIC + struct.pack('<HI', self.FILE_VERSION, len(encoded)) + encoded
+
+        sections = [(offset, array) for (offset, _, _), array in
+                    zip(self._binary_sections(header, len(prefix)), arrays)]
+        offset, array = sections[-1]
+
+        return prefix, sections, offset + array.nbytes
+
+    @classmethod
+    def parse_binary_header(cls, prefix):
+        """
+        Parses the header of the binary format of a filter.
+        :param prefix: the bytes of the binary format, at least up to the end of the header.
+        :return: a tuple (header, sections) with the header dictionary and the list of (offset, dtype, length) of
+                 the sections, in the order of binary_layout.
+        :raise IOError: the bytes are not a filter, or have an unsupported format version.
+        """
+        start = len(cls.FILE_MAGIC) + 6
+        if (len(prefix) < start) or (bytes(prefix[:len(cls.FILE_MAGIC)]) != cls.FILE_MAGIC):
+            raise IOError("Invalid filter file.")
+        version, header_length = struct.unpack('<HI', bytes(prefix[len(cls.FILE_MAGIC):start]))
+        if version > cls.FILE_VERSION:
+            raise IOError("Unsupported filter file version.")
+        if len(prefix) < start + header_length:
+            raise IOError("Invalid filter file.")
+        header = json.loads(bytes(prefix[start:start + header_length]).decode('utf-8'))
+
+        return header, cls._binary_sections(header, start + header_length)
+
+    @classmethod
+    def _binary_sections(cls, header, offset):
+        """
+        Lays the sections of the binary format out after the header.
+        :param header: the header dictionary.
+        :param offset: the end of the header.
+        :return: list of (offset, dtype, length) of the sections.
+        """
+        cell_dtype = np.dtype(header["cell_dtype"])
+        bits = header.get("cell_bits", 8 * cell_dtype.itemsize)
+        if header.get("cell_backend", 'dense') == 'sparse':
+            shapes = [(np.dtype(np.uint64), header["cell_count"]), (cell_dtype, header["cell_count"])]
+        elif bits < 8:
+            shapes = [(cell_dtype, -(-pow(2, header["bit_mapping"]) * bits // 8))]
+        else:
+            shapes = [(cell_dtype, pow(2, header["bit_mapping"]))]
+        shapes.append((np.dtype(header.get("grid_dtype", '|u1')), header["grid_size"]))
+
+        sections = []
+        for dtype, length in shapes:
+            offset = cls._aligned(offset)
+            sections.append((offset, dtype, length))
+            offset += length * dtype.itemsize
+
+        return sections
+
+    @classmethod
+    def from_binary(cls, header, arrays, hash_salt_path="default", grid=None, hash_engine=None):
+        """
+        Builds a filter from a parsed binary header and the arrays of its sections, which are used as given (not
+        copied) for the cells.
+        :param header: the header dictionary.
+        :param arrays: the arrays of the sections, in the order of binary_layout.
+        :param hash_salt_path: the path to the hash salt file, which must be the one the filter was built with.
+        :param grid: the coordinate grid (CoordinateGrid) the filter was built with; defaults to Cork.
+        :param hash_engine: the hashing component of a filter with the same configuration, to share with it.
+        :return: the filter (sbf).
+        :raise AttributeError: the hash salt or the grid differ from the ones the filter was built with.
+        """
+        cell_backend = header.get("cell_backend", 'dense')
+        fltr = cls(header["hash_family"], header["bit_mapping"], hash_salt_path, grid=grid, hash_engine=hash_engine,
+                   cell_backend=cell_backend, num_areas=header["num_areas"],
+                   index_mode=header.get("index_mode", 'digest'), salt_version=header.get("salt_version", 1),
+                   element_format=header.get("element_format", 'string'))
+        if fltr.salt_fingerprint() != header["salt_fingerprint"]:
+            raise AttributeError("Invalid hash salt.")
+        if fltr.grid.size != header["grid_size"]:
+            raise AttributeError("Invalid grid.")
+
+        fltr.cell_bits = header.get("cell_bits", 8 * arrays[-2].dtype.itemsize)
+        fltr.cell_size = fltr.cell_bits / 8
+        if cell_backend == 'sparse':
+            fltr.filter = SparseCells(fltr.num_cells, arrays[1].dtype, arrays[0], arrays[1])
+        elif fltr.cell_bits < 8:
+            fltr.filter = PackedCells(fltr.num_cells, fltr.cell_bits, arrays[0])
+        else:
+            fltr.filter = arrays[0]
+        fltr.grid_areas = np.array(arrays[-1])
+        fltr.members = header["members"]
+        fltr.collisions = header["collisions"]
+        fltr.area_members = header["area_members"]
+        fltr.area_cells = header["area_cells"]
+        fltr.area_self_collisions = header["area_self_collisions"]
+        fltr.insert_file_list = header["insert_file_list"]
+        fltr.stats = header["stats"]
+        fltr.generation = next(cls.GENERATIONS)
+
+        return fltr
+
+    def salt_fingerprint(self):
+        """
+        Returns a fingerprint of the hash salts, identifying them without revealing them.
+        :return: the SHA-256 hex digest of the salts.
+        """
+        return hashlib.sha256(b''.join(self.hash_salts)).hexdigest()
+
+    @classmethod
+    def _aligned(cls, offset):
+        """
+        Rounds a file offset up to the file alignment.
+        :param offset: the offset.
+        :return: the aligned offset.
+        """
+        return -(-offset // cls.FILE_ALIGNMENT) * cls.FILE_ALIGNMENT
+
     def incorrect_values(self):
         """
         Create a dictionary of coordinates where its area has been overwritten.
         The coordinate is the key with and list [real_area, [returned areas]] as the key.
+        The dictionary is cached until the filter next changes.
         :return: a dictionary of incorrect checks.
         """
-        self.dataset_path = self._get_dataset_path()
-        self.dataset_delimiter = ','
-
-        with open(self.dataset_path, 'r') as self.dataset_file:
-            self.dataset_reader = csv.reader(self.dataset_file, delimiter=self.dataset_delimiter)
-            for row in self.dataset_reader:
-                self.check_val = self.check(row[1])
-                self.areas = []
-                for hf in self.hash_family:
-                    self.areas.append(self.check_val[hf][1])
-                if str(min(int(m) for m in self.areas)) != row[0]:
-                    self.incorrect_areas[row[1]] = [int(row[0]), self.areas]
-
-        del self.dataset_path
-        del self.dataset_delimiter
-        del self.dataset_file
-        del self.dataset_reader
-        del self.check_val
-        del self.areas
+        if self.incorrect_areas_generation == self.generation:
+            return self.incorrect_areas
+
+        report = self.evaluate_grid()
+        self.incorrect_areas = {}
+        for i in report["Overwrites"]:
+            self.incorrect_areas[self.grid.element(i)] = [int(self.grid_areas[i]), report["Areas"][i].tolist()]
+        self.incorrect_areas_generation = self.generation
 
         return self.incorrect_areas
 
@@ -430,82 +1246,174 @@ class sbf:
         """
         return self.HASH_FAMILIES
 
-    def find_false_positives(self):
+    def find_false_positives(self, limit=10):
         """
         Find the coordinates are not in the SBF but falsely return an Area of Interest.
-        :return: a dictionary of 10 false positive coordinates.( key: coordinate, value:[area of interests])
-        """
-        indexes = []
-        while len(indexes) != 100:
-            indexes.append(randint(0, len(self.all_coors)))
-        for i in indexes:
-            if len(self.fp_coor) == 10:
-                return self.fp_coor
-            aoi = []
-            self.check_result = self.check(self.all_coors[i])
-            for hf in self.hash_family:
-                aoi.append(self.check_result[hf][1])
-            if min(int(m) for m in aoi) != 0:
-                self.fp_coor[self.all_coors[i]] = aoi
-
-    def _bits_of(self, byte, nbits):
-        """
-        Return the number of bits need for mapping the hash digest.
-        :param byte: the hash digest.
-        :param nbits: the number of bits needed for mapping
-        :return: the bits needed for mapping
-        """
-        self.byte = byte
-        self.nbits = nbits
-
-        # Calculate where to truncate the hash digest
-        self.bytes_needed = (self.nbits + 7) // 8
-
-        self.x = int.from_bytes(self.byte[:self.bytes_needed], byteorder=byteorder)
-        # If there were a non-byte aligned number of bits requested,
-        # shift off the excess from the right (which came from the last byte processed)
-        if self.nbits % 8:
-            self.x >>= 8 - self.nbits % 8
-
-        del self.byte
-        del self.nbits
-        del self.bytes_needed
-        return self.x
-
-    def _coors(self):
-        long1, long2, lat1, lat2 = 8945, 9020, 4694, 4844
-        for x in range(long1, long2 + 1):
-            for y in range(lat1, lat2 + 2):
-                self.all_coors.append("51.{}#-8.{}".format(x, y))
-
-    def _area_fpp(self):
+        :param limit: the maximum number of false positives returned, None for all of them.
+        :return: a dictionary of false positive coordinates.( key: coordinate, value:[area of interests])
         """
-        Computes false positives probability for each area.
-        :return: list of false positives probability for the areas.
-        """
-
-        self.area_fpp = [0] * (self.num_areas + 1)
+        report = self.evaluate_grid()
 
-        for self.i in range(self.num_areas, 0, -1):
-
-            self.c = 0
+        self.fp_coor = {}
+        for i in report["False Positives"][:limit]:
+            self.fp_coor[self.grid.element(i)] = report["Areas"][i].tolist()
 
-            for self.j in range(self.i, self.num_areas + 1):
-                self.c += self.area_cells[self.j]
+        return self.fp_coor
 
-            self.p = self.c / self.num_cells
-            self.area_fpp[self.i] = pow(self.p, len(self.hash_family))
+    def evaluate_grid(self):
+        """
+        Checks every coordinate of the grid against the filter, in one vectorized gather.
+        The evaluation is cached until the filter next changes.
+        The report holds the (n_coordinates x k_hashes) matrix of areas returned for each grid coordinate ("Areas")
+        and their resolved areas ("Min Areas"), the grid indexes of the coordinates not in the dataset that return an
+        area ("False Positives") and of the dataset coordinates that return a wrong area ("Overwrites"), and the
+        empirical false positive rate over the coordinates not in the dataset, overall ("Filter FPR") and for each
+        area ("Area FPR").
+        :return: a dictionary with the evaluation of the grid.
+        """
+        if self.grid_report_generation == self.generation:
+            return self.grid_report
+
+        areas = self.filter[self.hash_engine.grid_indexes(self.grid)]
+        min_areas = areas.min(axis=1)
+        free = self.grid_areas == 0
+        false_positives = np.flatnonzero(free & (min_areas != 0))
+        overwrites = np.flatnonzero(~free & (min_areas != self.grid_areas))
+
+        num_free = max(int(np.count_nonzero(free)), 1)
+        fp_counts = np.bincount(min_areas[false_positives], minlength=self.num_areas + 1)
+
+        self.grid_report = {
+            "Areas": areas,
+            "Min Areas": min_areas,
+            "False Positives": false_positives,
+            "Overwrites": overwrites,
+            "Filter FPR": len(false_positives) / num_free,
+            "Area FPR": (fp_counts / num_free).tolist(),
+        }
+        self.grid_report_generation = self.generation
+        return self.grid_report
 
-            for self.j in range(self.i, self.num_areas):
-                self.area_fpp[self.i] -= self.area_fpp[self.j + 1]
+    @classmethod
+    def expected_stats(cls, area_members, bit_mapping, num_hashes):
+        """
+        Predicts, in closed form, the stats of a filter holding a number of elements per area, inserted in ascending
+        order of area label.
+        With m cells and k hash functions, the cells of area i and above are the ones written by the N_i elements of
+        those areas, m (1 - (1 - 1/m)^(k N_i)) in expectation; the distinct cells written by area i alone give its
+        self collisions the same way. The FPP, ISEP and emersion then follow from the expected counters, with the
+        formulas of _filter_fpp, _area_fpp and _area_isep.
+        The bit mapping and the number of hash functions broadcast, so many configurations can be predicted at once.
+        :param area_members: sequence of the number of elements of each area, for the areas 1 to num_areas.
+        :param bit_mapping: filter composed of 2^bit_mapping cells (int or array).
+        :param num_hashes: the number of hash functions (int or array).
+        :return: a dictionary of arrays, indexed by area label on the last axis: "Area Cells", "Area Self Collisions",
+                 "Area FPP", "Area Emersion", "Area ISEP", and the "Filter FPP".
+        """
+        members = np.concatenate([[0], np.asarray(area_members, dtype=np.float64)])
+        num_cells = np.power(2.0, np.asarray(bit_mapping, dtype=np.float64))[..., np.newaxis]
+        num_hashes = np.asarray(num_hashes, dtype=np.float64)[..., np.newaxis]
+        keep = np.log1p(-1 / num_cells)
+
+        above = -num_cells * np.expm1(num_hashes * np.cumsum(members[::-1])[::-1] * keep)
+        area_cells = above - np.concatenate([above[..., 1:], np.zeros_like(above[..., :1])], axis=-1)
+        area_cells[..., 0] = 0
+        self_collisions = members * num_hashes + num_cells * np.expm1(num_hashes * members * keep)
+
+        emersion = cls._area_emersions_of(area_cells, members, self_collisions, num_hashes)
+        return {
+            "Area Cells": area_cells,
+            "Area Self Collisions": self_collisions,
+            "Area FPP": cls._area_fpp_of(area_cells, num_cells, num_hashes),
+            "Area Emersion": emersion,
+            "Area ISEP": cls._area_isep_of(emersion, num_hashes),
+            "Filter FPP": np.power(area_cells.sum(axis=-1) / num_cells[..., 0], num_hashes[..., 0]),
+        }
 
-            if self.area_fpp[self.i] < 0:
-                self.area_fpp[self.i] = 0
+    @classmethod
+    def plan(cls, area_members, fpp=None, area_fpp=None, isep=None, max_hashes=None):
+        """
+        Finds the smallest filter meeting some targets, from the number of elements of each area.
+        Every bit mapping and number of hash functions is predicted at once with expected_stats; the smallest bit
+        mapping meeting the targets is kept, with the number of hash functions giving it the lowest filter FPP.
+        :param area_members: sequence of the number of elements of each area, for the areas 1 to num_areas.
+        :param fpp: the maximum false positive probability of the filter.
+        :param area_fpp: the maximum false positive probability of each area.
+        :param isep: the maximum inter-set error probability of each (non-empty) area.
+        :param max_hashes: the maximum number of hash functions, defaults to the number of available ones.
+        :return: a dictionary with the "Bit Mapping" and the "Number of Hash Functions", and the predicted stats
+                 (as in expected_stats, with lists).
+        :raise AttributeError: there are no targets, or no filter meets them.
+        """
+        if (fpp is None) and (area_fpp is None) and (isep is None):
+            raise AttributeError("Invalid targets.")
+        if max_hashes is None:
+            max_hashes = len(cls.HASH_FAMILIES)
+
+        bit_mappings = np.arange(1, cls.MAX_BIT_MAPPING + 1)[:, np.newaxis]
+        num_hashes = np.arange(1, max_hashes + 1)[np.newaxis, :]
+        expected = cls.expected_stats(area_members, bit_mappings, num_hashes)
+
+        met = np.ones((len(bit_mappings), max_hashes), dtype=bool)
+        if fpp is not None:
+            met &= expected["Filter FPP"] <= fpp
+        if area_fpp is not None:
+            met &= expected["Area FPP"][..., 1:].max(axis=-1) <= area_fpp
+        if isep is not None:
+            non_empty = np.asarray(area_members) > 0
+            met &= expected["Area ISEP"][..., 1:][..., non_empty].max(axis=-1, initial=0) <= isep
+        if not met.any():
+            raise AttributeError("Unreachable targets.")
+
+        row = np.flatnonzero(met.any(axis=1))[0]
+        col = np.argmin(np.where(met[row], expected["Filter FPP"][row], np.inf))
+
+        plan = {"Bit Mapping": int(bit_mappings[row, 0]), "Number of Hash Functions": int(num_hashes[0, col])}
+        for key, value in expected.items():
+            plan[key] = value[row, col].tolist()
+        return plan
+
+    @classmethod
+    def check_plan(cls, plan, source, hash_family, sample_bits=0, hash_salt_path="default", delimiter=','):
+        """
+        Checks a plan against a build: a filter of the planned configuration is built from a dataset, and its stats
+        are returned to compare with the predicted ones.
+        With sample_bits, only one element in 2^sample_bits is inserted, into a filter 2^sample_bits times smaller:
+        the load of the cells, and so the stats, are the same as the full filter's, for a fraction of the time.
+        :param plan: the plan, as returned by plan.
+        :param source: a path to a CSV file, an open CSV file object, or an iterable of (area, element) couples.
+        :param hash_family: the hash family to build with, of the planned number of hash functions.
+        :param sample_bits: the log2 of the sampling stride.
+        :param hash_salt_path: the path to the hash salt file.
+        :param delimiter: the CSV delimiter.
+        :return: a dictionary with the measured "Area Cells", "Area Self Collisions", "Area FPP", "Area Emersion",
+                 "Area ISEP" (lists indexed by area label) and "Filter FPP", of the sampled filter.
+        :raise AttributeError: the hash family does not match the plan.
+        """
+        if len(hash_family) != plan["Number of Hash Functions"]:
+            raise AttributeError("Invalid hash family.")
+
+        bit_mapping = max(plan["Bit Mapping"] - sample_bits, 1)
+        fltr = cls(hash_family, bit_mapping, hash_salt_path, num_areas=len(plan["Area Cells"]) - 1)
+        fltr.insert_from(islice(cls._read_pairs(source, delimiter), 0, None, pow(2, sample_bits)))
+        fltr.update_stats()
+
+        return {
+            "Area Cells": list(fltr.area_cells),
+            "Area Self Collisions": list(fltr.area_self_collisions),
+            "Area FPP": fltr.area_fpp,
+            "Area Emersion": fltr._area_emersions().tolist(),
+            "Area ISEP": fltr.area_isep,
+            "Filter FPP": fltr._filter_fpp(),
+        }
 
-        del self.j
-        del self.c
-        del self.p
-        del self.i
+    def _area_fpp(self):
+        """
+        Computes false positives probability for each area.
+        :return: list of false positives probability for the areas.
+        """
+        self.area_fpp = self._area_fpp_of(np.asarray(self.area_cells, dtype=np.float64), self.num_cells,
+                                          len(self.hash_family)).tolist()
 
         return self.area_fpp
 
@@ -514,33 +1422,69 @@ class sbf:
         Computes inter-set error probability for each area.
         :return: list of inter-set error probability for the areas.
         """
+        self.area_isep = self._area_isep_of(self._area_emersions(), len(self.hash_family)).tolist()
 
-        self.area_isep = [0] * (self.num_areas + 1)
-
-        for self.i in range(self.num_areas, 0, -1):
-            self.p = 1 - self._area_emersion(self.i)
-            self.p = pow(self.p, len(self.hash_family))
+        return self.area_isep
 
-            self.area_isep[self.i] = self.p
+    def _area_emersions(self):
+        """
+        Computes the emersion value of every area.
+        :return: array of emersion values, indexed by area label (-1 for the areas without members).
+        """
+        return self._area_emersions_of(np.asarray(self.area_cells, dtype=np.float64),
+                                       np.asarray(self.area_members, dtype=np.float64),
+                                       np.asarray(self.area_self_collisions, dtype=np.float64),
+                                       len(self.hash_family))
 
-        del self.p
+    @staticmethod
+    def _area_fpp_of(area_cells, num_cells, num_hashes):
+        """
+        Computes false positives probability for each area from the number of cells of each area.
+        An element falls in area i or above with probability (c_i / m)^k, c_i being the number of cells of area i
+        and above (a suffix sum of area_cells), so the probability of area i is the difference of two such terms.
+        The arguments broadcast, the areas being the last axis, so many filters can be computed at once.
+        :param area_cells: array of the number of cells of each area, indexed by area label.
+        :param num_cells: the number of cells of the filter.
+        :param num_hashes: the number of hash functions.
+        :return: array of false positives probability, indexed by area label.
+        """
+        above = np.power(np.cumsum(area_cells[..., ::-1], axis=-1)[..., ::-1] / num_cells, num_hashes)
+        area_fpp = np.maximum(above - np.concatenate([above[..., 1:], np.zeros_like(above[..., :1])], axis=-1), 0)
+        area_fpp[..., 0] = 0
 
-        return self.area_isep
+        return area_fpp
 
-    def _area_emersion(self, area):
+    @staticmethod
+    def _area_emersions_of(area_cells, area_members, area_self_collisions, num_hashes):
         """
-        Computes the emersion value for an area.
-        :param area: the area for which to calculate the emersion value.
-        :return: the emersion value.
+        Computes the emersion value of every area from the counters of a filter: the fraction of the cells written
+        by an area that still hold its label.
+        The arguments broadcast, the areas being the last axis.
+        :param area_cells: array of the number of cells of each area, indexed by area label.
+        :param area_members: array of the number of members of each area.
+        :param area_self_collisions: array of the number of self collisions of each area.
+        :param num_hashes: the number of hash functions.
+        :return: array of emersion values, indexed by area label (-1 for the areas without members).
         """
+        area_cells, area_members, written = np.broadcast_arrays(
+            area_cells, area_members, area_members * num_hashes - area_self_collisions)
+        emersion = np.full(area_cells.shape, -1.0)
+        np.divide(area_cells, written, out=emersion, where=area_members != 0)
 
-        self.area = area
+        return emersion
 
-        if self.area_members[self.area] == 0:
-            return -1
-        else:
-            return (self.area_cells[self.area] / (
-                    (self.area_members[self.area] * len(self.hash_family)) - self.area_self_collisions[self.area]))
+    @staticmethod
+    def _area_isep_of(emersion, num_hashes):
+        """
+        Computes inter-set error probability for each area from its emersion value.
+        :param emersion: array of emersion values, indexed by area label.
+        :param num_hashes: the number of hash functions.
+        :return: array of inter-set error probability, indexed by area label.
+        """
+        area_isep = np.power(1 - emersion, num_hashes)
+        area_isep[..., 0] = 0
+
+        return area_isep
 
     @staticmethod
     def _get_salt_path():
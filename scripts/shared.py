@@ -0,0 +1,280 @@
+import struct
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from scripts.sbf import sbf
+
+
+class SharedFilter:
+
+    # Control block: sequence number (odd while a swap is in progress), published generation, data segment name
+    CONTROL_FORMAT = '<QQ64s'
+
+    # Segments created by this process, which its resource tracker already knows about
+    CREATED = set()
+
+    def __init__(self, name):
+        """
+        Initialises a filter shared between the processes of a host (e.g. the workers of a WSGI server).
+        One builder process publishes the filter into a shared memory segment, in the binary format of sbf.save,
+        and a small control segment, named after the shared filter, points to the current data segment. Workers
+        attach to the data segment without copying it: the memory of the filter is paid once per host.
+        :param name: the name of the shared filter, unique on the host.
+        """
+        self.name = name
+        self.control = None
+        self.segment = None
+        self.published = 0
+        self.attached = None
+        self.attached_generation = 0
+        # The parsed header and the read-only section arrays of the attached filter
+        self.header = None
+        self.arrays = []
+        # Segments replaced while the filters viewing them may still be in use
+        self.retired = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def publish(self, fltr):
+        """
+        Publishes a filter (builder side).
+        The filter is written to a new data segment, then the control block is switched to it in one step, so
+        workers see either the previous filter or the new one, never a partial one. The previous data segment is
+        unlinked: workers still attached to it keep their mapping until they move to the new one.
+        :param fltr: the filter (sbf) to publish.
+        :return: the published generation.
+        """
+        self.create()
+
+        prefix, sections, size = fltr.binary_layout()
+        generation = 0
+        while True:
+            sequence, published, _ = self._read_control_raw()
+            generation = max(generation, published) + 1
+            try:
+                segment = shared_memory.SharedMemory(name="{}_{}".format(self.name, generation), create=True,
+                                                     size=size)
+                break
+            except FileExistsError:
+                # Another process is publishing this generation: move on to the next one
+                continue
+        self.CREATED.add(segment.name)
+        segment.buf[:len(prefix)] = prefix
+        for offset, array in sections:
+            segment.buf[offset:offset + array.nbytes] = memoryview(np.ascontiguousarray(array)).cast('B')
+
+        # Odd sequence numbers tell readers a swap is in progress
+        struct.pack_into('<Q', self.control.buf, 0, sequence + 1)
+        struct.pack_into(self.CONTROL_FORMAT, self.control.buf, 0, sequence + 1, generation,
+                         segment.name.encode('ascii'))
+        struct.pack_into('<Q', self.control.buf, 0, sequence + 2)
+
+        if self.segment is not None:
+            self.segment.unlink()
+            self.CREATED.discard(self.segment.name)
+            self._retire(self.segment)
+        self.segment = segment
+        self.published = generation
+
+        return generation
+
+    def create(self):
+        """
+        Creates the control segment of the shared filter, unless it already exists.
+        Only one process of the host creates it, which makes it the one to build and publish the filter, while the
+        others wait for it.
+        :return: True if this process created the control segment, False if it opened an existing one.
+        """
+        if self.control is not None:
+            return False
+
+        try:
+            self.control = shared_memory.SharedMemory(name=self.name, create=True,
+                                                      size=struct.calcsize(self.CONTROL_FORMAT))
+        except FileExistsError:
+            while True:
+                try:
+                    self.control = self._open(self.name)
+                    return False
+                except ValueError:
+                    # The other process has not sized the segment yet
+                    time.sleep(0.001)
+        self.control.buf[:] = bytes(len(self.control.buf))
+        self.CREATED.add(self.control.name)
+        return True
+
+    def wait(self, timeout=None, interval=0.01):
+        """
+        Waits until a filter has been published (worker side).
+        :param timeout: the maximum number of seconds to wait, None to wait forever.
+        :param interval: the number of seconds between two looks at the control block.
+        :return: the published generation.
+        :raise TimeoutError: nothing was published in time.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            generation = self.generation()
+            if generation != 0:
+                return generation
+            if (deadline is not None) and (time.monotonic() >= deadline):
+                raise TimeoutError("No published filter.")
+            time.sleep(interval)
+
+    def attach(self, hash_salt_path="default", grid=None, hash_engine=None):
+        """
+        Returns the published filter (worker side), attaching to its data segment without copying it.
+        Call it on each request: it only re-attaches when a new generation has been published. The filter is
+        read-only.
+        :param hash_salt_path: the path to the hash salt file the filter was built with.
+        :param grid: the coordinate grid (CoordinateGrid) the filter was built with; defaults to Cork.
+        :param hash_engine: the hashing component of a filter with the same configuration, to share with it.
+        :return: the filter (sbf).
+        :raise FileNotFoundError: no filter has been published under this name, or it was removed.
+        """
+        if self.control is None:
+            self.control = self._open(self.name)
+
+        while True:
+            generation, segment_name = self._read_control()
+            if generation == 0:
+                raise FileNotFoundError("No published filter.")
+            if generation == self.attached_generation:
+                return self.attached
+            try:
+                segment = self._open(segment_name)
+                break
+            except FileNotFoundError:
+                # The segment was replaced between reading the control block and opening it, unless it is gone
+                if self._read_control()[0] == generation:
+                    raise
+                continue
+
+        header, sections = sbf.parse_binary_header(segment.buf)
+        arrays = []
+        for offset, dtype, length in sections:
+            array = np.ndarray((length,), dtype=dtype, buffer=segment.buf, offset=offset)
+            array.flags.writeable = False
+            arrays.append(array)
+        fltr = sbf.from_binary(header, arrays, hash_salt_path, grid, hash_engine)
+        self.header = header
+        self.arrays = arrays
+
+        if self.segment is not None:
+            self._retire(self.segment)
+        self.segment = segment
+        self.attached = fltr
+        self.attached_generation = generation
+
+        return fltr
+
+    def view(self, hash_salt_path="default", grid=None, hash_engine=None):
+        """
+        Returns a new filter over the published cells (worker side), attaching first if needed.
+        Unlike the filter returned by attach, each view has its own counters and caches, so it can be handed to a
+        single session: clearing it gives it new cells of its own, while the shared cells stay read-only.
+        :param hash_salt_path: the path to the hash salt file the filter was built with.
+        :param grid: the coordinate grid (CoordinateGrid) the filter was built with; defaults to Cork.
+        :param hash_engine: the hashing component of a filter with the same configuration, to share with it.
+        :return: the filter (sbf).
+        :raise FileNotFoundError: no filter has been published under this name.
+        """
+        self.attach(hash_salt_path, grid, hash_engine)
+        return sbf.from_binary(self.header, self.arrays, hash_salt_path, grid, hash_engine)
+
+    def generation(self):
+        """
+        Returns the currently published generation.
+        :return: the generation, 0 if nothing has been published.
+        """
+        if self.control is None:
+            try:
+                self.control = self._open(self.name)
+            except FileNotFoundError:
+                return 0
+        return self._read_control()[0]
+
+    def close(self):
+        """
+        Detaches from the shared memory, leaving the published filter in place.
+        """
+        self.attached = None
+        self.attached_generation = 0
+        self.header = None
+        self.arrays = []
+        for segment in [self.segment, self.control] + self.retired:
+            if segment is not None:
+                self._close(segment)
+        self.segment = None
+        self.control = None
+        self.retired = []
+
+    def unlink(self):
+        """
+        Removes the published filter from the host (builder side), then detaches from it.
+        """
+        for segment in [self.segment, self.control]:
+            if segment is not None:
+                segment.unlink()
+                self.CREATED.discard(segment.name)
+        self.close()
+
+    def _read_control(self):
+        """
+        Reads a consistent state of the control block, retrying while a swap is in progress.
+        :return: a tuple (generation, segment_name).
+        """
+        while True:
+            sequence, generation, segment_name = self._read_control_raw()
+            if (sequence % 2 == 0) and (struct.unpack_from('<Q', self.control.buf, 0)[0] == sequence):
+                return generation, segment_name
+
+    def _read_control_raw(self):
+        """
+        Reads the control block.
+        :return: a tuple (sequence, generation, segment_name).
+        """
+        sequence, generation, segment_name = struct.unpack_from(self.CONTROL_FORMAT, self.control.buf, 0)
+        return sequence, generation, segment_name.rstrip(b'\x00').decode('ascii')
+
+    def _retire(self, segment):
+        """
+        Closes a replaced segment, or keeps it until its filter views are released.
+        :param segment: the shared memory segment.
+        """
+        self.retired.append(segment)
+        self.retired = [retired for retired in self.retired if not self._close(retired)]
+
+    @staticmethod
+    def _close(segment):
+        """
+        Closes a segment, if no array views it anymore.
+        :param segment: the shared memory segment.
+        :return: True if the segment was closed.
+        """
+        try:
+            segment.close()
+            return True
+        except BufferError:
+            return False
+
+    @classmethod
+    def _open(cls, name):
+        """
+        Opens an existing segment, without handing it to the resource tracker of this process: the tracker would
+        unlink the segment when this process exits, while other processes still use it.
+        :param name: the name of the segment.
+        :return: the shared memory segment.
+        """
+        try:
+            return shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            segment = shared_memory.SharedMemory(name=name)
+            if segment.name not in cls.CREATED:
+                resource_tracker.unregister(segment._name, 'shared_memory')
+            return segment
@@ -0,0 +1,148 @@
+import csv
+import json
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+
+from scripts.sbf import HashEngine, sbf
+from scripts.sweep import SizeSweep
+
+# The columns of the study results, one row per dataset, hash family and bit mapping
+STUDY_COLUMNS = ['dataset', 'hash_family', 'num_hashes', 'bit_mapping', 'num_cells', 'members', 'collisions',
+                 'self_collisions', 'sparsity', 'fpp', 'max_area_fpp', 'max_area_isep']
+
+# The sweeps hashed by this process, by (dataset, hash functions, salt, number of areas)
+_SWEEPS = {}
+
+
+def available_hash_functions():
+    """
+    Returns the hash functions of sbf.HASH_FAMILIES provided by this Python build (md4 depends on OpenSSL).
+    :return: list of hash functions.
+    """
+    available = []
+    for hf in sbf.HASH_FAMILIES:
+        try:
+            HashEngine._constructor(hf)(b'')
+        except ValueError:
+            continue
+        available.append(hf)
+    return available
+
+
+def hash_family_subsets(hash_functions=None, sizes=None):
+    """
+    Returns the hash families made of subsets of some hash functions.
+    :param hash_functions: the hash functions, defaults to every available one (available_hash_functions).
+    :param sizes: the numbers of hash functions of the families, defaults to all of them.
+    :return: list of hash families (lists of hash functions).
+    """
+    if hash_functions is None:
+        hash_functions = available_hash_functions()
+    if sizes is None:
+        sizes = range(1, len(hash_functions) + 1)
+
+    return [list(family) for size in sizes for family in combinations(hash_functions, size)]
+
+
+def run_study(datasets, hash_families=None, bit_mappings=range(1, 33), hash_salt_path="default", num_areas=4,
+              workers=None):
+    """
+    Measures the filters of every combination of dataset, hash family and bit mapping.
+    Each (dataset, hash family) couple is a task, spread over a pool of processes; a process hashes a dataset once,
+    with every hash function of the study, and derives all the hash families and sizes from those digests.
+    :param datasets: list of paths to dataset CSV files.
+    :param hash_families: list of hash families, defaults to every subset of the available hash functions.
+    :param bit_mappings: the bit mappings of the filters.
+    :param hash_salt_path: the path to the hash salt file.
+    :param num_areas: the number of areas of the filters.
+    :param workers: the number of worker processes, None (or 1) to run in this process.
+    :return: the results, as a dictionary of columns (STUDY_COLUMNS) of equal length.
+    """
+    if hash_families is None:
+        hash_families = hash_family_subsets()
+    hash_families = [[hf.lower() for hf in family] for family in hash_families]
+    hash_functions = sorted({hf for family in hash_families for hf in family})
+    bit_mappings = list(bit_mappings)
+
+    tasks = [(dataset, family) for dataset in datasets for family in hash_families]
+    arguments = ([dataset for dataset, _ in tasks], [family for _, family in tasks],
+                 [hash_functions] * len(tasks), [bit_mappings] * len(tasks), [hash_salt_path] * len(tasks),
+                 [num_areas] * len(tasks))
+
+    if workers is None or workers <= 1:
+        try:
+            rows = list(map(_study_task, *arguments))
+        finally:
+            _SWEEPS.clear()
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            rows = list(executor.map(_study_task, *arguments))
+
+    results = {column: [] for column in STUDY_COLUMNS}
+    for task_rows in rows:
+        for row in task_rows:
+            for column in STUDY_COLUMNS:
+                results[column].append(row[column])
+
+    return results
+
+
+def _study_task(dataset, hash_family, hash_functions, bit_mappings, hash_salt_path, num_areas):
+    """
+    Measures the filters of one dataset and hash family, at every bit mapping.
+    :param dataset: the path to the dataset CSV file.
+    :param hash_family: the hash family of the filters.
+    :param hash_functions: every hash function of the study, hashed together the first time the dataset is seen.
+    :param bit_mappings: the bit mappings of the filters.
+    :param hash_salt_path: the path to the hash salt file.
+    :param num_areas: the number of areas of the filters.
+    :return: list of result rows (dictionaries).
+    """
+    key = (dataset, tuple(hash_functions), hash_salt_path, num_areas)
+    sweep = _SWEEPS.get(key)
+    if sweep is None:
+        sweep = SizeSweep(hash_functions, max(bit_mappings), hash_salt_path, num_areas=num_areas)
+        sweep.insert_from_file(dataset)
+        _SWEEPS[key] = sweep
+
+    rows = []
+    for bit_mapping, fltr in sweep.select(hash_family).filters(bit_mappings):
+        rows.append({
+            'dataset': dataset,
+            'hash_family': '+'.join(fltr.hash_family),
+            'num_hashes': len(fltr.hash_family),
+            'bit_mapping': bit_mapping,
+            'num_cells': fltr.num_cells,
+            'members': fltr.members,
+            'collisions': fltr.collisions,
+            'self_collisions': sum(fltr.area_self_collisions),
+            'sparsity': fltr._filter_sparsity(),
+            'fpp': fltr._filter_fpp(),
+            'max_area_fpp': max(fltr.area_fpp[1:]),
+            'max_area_isep': max(fltr.area_isep[1:]),
+        })
+
+    return rows
+
+
+def write_csv(results, path):
+    """
+    Writes study results to a CSV file, with a header row.
+    :param results: the results, as a dictionary of columns.
+    :param path: the path of the CSV file.
+    """
+    columns = list(results.keys())
+    with open(path, 'w', newline='') as results_file:
+        writer = csv.writer(results_file)
+        writer.writerow(columns)
+        writer.writerows(zip(*[results[column] for column in columns]))
+
+
+def write_json(results, path):
+    """
+    Writes study results to a JSON file, as a dictionary of columns.
+    :param results: the results, as a dictionary of columns.
+    :param path: the path of the JSON file.
+    """
+    with open(path, 'w') as results_file:
+        json.dump(results, results_file)
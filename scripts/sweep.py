@@ -0,0 +1,121 @@
+from pathlib import Path
+
+import numpy as np
+
+from scripts.sbf import HashEngine, sbf
+
+
+class SizeSweep:
+
+    def __init__(self, hash_family, max_bit_mapping=32, hash_salt_path="default", grid=None, num_areas=4):
+        """
+        Initialises a sweep over the filter sizes 2^1 to 2^max_bit_mapping of one hash family.
+        Each element is hashed once per hash function, keeping the 64-bit indexes; the indexes of every smaller size
+        are then derived from them by truncation, as the filter would compute them, so a whole sweep costs a single
+        hashing pass.
+        :param hash_family: the hash family used.
+        :param max_bit_mapping: the largest bit mapping of the sweep.
+        :param hash_salt_path: the path to the hash salt file.
+        :param grid: the coordinate grid (CoordinateGrid) of the map; defaults to Cork.
+        :param num_areas: the number of areas of the filters.
+        :raise AttributeError: the arguments are out of bounds.
+        """
+        if (max_bit_mapping <= 0) or (max_bit_mapping > sbf.MAX_BIT_MAPPING):
+            raise AttributeError("Invalid bit mapping.")
+
+        self.max_bit_mapping = max_bit_mapping
+        # Hashes at the full 64 bits, and records the grid cells of the elements; its cells are never written
+        self.base = sbf(hash_family, sbf.MAX_BIT_MAPPING, hash_salt_path, grid=grid, cell_backend='sparse',
+                        num_areas=num_areas)
+        self.indexes = np.empty((0, len(self.base.hash_family)), dtype=np.uint64)
+        self.areas = np.empty(0, dtype=np.int64)
+
+    def insert_from_file(self, dataset_path=None, workers=None, chunk_size=10000):
+        """
+        Hashes the elements from a dataset CSV file.
+        :param dataset_path: the path of the CSV file, defaults to the cork dataset.
+        :param workers: the number of worker processes used for hashing, None to hash serially.
+        :param chunk_size: the number of rows hashed together.
+        """
+        if dataset_path is None:
+            dataset_path = self.base._get_dataset_path()
+
+        self.insert_from(dataset_path, workers=workers, chunk_size=chunk_size)
+
+    def insert_from(self, source, delimiter=',', workers=None, chunk_size=10000):
+        """
+        Hashes a stream of area-element couples, in the order they will be inserted into the filters.
+        :param source: a path to a CSV file, an open CSV file object, or an iterable of (area, element) couples.
+        :param delimiter: the CSV delimiter.
+        :param workers: the number of worker processes used for hashing, None to hash serially.
+        :param chunk_size: the number of couples hashed together.
+        :raise AttributeError: an area label is out of bounds.
+        """
+        indexes, areas = [self.indexes], [self.areas]
+
+        chunks = self.base._chunked(self.base._read_pairs(source, delimiter), chunk_size)
+        for chunk_elements, chunk_areas, chunk_indexes in self.base._hash_chunks(chunks, workers):
+            chunk_areas = np.asarray(chunk_areas, dtype=np.int64)
+            if (chunk_areas.min() <= 0) or (chunk_areas.max() > self.base.num_areas):
+                raise AttributeError("Invalid area number.")
+            indexes.append(chunk_indexes)
+            areas.append(chunk_areas)
+            self.base._map_coordinates(chunk_elements, chunk_areas)
+
+        self.indexes = np.concatenate(indexes)
+        self.areas = np.concatenate(areas)
+        if isinstance(source, (str, Path)):
+            self.base.insert_file_list.append(str(source))
+        elif hasattr(source, 'name'):
+            self.base.insert_file_list.append(source.name)
+
+    def select(self, hash_family):
+        """
+        Returns a sweep over a subset of the hash functions of this one, sharing its digests: the indexes of a hash
+        function do not depend on the other members of the family, so no element is hashed again.
+        :param hash_family: the hash family, a subset of the hash family of this sweep.
+        :return: the sweep (SizeSweep).
+        :raise AttributeError: a hash function is not part of this sweep.
+        """
+        hash_family = [hf.lower() for hf in hash_family]
+        if any(hf not in self.base.hash_family for hf in hash_family):
+            raise AttributeError("Invalid hash family.")
+
+        sweep = SizeSweep(hash_family, self.max_bit_mapping, self.base.hash_salt_path, grid=self.base.grid,
+                          num_areas=self.base.num_areas)
+        sweep.indexes = self.indexes[:, [self.base.hash_family.index(hf) for hf in hash_family]]
+        sweep.areas = self.areas
+        sweep.base.grid_areas = self.base.grid_areas.copy()
+        sweep.base.insert_file_list = list(self.base.insert_file_list)
+
+        return sweep
+
+    def filters(self, bit_mappings=None):
+        """
+        Builds the filter of each size of the sweep, without hashing again, with its stats up to date.
+        The filters are yielded one at a time, so they can be dropped once measured.
+        :param bit_mappings: the bit mappings to build, defaults to 1 to max_bit_mapping.
+        :return: generator of (bit_mapping, filter) couples.
+        """
+        if bit_mappings is None:
+            bit_mappings = range(1, self.max_bit_mapping + 1)
+
+        for bit_mapping in bit_mappings:
+            engine = HashEngine(self.base.hash_family, bit_mapping, self.base.hash_salts)
+            fltr = sbf(self.base.hash_family, bit_mapping, self.base.hash_salt_path, grid=self.base.grid,
+                       hash_engine=engine, num_areas=self.base.num_areas)
+            if len(self.areas) > 0:
+                fltr._apply_indexes(HashEngine.truncate_indexes(self.indexes, bit_mapping), self.areas)
+            fltr.grid_areas = self.base.grid_areas.astype(fltr.grid_areas.dtype)
+            fltr.insert_file_list = list(self.base.insert_file_list)
+            fltr.update_stats()
+
+            yield bit_mapping, fltr
+
+    def stats(self, bit_mappings=None):
+        """
+        Returns the stats of the filter of each size of the sweep.
+        :param bit_mappings: the bit mappings to measure, defaults to 1 to max_bit_mapping.
+        :return: a dictionary with the bit mapping as the key and the filter stats as the value.
+        """
+        return {bit_mapping: fltr.get_stats() for bit_mapping, fltr in self.filters(bit_mappings)}
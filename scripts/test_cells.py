@@ -0,0 +1,81 @@
+import sys
+from unittest import TestCase
+from scripts.cells import PackedCells, SparseCells, cell_bits, new_cells
+import numpy as np
+
+
+class TestCells(TestCase):
+
+    def test_sparse_cells(self):
+        dense = np.zeros(64, dtype=np.uint8)
+        sparse = new_cells('sparse', 64)
+
+        for key, value in [(5, 2), (np.array([9, 3, 5]), np.array([1, 4, 3])), (np.array([9, 40]), 0),
+                           (np.array([63, 0]), 7)]:
+            dense[key] = value
+            sparse[key] = value
+
+        np.testing.assert_array_equal(np.asarray(sparse), dense)
+        np.testing.assert_array_equal(sparse[10:50], dense[10:50])
+        np.testing.assert_array_equal(sparse[np.array([[3, 4], [63, 5]])], dense[np.array([[3, 4], [63, 5]])])
+        self.assertEqual(sparse[5], dense[5])
+        np.testing.assert_array_equal(sparse.nonzero()[0], np.flatnonzero(dense))
+        self.assertEqual(len(sparse.values), 4)
+
+    def test_large_address_space(self):
+        sparse = SparseCells(pow(2, 64))
+        sparse[pow(2, 64) - 1] = 3
+
+        self.assertEqual(sparse[pow(2, 64) - 1], 3)
+        self.assertEqual(sparse[pow(2, 63)], 0)
+        self.assertEqual(sparse.nbytes, 9)
+        self.assertEqual(len(sparse), sys.maxsize)
+
+    def test_sparse_scalar_writes(self):
+        sparse = SparseCells(1000)
+        sparse[[1, 5]] = [2, 2]
+        sparse[7] = 3
+        sparse[5] = 0
+        sparse[7] = 4
+
+        self.assertEqual(sparse.pending, {5: 0, 7: 4})
+        self.assertEqual(sparse[7], 4)
+        self.assertEqual(sparse[1], 2)
+        np.testing.assert_array_equal(sparse[0:8], [0, 2, 0, 0, 0, 0, 0, 4])
+        np.testing.assert_array_equal(sparse.indexes, [1, 7])
+        self.assertEqual(sparse.pending, {})
+
+    def test_packed_cells(self):
+        for bits in (2, 4):
+            dense = np.zeros(61, dtype=np.uint8)
+            packed = new_cells('dense', 61, bits)
+            self.assertIsInstance(packed, PackedCells)
+
+            for key, value in [(5, 2), (np.array([4, 6, 5, 60]), np.array([1, 3, 3, 2])), (np.array([4, 7]), 0),
+                               (np.arange(10, 30), np.arange(20) % 4), (11, 1), (np.int64(12), 0), (-1, 3)]:
+                dense[key] = value
+                packed[key] = value
+
+            np.testing.assert_array_equal(np.asarray(packed), dense)
+            np.testing.assert_array_equal(packed[10:50], dense[10:50])
+            np.testing.assert_array_equal(packed[np.array([[3, 4], [60, 5]])], dense[np.array([[3, 4], [60, 5]])])
+            self.assertEqual(packed[6], dense[6])
+            self.assertEqual([packed[i] for i in range(-3, 61)], [dense[i] for i in range(-3, 61)])
+            self.assertEqual(list(packed), dense.tolist())
+            self.assertEqual(packed.nbytes, -(-61 * bits // 8))
+
+        with self.assertRaisesRegex(ValueError, "Cell value out of range."):
+            packed[3] = 16
+        with self.assertRaisesRegex(IndexError, "Cell index out of range."):
+            packed[61]
+
+    def test_cell_bits(self):
+        self.assertEqual(cell_bits(3), 2)
+        self.assertEqual(cell_bits(4), 4)
+        self.assertEqual(cell_bits(255), 8)
+        self.assertEqual(cell_bits(256), 16)
+        self.assertIs(new_cells('dense', 8, 16).dtype, np.dtype(np.uint16))
+
+    def test_invalid_backend(self):
+        with self.assertRaisesRegex(AttributeError, "Invalid cell backend."):
+            new_cells('tree', 64)
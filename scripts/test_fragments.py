@@ -0,0 +1,31 @@
+from unittest import TestCase
+from scripts.fragments import FragmentCache
+
+
+class TestFragments(TestCase):
+
+    def test_get(self):
+        cache = FragmentCache()
+        renders = []
+
+        def render():
+            renders.append(1)
+            return "<tr></tr>"
+
+        self.assertEqual(cache.get(('a', 1, 'sbf_table'), render), "<tr></tr>")
+        self.assertEqual(cache.get(('a', 1, 'sbf_table'), render), "<tr></tr>")
+        self.assertEqual(len(renders), 1)
+        cache.get(('a', 2, 'sbf_table'), render)
+        self.assertEqual(len(renders), 2)
+
+    def test_eviction(self):
+        cache = FragmentCache(max_bytes=10)
+        cache.get('a', lambda: "x" * 4)
+        cache.get('b', lambda: "x" * 4)
+        cache.get('a', lambda: "x" * 4)
+        cache.get('c', lambda: "x" * 4)
+
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertLessEqual(cache.size, cache.max_bytes)
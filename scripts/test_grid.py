@@ -0,0 +1,42 @@
+from unittest import TestCase
+from scripts.grid import CoordinateGrid, CORK_GRID, pack_coordinate, pack_coordinates, unpack_coordinates
+import numpy as np
+
+
+class TestGrid(TestCase):
+
+    def test_cork_elements(self):
+        expected = ["51.{}#-8.{}".format(x, y) for x in range(8945, 9021) for y in range(4694, 4846)]
+
+        self.assertEqual(len(CORK_GRID), len(expected))
+        self.assertEqual(list(CORK_GRID), expected)
+
+    def test_index_of(self):
+        self.assertEqual(CORK_GRID.index_of(CORK_GRID.element(1234)), 1234)
+        self.assertEqual(CORK_GRID.index_of("51.8944#-8.4700"), -1)
+        self.assertEqual(CORK_GRID.index_of("51.89540#-8.4772"), -1)
+        self.assertEqual(CORK_GRID.index_of("not a coordinate"), -1)
+        np.testing.assert_array_equal(CORK_GRID.indexes_of(["51.8945#-8.4694", "x"]), [0, -1])
+
+    def test_coordinates(self):
+        grid = CoordinateGrid((-5, 5), (20, 10))
+        lats, lons = grid.coordinates([0, grid.size - 1])
+
+        self.assertEqual(grid.element(0), "-0.0005#0.0020")
+        np.testing.assert_array_equal(lats, [-5, 5])
+        np.testing.assert_array_equal(lons, [20, 10])
+
+    def test_immutable(self):
+        with self.assertRaisesRegex(AttributeError, "CoordinateGrid is immutable."):
+            CORK_GRID.rows = 1
+
+    def test_packed(self):
+        packed = pack_coordinates([51.8954, 51.8945, 52.0], [-8.4772, -8.4694, -8.4772])
+        lats, lons = unpack_coordinates(packed)
+
+        np.testing.assert_array_equal(lats, [518954, 518945, 520000])
+        np.testing.assert_array_equal(lons, [-84772, -84694, -84772])
+        self.assertEqual(len(pack_coordinate(51.8954, -8.4772)), 8)
+        np.testing.assert_array_equal(CORK_GRID.indexes_of(packed), [CORK_GRID.index_of("51.8954#-8.4772"), 0, -1])
+        self.assertEqual(CORK_GRID.index_of(pack_coordinate(51.8954, -8.4772)), CORK_GRID.index_of("51.8954#-8.4772"))
+        np.testing.assert_array_equal(CORK_GRID.packed([0, 1446]), packed[[1, 0]])
@@ -0,0 +1,41 @@
+from unittest import TestCase
+from scripts.cells import new_cells
+from scripts.heatmap import filter_tiles, filter_heatmap
+import numpy as np
+import struct
+import zlib
+
+
+class TestHeatmap(TestCase):
+
+    def test_filter_tiles(self):
+        cells = np.array([0, 1, 0, 0, 4, 2, 0, 0], dtype=np.uint8)
+
+        np.testing.assert_array_equal(filter_tiles(cells, 4, 'max'), [1, 0, 4, 0])
+        np.testing.assert_array_equal(filter_tiles(cells, 2, 'occupancy'), [0.25, 0.5])
+        with self.assertRaisesRegex(AttributeError, "Invalid heatmap mode."):
+            filter_tiles(cells, 2, 'mean')
+
+    def test_filter_heatmap(self):
+        cells = np.zeros(1 << 12, dtype=np.uint8)
+        cells[:16] = 3
+        png = filter_heatmap(cells, 4, size=16)
+
+        self.assertEqual(png[:8], b'\x89PNG\r\n\x1a\n')
+        width, height, depth, colour_type = struct.unpack('>IIBB', png[16:26])
+        self.assertEqual((width, height, depth, colour_type), (16, 16, 8, 3))
+
+        idat = png.index(b'IDAT')
+        length = struct.unpack('>I', png[idat - 4:idat])[0]
+        scanlines = np.frombuffer(zlib.decompress(png[idat + 4:idat + 4 + length]), dtype=np.uint8)
+        pixels = scanlines.reshape(16, 17)[:, 1:]
+        self.assertEqual(pixels[0, 0], 3)
+        self.assertEqual(np.count_nonzero(pixels), 1)
+
+    def test_sparse_tiles(self):
+        cells = np.array([0, 1, 0, 0, 4, 2, 0, 0], dtype=np.uint8)
+        sparse = new_cells('sparse', 8)
+        sparse[np.flatnonzero(cells)] = cells[cells != 0]
+
+        np.testing.assert_array_equal(filter_tiles(sparse, 4, 'max'), filter_tiles(cells, 4, 'max'))
+        np.testing.assert_array_equal(filter_tiles(sparse, 2, 'occupancy'), filter_tiles(cells, 2, 'occupancy'))
@@ -0,0 +1,79 @@
+from unittest import TestCase
+from scripts.cells import PackedCells
+from scripts.layout import Layout
+import numpy as np
+
+
+class WindowCells(PackedCells):
+    """
+    Packed cells recording the ranges read, and refusing to be unpacked whole.
+    """
+
+    def __init__(self, size, bits):
+        super().__init__(size, bits)
+        self.reads = []
+
+    def __array__(self, dtype=None, copy=None):
+        raise AssertionError("The whole filter was unpacked")
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            self.reads.append(range(*key.indices(self.size)))
+        return super().__getitem__(key)
+
+
+class TestLayout(TestCase):
+
+    def test_load_table(self):
+        table = Layout(7).load_table(np.arange(128, dtype=np.uint8) % 5)
+
+        self.assertEqual(table.count("<tr>"), 2)
+        self.assertEqual(table.count("<td>"), 128)
+        self.assertTrue(table.startswith("<tr><td>0</td><td>1</td>"))
+
+    def test_highlight_table(self):
+        layout = Layout(7, hash_family=['md5', 'sha1'])
+        sbf_table = np.zeros(128, dtype=np.uint8)
+        plain = layout.highlight_table(sbf_table, {'md5': [3, 0], 'sha1': [100, 0]}, generation=1)
+        cached = layout.highlight_table(sbf_table, {'md5': [5, 0], 'sha1': [5, 0]}, generation=1)
+
+        self.assertIn("<td class=\"tooltip\" id=3 style=\"background-color: red\">0"
+                      "<span class=\"tooltiptext\">MD5</span></td>", plain)
+        self.assertIn("<span class=\"tooltiptext\">SHA1</span>", plain)
+        self.assertIn("<td id=3>0</td>", cached)
+        self.assertEqual(cached.count("tooltiptext"), 1)
+        self.assertIn("<td id=100>0</td>", cached)
+
+        # Layouts sharing a row cache (one per request) reuse each other's rows
+        shared = Layout(7, hash_family=['sha1'], row_cache=layout.row_cache)
+        self.assertIn("<td id=3>0</td>", shared.highlight_table(sbf_table, {'sha1': [5, 0]}, generation=1))
+
+    def test_load_window(self):
+        layout = Layout()
+        layout.hash_family = ['md5']
+        sbf_table = np.arange(1 << 16, dtype=np.uint16)
+        window = layout.load_window(sbf_table, 1000, 20, row_width=8, results={'md5': [1005, 0]})
+
+        self.assertEqual(window.count("<tr>"), 3)
+        self.assertTrue(window.startswith("<tr><td id=1000>1000</td>"))
+        self.assertIn("<td class=\"tooltip\" id=1005 style=\"background-color: red\">1005", window)
+        self.assertNotIn("id=1020", window)
+        self.assertEqual(layout.load_window(sbf_table, (1 << 16) - 2, 20).count("<td"), 2)
+
+    def test_load_window_packed(self):
+        sbf_table = WindowCells(1 << 20, 4)
+        sbf_table[1005] = 3
+        window = Layout().load_window(sbf_table, 1000, 20, row_width=8)
+
+        self.assertIn("<td id=1005>3</td>", window)
+        self.assertEqual(sbf_table.reads, [range(1000, 1020)])
+
+    def test_area_stats(self):
+        stats1 = {str(a).rjust(2): [str(a), '0'] for a in range(1, 13)}
+        stats2 = {str(a).rjust(2): ['0.5'] for a in range(1, 13)}
+        properties, other_stats = Layout().area_stats(stats1, stats2)
+
+        self.assertEqual(properties.count("<tr>"), 12)
+        self.assertTrue(properties.startswith("<tr><td> 1</td><td>1</td><td>0</td></tr>"))
+        self.assertTrue(properties.endswith("<tr><td>12</td><td>12</td><td>0</td></tr>"))
+        self.assertEqual(other_stats.count("<td>0.5</td>"), 12)
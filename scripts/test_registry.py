@@ -0,0 +1,59 @@
+from unittest import TestCase
+from scripts.registry import FilterRegistry
+from scripts.sbf import sbf
+
+
+class TestRegistry(TestCase):
+
+    def test_get(self):
+        registry = FilterRegistry(hash_salt_path="../hash_salt/hash_salt")
+        fltr = registry.get('a', ['md5', 'sha1'], bit_mapping=4)
+        fltr.insert("51.8989#-8.4825", 1)
+
+        self.assertIs(registry.get('a', ['md5', 'sha1'], bit_mapping=4), fltr)
+        self.assertIsNot(registry.get('b', ['md5', 'sha1'], bit_mapping=4), fltr)
+        self.assertEqual(registry.get('b', ['md5', 'sha1'], bit_mapping=4).members, 0)
+
+    def test_shared_engine(self):
+        registry = FilterRegistry(hash_salt_path="../hash_salt/hash_salt")
+        a = registry.get('a', ['md5', 'sha1'], bit_mapping=4)
+        b = registry.get('b', ['md5', 'sha1'], bit_mapping=4)
+        c = registry.get('c', ['md5', 'sha256'], bit_mapping=4)
+
+        self.assertIs(a.hash_engine, b.hash_engine)
+        self.assertIsNot(a.hash_engine, c.hash_engine)
+
+    def test_hashing_modes(self):
+        registry = FilterRegistry(hash_salt_path="../hash_salt/hash_salt")
+        salted = registry.register('a', sbf(['md5', 'sha1'], 4, hash_salt_path="../hash_salt/hash_salt",
+                                            salt_version=2))
+        double = registry.get('b', ['md5', 'sha1'], bit_mapping=4, index_mode='double')
+        plain = registry.get('c', ['md5', 'sha1'], bit_mapping=4)
+
+        self.assertEqual((plain.index_mode, plain.salt_version), ('digest', 1))
+        self.assertEqual(double.index_mode, 'double')
+        self.assertIsNot(plain.hash_engine, salted.hash_engine)
+        self.assertIsNot(plain.hash_engine, double.hash_engine)
+        self.assertIsNot(registry.get('b', ['md5', 'sha1'], bit_mapping=4), double)
+
+    def test_new_configuration(self):
+        registry = FilterRegistry(hash_salt_path="../hash_salt/hash_salt")
+        fltr = registry.get('a', ['md5', 'sha1'], bit_mapping=4)
+        other = registry.get('a', ['sha256'], bit_mapping=4)
+
+        self.assertIsNot(other, fltr)
+        self.assertEqual(other.get_hash_family(), ['sha256'])
+        self.assertEqual(len(registry), 1)
+
+    def test_eviction(self):
+        registry = FilterRegistry(hash_salt_path="../hash_salt/hash_salt")
+        size = registry.get('a', ['md5'], bit_mapping=4).memory_usage()
+        registry.memory_budget = 2 * size
+        registry.get('b', ['md5'], bit_mapping=4)
+        registry.get('a', ['md5'], bit_mapping=4)
+        registry.get('c', ['md5'], bit_mapping=4)
+
+        self.assertIn('a', registry)
+        self.assertNotIn('b', registry)
+        self.assertIn('c', registry)
+        self.assertLessEqual(registry.memory_usage(), registry.memory_budget)
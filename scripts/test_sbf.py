@@ -1,7 +1,11 @@
 from unittest import TestCase
 from scripts.sbf import sbf
+from scripts.grid import pack_coordinate, pack_coordinates
 import numpy as np
 import ast
+import os
+import tempfile
+import csv
 
 
 class TestSbf(TestCase):
@@ -57,3 +61,379 @@ class TestSbf(TestCase):
         fltr.clear_filter()
 
         self.assertEqual(np.count_nonzero(fltr.get_filter()), 0)
+
+    def test_insert_many(self):
+        elements = ["51.{}#-8.{}".format(8950 + i % 7, 4700 + i) for i in range(200)]
+        areas = [(i * 7) % 4 + 1 for i in range(200)]
+        sequential = sbf(['sha512', 'md5', 'sha1'], bit_mapping=6, hash_salt_path="../hash_salt/hash_salt")
+        for element, area in zip(elements, areas):
+            sequential.insert(element, area)
+        batch = sbf(['sha512', 'md5', 'sha1'], bit_mapping=6, hash_salt_path="../hash_salt/hash_salt")
+        batch.insert_many(elements[:50], areas[:50])
+        batch.insert_many(elements[50:], areas[50:])
+
+        np.testing.assert_array_equal(batch.get_filter(), sequential.get_filter())
+        self.assertEqual(batch.members, sequential.members)
+        self.assertEqual(batch.collisions, sequential.collisions)
+        self.assertEqual(batch.area_members, sequential.area_members)
+        self.assertEqual(batch.area_cells, sequential.area_cells)
+        self.assertEqual(batch.area_self_collisions, sequential.area_self_collisions)
+
+    def test_insert_many_invalid_area(self):
+        fltr = sbf(['sha512', 'md5', 'sha1'], bit_mapping=4, hash_salt_path="../hash_salt/hash_salt")
+        with self.assertRaisesRegex(AttributeError, "Invalid area number."):
+            fltr.insert_many(["51.8989#-8.4825"], [5])
+
+    def test_check_many(self):
+        fltr = sbf(['sha512', 'md5', 'sha1'], bit_mapping=4, hash_salt_path="../hash_salt/hash_salt")
+        fltr.insert("51.8989#-8.4825", 2)
+        elements = ["51.8989#-8.4825", "51.8980#-8.4845"]
+        indexes, areas, min_areas = fltr.check_many(elements)
+
+        self.assertEqual(indexes.shape, (2, 3))
+        for row, element in enumerate(elements):
+            result = fltr.check(element)
+            for col, hf in enumerate(['sha512', 'md5', 'sha1']):
+                self.assertEqual(indexes[row, col], result[hf][0])
+                self.assertEqual(areas[row, col], result[hf][1])
+        self.assertEqual(list(min_areas), [2, 0])
+
+    def test_hash_timings(self):
+        fltr = sbf(['sha512', 'md5', 'sha1'], bit_mapping=4, hash_salt_path="../hash_salt/hash_salt")
+        fltr.insert("51.8989#-8.4825", 1)
+        fltr.check_many(["51.8989#-8.4825", "51.8980#-8.4845"])
+        timings = fltr.get_hash_timings()
+
+        self.assertEqual(list(timings.keys()), ['sha512', 'md5', 'sha1'])
+        for calls, seconds in timings.values():
+            self.assertEqual(calls, 3)
+            self.assertGreaterEqual(seconds, 0)
+
+    def test_parallel_insert_from_file(self):
+        serial = sbf(['sha512', 'md5', 'sha1'], bit_mapping=8, hash_salt_path="../hash_salt/hash_salt")
+        serial.insert_from_file("../dataset/cork.csv")
+        parallel = sbf(['sha512', 'md5', 'sha1'], bit_mapping=8, hash_salt_path="../hash_salt/hash_salt")
+        parallel.insert_from_file("../dataset/cork.csv", workers=2, chunk_size=50)
+
+        np.testing.assert_array_equal(parallel.get_filter(), serial.get_filter())
+        self.assertEqual(parallel.members, serial.members)
+        self.assertEqual(parallel.collisions, serial.collisions)
+        self.assertEqual(parallel.area_cells, serial.area_cells)
+        self.assertEqual(parallel.area_self_collisions, serial.area_self_collisions)
+        self.assertEqual(parallel.all_coors, serial.all_coors)
+
+    def test_insert_from_sources(self):
+        with open("../dataset/cork.csv") as dataset_file:
+            rows = [(int(area), element) for area, element in csv.reader(dataset_file)]
+        from_path = sbf(['sha512', 'md5', 'sha1'], bit_mapping=8, hash_salt_path="../hash_salt/hash_salt")
+        from_path.insert_from("../dataset/cork.csv")
+        from_pairs = sbf(['sha512', 'md5', 'sha1'], bit_mapping=8, hash_salt_path="../hash_salt/hash_salt")
+        progress = []
+        from_pairs.insert_from(iter(rows), chunk_size=100, progress=progress.append)
+        from_file = sbf(['sha512', 'md5', 'sha1'], bit_mapping=8, hash_salt_path="../hash_salt/hash_salt")
+        with open("../dataset/cork.csv") as dataset_file:
+            from_file.insert_from(dataset_file)
+
+        np.testing.assert_array_equal(from_pairs.get_filter(), from_path.get_filter())
+        np.testing.assert_array_equal(from_file.get_filter(), from_path.get_filter())
+        self.assertEqual(from_pairs.collisions, from_path.collisions)
+        self.assertEqual(progress, [100, 200, 300, 400, len(rows)])
+        self.assertEqual(len(from_path.all_coors), len(from_pairs.all_coors))
+        self.assertNotIn(rows[0][1], from_path.all_coors)
+        self.assertEqual(from_path.insert_file_list, ["../dataset/cork.csv"])
+
+    def test_all_coors(self):
+        fltr = sbf(['sha512', 'md5', 'sha1'], bit_mapping=4, hash_salt_path="../hash_salt/hash_salt")
+        fltr.insert("51.8989#-8.4825", 1)
+
+        self.assertEqual(len(fltr.all_coors), len(fltr.grid) - 1)
+        self.assertNotIn("51.8989#-8.4825", fltr.all_coors)
+        fltr.clear_filter()
+        self.assertIn("51.8989#-8.4825", fltr.all_coors)
+
+    def test_evaluate_grid(self):
+        fltr = sbf(['sha512', 'md5', 'sha1'], bit_mapping=6, hash_salt_path="../hash_salt/hash_salt")
+        fltr.insert_from("../dataset/cork.csv")
+        report = fltr.evaluate_grid()
+        free_coors = fltr.all_coors
+        _, _, min_areas = fltr.check_many(free_coors)
+
+        self.assertEqual(len(report["False Positives"]), np.count_nonzero(min_areas))
+        self.assertAlmostEqual(report["Filter FPR"], np.count_nonzero(min_areas) / len(free_coors))
+        self.assertAlmostEqual(sum(report["Area FPR"]), report["Filter FPR"])
+        self.assertEqual(len(fltr.find_false_positives(limit=None)), len(report["False Positives"]))
+        self.assertIs(fltr.evaluate_grid(), report)
+
+        fltr.clear_filter()
+        self.assertEqual(len(fltr.evaluate_grid()["False Positives"]), 0)
+
+    def test_check_cache(self):
+        fltr = sbf(['sha512', 'md5', 'sha1'], bit_mapping=4, hash_salt_path="../hash_salt/hash_salt")
+        negative = fltr.check("51.8989#-8.4825")
+        generation = fltr.generation
+
+        self.assertIs(fltr.check("51.8989#-8.4825"), negative)
+        self.assertEqual(fltr.get_hash_timings()['md5'][0], 1)
+
+        fltr.insert("51.8989#-8.4825", 3)
+        self.assertGreater(fltr.generation, generation)
+        positive = fltr.check("51.8989#-8.4825")
+        self.assertEqual(min(int(m[1]) for m in positive.values()), 3)
+        self.assertEqual(fltr.get_hash_timings()['md5'][0], 2)
+        self.assertIs(fltr.incorrect_values(), fltr.incorrect_values())
+
+        fltr.clear_filter()
+        self.assertEqual(min(int(m[1]) for m in fltr.check("51.8989#-8.4825").values()), 0)
+
+    def test_save_load(self):
+        fltr = sbf(['sha512', 'md5', 'sha1'], bit_mapping=6, hash_salt_path="../hash_salt/hash_salt")
+        fltr.insert_from("../dataset/cork.csv")
+        fltr.update_stats()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "cork.sbf")
+            fltr.save(path)
+            mapped = sbf.load(path, hash_salt_path="../hash_salt/hash_salt")
+            loaded = sbf.load(path, hash_salt_path="../hash_salt/hash_salt", mmap=False)
+
+            for other in (mapped, loaded):
+                np.testing.assert_array_equal(other.get_filter(), fltr.get_filter())
+                np.testing.assert_array_equal(other.grid_areas, fltr.grid_areas)
+                self.assertEqual(other.collisions, fltr.collisions)
+                self.assertEqual(other.area_cells, fltr.area_cells)
+                self.assertEqual(other.area_self_collisions, fltr.area_self_collisions)
+                self.assertEqual(other.get_stats(), fltr.get_stats())
+                self.assertEqual(other.check("51.8954#-8.4772"), fltr.check("51.8954#-8.4772"))
+
+            self.assertFalse(mapped.filter.flags.writeable)
+            self.assertTrue(loaded.filter.flags.writeable)
+            del mapped
+
+    def test_load_invalid(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "cork.sbf")
+            with open(path, 'wb') as filter_file:
+                filter_file.write(b'not a filter')
+            with self.assertRaisesRegex(IOError, "Invalid filter file."):
+                sbf.load(path, hash_salt_path="../hash_salt/hash_salt")
+
+            sbf(['md5'], bit_mapping=4, hash_salt_path="../hash_salt/hash_salt").save(path)
+            other_salt = os.path.join(tmp_dir, "hash_salt")
+            with open(other_salt, 'w') as salt_file:
+                salt_file.write("c2FsdA==\n")
+            with self.assertRaisesRegex(AttributeError, "Invalid hash salt."):
+                sbf.load(path, hash_salt_path=other_salt)
+
+    def test_sparse_backend(self):
+        dense = sbf(['sha512', 'md5', 'sha1'], bit_mapping=8, hash_salt_path="../hash_salt/hash_salt")
+        sparse = sbf(['sha512', 'md5', 'sha1'], bit_mapping=8, hash_salt_path="../hash_salt/hash_salt",
+                     cell_backend='sparse')
+        for fltr in (dense, sparse):
+            fltr.insert("51.8989#-8.4825", 4)
+            fltr.insert_from("../dataset/cork.csv")
+            fltr.update_stats()
+
+        np.testing.assert_array_equal(np.asarray(sparse.get_filter()), dense.get_filter())
+        self.assertEqual(sparse.area_cells, dense.area_cells)
+        self.assertEqual(sparse.get_stats(), dense.get_stats())
+        self.assertEqual(sparse.check("51.8954#-8.4772"), dense.check("51.8954#-8.4772"))
+        self.assertEqual(sparse.incorrect_values(), dense.incorrect_values())
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "cork.sbf")
+            sparse.save(path)
+            loaded = sbf.load(path, hash_salt_path="../hash_salt/hash_salt")
+            self.assertEqual(loaded.cell_backend, 'sparse')
+            np.testing.assert_array_equal(np.asarray(loaded.get_filter()), dense.get_filter())
+            del loaded
+
+    def test_large_filter(self):
+        fltr = sbf(['md5', 'sha1'], bit_mapping=64, hash_salt_path="../hash_salt/hash_salt")
+        fltr.insert_from("../dataset/cork.csv")
+
+        self.assertEqual(fltr.cell_backend, 'sparse')
+        self.assertEqual(len(fltr.get_filter().values), fltr.members * 2 - fltr.collisions)
+        self.assertEqual(min(int(m[1]) for m in fltr.check("51.8954#-8.4772").values()), 1)
+        self.assertEqual(len(fltr.find_false_positives(limit=None)), 0)
+
+    def test_packed_cells(self):
+        fltr = sbf(['sha512', 'md5', 'sha1'], bit_mapping=10, hash_salt_path="../hash_salt/hash_salt")
+        fltr.insert_from("../dataset/cork.csv")
+
+        self.assertEqual(fltr.cell_bits, 4)
+        self.assertEqual(fltr.filter.nbytes, 512)
+        self.assertEqual(np.count_nonzero(fltr.get_filter()), sum(fltr.area_cells))
+        self.assertEqual(int(np.asarray(fltr.get_filter()).max()), 4)
+        self.assertIsInstance(fltr.get_filter(), np.ndarray)
+
+        scalar = sbf(['sha512', 'md5', 'sha1'], bit_mapping=10, hash_salt_path="../hash_salt/hash_salt")
+        with open("../dataset/cork.csv") as dataset_file:
+            for area, element in csv.reader(dataset_file):
+                scalar.insert(element, int(area))
+        np.testing.assert_array_equal(scalar.get_filter(), fltr.get_filter())
+        self.assertEqual(scalar.area_self_collisions, fltr.area_self_collisions)
+
+    def test_num_areas(self):
+        elements = ["51.{}#-8.{}".format(8950 + i % 7, 4700 + i) for i in range(600)]
+        areas = [i % 300 + 1 for i in range(600)]
+        fltr = sbf(['md5', 'sha1'], bit_mapping=12, hash_salt_path="../hash_salt/hash_salt", num_areas=300)
+        fltr.insert_many(elements, areas)
+        fltr.update_stats()
+        properties, stats = fltr.area_stats()
+
+        self.assertEqual(fltr.cell_bits, 16)
+        self.assertEqual(len(properties), 300)
+        self.assertEqual(properties['300'], ['2', str(fltr.area_cells[300]), '4', str(fltr.area_self_collisions[300])])
+        self.assertAlmostEqual(sum(fltr.area_fpp), fltr._filter_fpp())
+        emersion = fltr.area_cells[1] / (fltr.area_members[1] * 2 - fltr.area_self_collisions[1])
+        self.assertEqual(stats['  1'][0], '{:.4f}'.format(round(emersion, 4)))
+        np.testing.assert_array_equal(sbf._area_emersions_of(np.array([3, 0]), np.array([2, 0]), np.array([1, 0]), 2),
+                                      [1.0, -1.0])
+        self.assertEqual(int(np.asarray(fltr.get_filter()).max()), max(a for a in range(301) if fltr.area_cells[a]))
+        with self.assertRaisesRegex(AttributeError, "Invalid area number."):
+            fltr.insert("51.8989#-8.4825", 301)
+        with self.assertRaisesRegex(AttributeError, "Invalid number of areas."):
+            sbf(['md5'], bit_mapping=4, hash_salt_path="../hash_salt/hash_salt", num_areas=0)
+
+    def test_plan(self):
+        fltr = sbf(['md5', 'sha1', 'sha256'], bit_mapping=12, hash_salt_path="../hash_salt/hash_salt")
+        fltr.insert_from("../dataset/cork.csv")
+        fltr.update_stats()
+        expected = sbf.expected_stats(fltr.area_members[1:], 12, 3)
+
+        self.assertAlmostEqual(float(expected["Filter FPP"]), fltr._filter_fpp(), delta=0.002)
+        np.testing.assert_allclose(expected["Area Cells"][1:], fltr.area_cells[1:], rtol=0.05)
+
+        plan = sbf.plan(fltr.area_members[1:], fpp=0.01, max_hashes=4)
+        self.assertLessEqual(plan["Filter FPP"], 0.01)
+        smaller = sbf.expected_stats(fltr.area_members[1:], plan["Bit Mapping"] - 1, np.arange(1, 5))
+        self.assertTrue((smaller["Filter FPP"] > 0.01).all())
+
+        hash_family = ['md5', 'sha1', 'sha256', 'sha512'][:plan["Number of Hash Functions"]]
+        built = sbf.check_plan(plan, "../dataset/cork.csv", hash_family, sample_bits=1,
+                               hash_salt_path="../hash_salt/hash_salt")
+        self.assertAlmostEqual(built["Filter FPP"], plan["Filter FPP"], delta=0.005)
+
+        isep_plan = sbf.plan(fltr.area_members[1:], isep=0.0001, max_hashes=4)
+        self.assertLessEqual(max(isep_plan["Area ISEP"]), 0.0001)
+        with self.assertRaisesRegex(AttributeError, "Unreachable targets."):
+            sbf.plan(fltr.area_members[1:], fpp=0, max_hashes=1)
+        with self.assertRaisesRegex(AttributeError, "Invalid targets."):
+            sbf.plan(fltr.area_members[1:])
+
+    def test_double_hashing(self):
+        family = ['sha512', 'md5', 'sha1', 'sha256', 'sha224', 'sha384']
+        fltr = sbf(family, bit_mapping=10, hash_salt_path="../hash_salt/hash_salt", index_mode='double')
+        batch = sbf(family, bit_mapping=10, hash_salt_path="../hash_salt/hash_salt", index_mode='double')
+        elements = ["51.{}#-8.{}".format(8950 + i % 7, 4700 + i) for i in range(100)]
+        for element in elements:
+            fltr.insert(element, 2)
+        batch.insert_many(elements, [2] * len(elements))
+
+        np.testing.assert_array_equal(batch.get_filter(), fltr.get_filter())
+        self.assertEqual(batch.area_self_collisions, fltr.area_self_collisions)
+        indexes = fltr.hash_engine.indexes_many(elements)
+        self.assertEqual([int(i) for i in indexes[7]], fltr.hash_engine.indexes(elements[7]))
+        self.assertTrue(all(len(set(row.tolist())) == len(family) for row in indexes))
+
+        result = fltr.check(elements[0])
+        self.assertEqual(list(result.keys()), family)
+        self.assertEqual(min(int(m[1]) for m in result.values()), 2)
+        self.assertEqual(fltr.get_hash_timings()['md5'][0], 0)
+        self.assertEqual(fltr.get_hash_timings()['sha512'][0], 202)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "double.sbf")
+            fltr.save(path)
+            loaded = sbf.load(path, hash_salt_path="../hash_salt/hash_salt", mmap=False)
+            self.assertEqual(loaded.index_mode, 'double')
+            self.assertEqual(loaded.check(elements[0]), result)
+        with self.assertRaisesRegex(AttributeError, "Invalid index mode."):
+            sbf(family, bit_mapping=10, hash_salt_path="../hash_salt/hash_salt", index_mode='triple')
+
+    def test_keyed_salt(self):
+        family = ['sha512', 'md5', 'sha1']
+        fltr = sbf(family, bit_mapping=16, hash_salt_path="../hash_salt/hash_salt", salt_version=2)
+        legacy = sbf(family, bit_mapping=16, hash_salt_path="../hash_salt/hash_salt")
+        elements = ["51.{}#-8.{}".format(8950 + i % 7, 4700 + i) for i in range(50)]
+        fltr.insert_many(elements, [3] * len(elements))
+
+        indexes = fltr.hash_engine.indexes_many(elements)
+        self.assertEqual([int(i) for i in indexes[5]], fltr.hash_engine.indexes(elements[5]))
+        self.assertNotEqual(fltr.hash_engine.indexes(elements[5]), legacy.hash_engine.indexes(elements[5]))
+        self.assertEqual(min(int(m[1]) for m in fltr.check(elements[5]).values()), 3)
+
+        # Elements longer than the salt only differ after its length, which the legacy salting truncates away
+        long_a, long_b = "x" * 200 + "a", "x" * 200 + "b"
+        self.assertEqual(legacy.hash_engine.indexes(long_a), legacy.hash_engine.indexes(long_b))
+        self.assertNotEqual(fltr.hash_engine.indexes(long_a), fltr.hash_engine.indexes(long_b))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "keyed.sbf")
+            fltr.save(path)
+            loaded = sbf.load(path, hash_salt_path="../hash_salt/hash_salt", mmap=False)
+            self.assertEqual(loaded.salt_version, 2)
+            self.assertEqual(loaded.check(elements[5]), fltr.check(elements[5]))
+        with self.assertRaisesRegex(AttributeError, "Invalid hash engine."):
+            sbf(family, bit_mapping=16, hash_salt_path="../hash_salt/hash_salt", hash_engine=legacy.hash_engine,
+                salt_version=2)
+        with self.assertRaisesRegex(AttributeError, "Invalid salt version."):
+            sbf(family, bit_mapping=16, hash_salt_path="../hash_salt/hash_salt", salt_version=3)
+
+    def test_packed_elements(self):
+        lats = [51.8954, 51.8945, 51.9001, 51.8990]
+        lons = [-8.4772, -8.4694, -8.4800, -8.4701]
+        strings = ["51.8954#-8.4772", "51.8945#-8.4694", "51.9001#-8.4800", "51.8990#-8.4701"]
+        packed = sbf(['sha512', 'md5'], bit_mapping=12, hash_salt_path="../hash_salt/hash_salt",
+                     element_format='packed')
+        legacy = sbf(['sha512', 'md5'], bit_mapping=12, hash_salt_path="../hash_salt/hash_salt")
+        packed.insert_many(pack_coordinates(lats, lons), [1, 2, 3, 4])
+        legacy.insert_many(strings, [1, 2, 3, 4])
+
+        # Both forms of a coordinate map to the same cells of a filter
+        for lat, lon, element in zip(lats, lons, strings):
+            self.assertEqual(packed.check(pack_coordinate(lat, lon)), packed.check(element))
+            self.assertEqual(legacy.check(pack_coordinate(lat, lon)), legacy.check(element))
+        np.testing.assert_array_equal(packed.check_many(pack_coordinates(lats, lons))[1],
+                                      packed.check_many(strings)[1])
+        np.testing.assert_array_equal(packed.grid_areas, legacy.grid_areas)
+        self.assertEqual(len(packed.evaluate_grid()["Overwrites"]), 0)
+
+        single = sbf(['sha512', 'md5'], bit_mapping=12, hash_salt_path="../hash_salt/hash_salt",
+                     element_format='packed')
+        for lat, lon, area in zip(lats, lons, [1, 2, 3, 4]):
+            single.insert(pack_coordinate(lat, lon), area)
+        np.testing.assert_array_equal(single.get_filter(), packed.get_filter())
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "packed.sbf")
+            packed.save(path)
+            loaded = sbf.load(path, hash_salt_path="../hash_salt/hash_salt", mmap=False)
+            self.assertEqual(loaded.element_format, 'packed')
+            self.assertEqual(loaded.check(strings[0]), packed.check(strings[0]))
+        with self.assertRaisesRegex(AttributeError, "Invalid element format."):
+            sbf(['md5'], bit_mapping=12, hash_salt_path="../hash_salt/hash_salt", element_format='float')
+
+    def test_check_radius(self):
+        fltr = sbf(['sha512', 'md5', 'sha1'], bit_mapping=12, hash_salt_path="../hash_salt/hash_salt")
+        fltr.insert_from_file("../dataset/cork.csv")
+
+        report = fltr.check_radius(51.8954, -8.4772, 2)
+        self.assertEqual(len(report["Distances"]), 13)
+        self.assertEqual(report["Distances"][0], 0)
+        self.assertEqual(int(report["Min Areas"][0]), min(int(m[1]) for m in fltr.check("51.8954#-8.4772").values()))
+        self.assertEqual(sum(report["Area Counts"]), 13)
+        self.assertEqual(report["Area"], int(report["Min Areas"].max()))
+
+        # Only the neighbours are hashed, the grid is left alone
+        self.assertNotIn(fltr.grid, fltr.hash_engine.grid_cache)
+        corner = fltr.check_radius(51.8945, -8.4694, 3)
+        elements = fltr.grid.elements_at(corner["Latitudes"], corner["Longitudes"])
+        np.testing.assert_array_equal(corner["Areas"], fltr.check_many(elements)[1])
+
+        # Once the grid is hashed, its cells are looked up, and the neighbours outside of it hashed
+        fltr.evaluate_grid()
+        np.testing.assert_array_equal(fltr.check_radius(51.8945, -8.4694, 3)["Indexes"], corner["Indexes"])
+
+        with self.assertRaisesRegex(AttributeError, "Invalid radius."):
+            fltr.check_radius(51.8954, -8.4772, -1)
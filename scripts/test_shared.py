@@ -0,0 +1,115 @@
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+from unittest import TestCase
+from scripts.sbf import sbf
+from scripts.shared import SharedFilter
+
+
+def _start_worker(name, start, finish, results, publish_all):
+    """
+    Starts a worker process of a server sharing a filter: either every worker publishes, or only the one creating
+    the shared filter does while the others wait for it.
+    """
+    try:
+        shared = SharedFilter(name)
+        fltr = sbf(['md5', 'sha1'], bit_mapping=6, hash_salt_path="../hash_salt/hash_salt")
+        fltr.insert("51.8989#-8.4825", 1)
+        start.wait()
+        if publish_all or shared.create():
+            shared.publish(fltr)
+        else:
+            shared.wait(timeout=10)
+        results.put(shared.attach(hash_salt_path="../hash_salt/hash_salt").members)
+    except Exception as error:
+        results.put(repr(error))
+        shared = None
+    # The segments of the publishers must outlive the attaching workers and the checks of the test
+    finish.wait()
+    if shared is not None:
+        shared.close()
+
+
+class TestShared(TestCase):
+
+    def setUp(self):
+        self.name = "sbf_test_{}".format(os.getpid())
+        self.builder = SharedFilter(self.name)
+        self.worker = SharedFilter(self.name)
+
+    def tearDown(self):
+        self.worker.close()
+        self.builder.unlink()
+
+    def test_publish_attach(self):
+        fltr = sbf(['md5', 'sha1'], bit_mapping=6, hash_salt_path="../hash_salt/hash_salt")
+        fltr.insert("51.8989#-8.4825", 1)
+        fltr.insert("51.8990#-8.4825", 2)
+        self.builder.publish(fltr)
+
+        shared = self.worker.attach(hash_salt_path="../hash_salt/hash_salt")
+        self.assertEqual(list(shared.get_filter()), list(fltr.get_filter()))
+        self.assertEqual(shared.members, fltr.members)
+        self.assertEqual(shared.check("51.8990#-8.4825"), fltr.check("51.8990#-8.4825"))
+        self.assertFalse(shared.get_filter().flags.writeable)
+        self.assertIs(self.worker.attach(hash_salt_path="../hash_salt/hash_salt"), shared)
+
+    def test_republish(self):
+        fltr = sbf(['md5', 'sha1'], bit_mapping=6, hash_salt_path="../hash_salt/hash_salt")
+        first = self.builder.publish(fltr)
+        shared = self.worker.attach(hash_salt_path="../hash_salt/hash_salt")
+
+        fltr.insert("51.8989#-8.4825", 3)
+        second = self.builder.publish(fltr)
+        self.assertEqual(self.worker.generation(), second)
+        self.assertNotEqual(first, second)
+
+        updated = self.worker.attach(hash_salt_path="../hash_salt/hash_salt")
+        self.assertIsNot(updated, shared)
+        self.assertEqual(updated.members, 1)
+        self.assertEqual(list(updated.get_filter()), list(fltr.get_filter()))
+
+    def test_not_published(self):
+        with self.assertRaises(FileNotFoundError):
+            self.worker.attach(hash_salt_path="../hash_salt/hash_salt")
+
+    def test_view(self):
+        fltr = sbf(['md5', 'sha1'], bit_mapping=6, hash_salt_path="../hash_salt/hash_salt")
+        fltr.insert("51.8989#-8.4825", 1)
+        self.builder.publish(fltr)
+
+        first = self.worker.view(hash_salt_path="../hash_salt/hash_salt")
+        second = self.worker.view(hash_salt_path="../hash_salt/hash_salt", hash_engine=first.hash_engine)
+        self.assertIsNot(first, second)
+        self.assertEqual(second.check("51.8989#-8.4825"), fltr.check("51.8989#-8.4825"))
+
+        first.clear_filter()
+        first.insert("51.8990#-8.4825", 2)
+        self.assertEqual(second.members, 1)
+        self.assertEqual(list(second.get_filter()), list(fltr.get_filter()))
+
+    def test_concurrent_workers(self):
+        # Spawned workers start from a clean interpreter, like the workers of a WSGI server
+        context = multiprocessing.get_context('spawn')
+        for publish_all in (False, True):
+            name = "{}_{}".format(self.name, int(publish_all))
+            start, finish = context.Barrier(4), context.Barrier(5)
+            results = context.Queue()
+            processes = [context.Process(target=_start_worker, args=(name, start, finish, results, publish_all))
+                         for _ in range(4)]
+            for process in processes:
+                process.start()
+            outcomes = [results.get(timeout=60) for _ in processes]
+            generation = SharedFilter(name).generation()
+            finish.wait()
+            for process in processes:
+                process.join(timeout=60)
+            # The workers share the resource tracker of this process, so the segments are removed here
+            for segment_name in [name] + ["{}_{}".format(name, g) for g in range(1, 5)]:
+                try:
+                    shared_memory.SharedMemory(name=segment_name).unlink()
+                except FileNotFoundError:
+                    pass
+
+            self.assertEqual(outcomes, [1] * 4)
+            self.assertEqual(generation, 4 if publish_all else 1)
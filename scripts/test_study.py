@@ -0,0 +1,43 @@
+from unittest import TestCase
+from scripts.sbf import sbf
+from scripts.study import available_hash_functions, hash_family_subsets, run_study, write_csv, write_json
+import csv
+import json
+import os
+import tempfile
+
+
+class TestStudy(TestCase):
+
+    def test_hash_family_subsets(self):
+        self.assertEqual(len(hash_family_subsets()), pow(2, len(available_hash_functions())) - 1)
+        self.assertIn('sha256', available_hash_functions())
+        self.assertEqual(hash_family_subsets(['md5', 'sha1', 'sha256'], sizes=[2]),
+                         [['md5', 'sha1'], ['md5', 'sha256'], ['sha1', 'sha256']])
+
+    def test_run_study(self):
+        families = hash_family_subsets(['md5', 'sha1', 'sha256'])
+        serial = run_study(["../dataset/cork.csv"], families, range(4, 12), hash_salt_path="../hash_salt/hash_salt")
+        parallel = run_study(["../dataset/cork.csv"], families, range(4, 12), hash_salt_path="../hash_salt/hash_salt",
+                             workers=2)
+        self.assertEqual(parallel, serial)
+        self.assertEqual(len(serial['fpp']), 7 * 8)
+
+        row = serial['hash_family'].index('md5+sha256') + 6
+        fltr = sbf(['md5', 'sha256'], 10, hash_salt_path="../hash_salt/hash_salt")
+        fltr.insert_from("../dataset/cork.csv")
+        self.assertEqual(serial['bit_mapping'][row], 10)
+        self.assertEqual(serial['collisions'][row], fltr.collisions)
+        self.assertEqual(serial['fpp'][row], fltr._filter_fpp())
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            write_csv(serial, os.path.join(tmp_dir, "study.csv"))
+            write_json(serial, os.path.join(tmp_dir, "study.json"))
+            with open(os.path.join(tmp_dir, "study.csv")) as results_file:
+                rows = list(csv.reader(results_file))
+            with open(os.path.join(tmp_dir, "study.json")) as results_file:
+                columns = json.load(results_file)
+
+        self.assertEqual(rows[0], list(serial.keys()))
+        self.assertEqual(len(rows), 7 * 8 + 1)
+        self.assertEqual(columns, serial)
@@ -0,0 +1,33 @@
+from unittest import TestCase
+from scripts.sbf import sbf
+from scripts.sweep import SizeSweep
+import numpy as np
+
+
+class TestSweep(TestCase):
+
+    def test_filters(self):
+        sweep = SizeSweep(['sha512', 'md5', 'sha1'], max_bit_mapping=20, hash_salt_path="../hash_salt/hash_salt")
+        sweep.insert_from("../dataset/cork.csv", chunk_size=1000)
+
+        for bit_mapping, fltr in sweep.filters([1, 3, 8, 9, 12, 16, 17, 20]):
+            built = sbf(['sha512', 'md5', 'sha1'], bit_mapping, hash_salt_path="../hash_salt/hash_salt")
+            built.insert_from("../dataset/cork.csv")
+            built.update_stats()
+
+            np.testing.assert_array_equal(np.asarray(fltr.get_filter()), np.asarray(built.get_filter()))
+            np.testing.assert_array_equal(fltr.grid_areas, built.grid_areas)
+            self.assertEqual(fltr.get_stats(), built.get_stats())
+            self.assertEqual(fltr.area_self_collisions, built.area_self_collisions)
+            self.assertEqual(fltr.check("51.8954#-8.4772"), built.check("51.8954#-8.4772"))
+
+    def test_stats(self):
+        sweep = SizeSweep(['md5', 'sha1'], max_bit_mapping=32, hash_salt_path="../hash_salt/hash_salt")
+        sweep.insert_from_file("../dataset/cork.csv")
+        stats = sweep.stats()
+
+        self.assertEqual(sorted(stats.keys()), list(range(1, 33)))
+        self.assertEqual(stats[32]["Number of Cells"], str(pow(2, 32)))
+        self.assertEqual(sweep.base.get_hash_timings()['md5'][0], len(sweep.areas))
+        with self.assertRaisesRegex(AttributeError, "Invalid bit mapping."):
+            SizeSweep(['md5'], max_bit_mapping=65, hash_salt_path="../hash_salt/hash_salt")
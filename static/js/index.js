@@ -1,4 +1,31 @@
 $(function() {
     $('.dropdown-button').dropdown();
     $('.button-collapse').sideNav();
-});
\ No newline at end of file
+
+    // Large filters are displayed a window of cells at a time: fetch the next window when scrolling near the end
+    var sbfTable = $('#sbfTable');
+    var loading = false;
+
+    $(window).on('scroll', function() {
+        var next = parseInt(sbfTable.data('next-offset'));
+        var total = parseInt(sbfTable.data('total'));
+        if (loading || isNaN(next) || next >= total) {
+            return;
+        }
+        if ($(window).scrollTop() + $(window).height() < sbfTable.offset().top + sbfTable.outerHeight() - 200) {
+            return;
+        }
+
+        loading = true;
+        $.getJSON(sbfTable.data('window-url'), {
+            offset: next,
+            limit: sbfTable.data('window-size'),
+            check: sbfTable.data('check')
+        }, function(data) {
+            sbfTable.append(data.html);
+            sbfTable.data('next-offset', data.next_offset);
+        }).always(function() {
+            loading = false;
+        });
+    });
+});